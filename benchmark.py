@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+端到端基准测试
+启动本地桩服务模拟 /v7/historical/weather（可配置延迟、错误率和429比例），
+用内存数据库替身（或SQLite、真实MySQL）驱动 get_today_weather_data + save_weather_data_to_db，
+输出机器可读的JSON：地区/分钟、行/秒、请求延迟p50/p99、峰值内存。
+运行时关闭响应缓存和本地写入暂存，限流固定为--rate-limit（--adaptive时使用自适应限流），
+不受运行环境中这些开关的影响，也不会在当前目录写入数据文件。
+
+用法：
+    python benchmark.py                                  # 默认 100,1000,3578 个地区
+    python benchmark.py --sizes 100 --latency-ms 50 --error-rate 0.01 --rate-limited 0.02
+    python benchmark.py --output logs/benchmark.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import tempfile
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from qweather_client import HISTORICAL_WEATHER_PATH, QWeatherClient
+from storage_backend import StorageBackend, create_storage_backend, set_storage_backend
+from weather_rows import build_daily_row, build_hourly_rows
+
+DEFAULT_SIZES = (100, 1000, 3578)
+
+# 子进程的环境变量：关闭会写本地文件或改变限流的功能，只测量获取和入库本身
+HERMETIC_ENV = {'FETCH_RATE_ADAPTIVE': '0', 'WRITE_SPOOL': '0', 'RESPONSE_CACHE': '0'}
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """桩服务请求处理：按配置注入延迟、5xx错误和429限流，其余返回24条小时数据和1条每日数据"""
+
+    protocol_version = "HTTP/1.1"  # 支持keep-alive，与真实API一致
+    disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免Nagle与延迟确认叠加出约40ms的假延迟
+
+    def do_GET(self):
+        config = self.server.config
+        parsed = urlparse(self.path)
+        if parsed.path != HISTORICAL_WEATHER_PATH:
+            self._send(200, {"code": "200"})
+            return
+
+        if config['latency_ms'] > 0:
+            time.sleep(config['latency_ms'] / 1000)
+        roll = self.server.random()
+        if roll < config['rate_limited']:
+            self._send(429, {"code": "429", "msg": "Too Many Requests"})
+            return
+        if roll < config['rate_limited'] + config['error_rate']:
+            self._send(500, {"code": "500", "msg": "Internal Server Error"})
+            return
+
+        query = parse_qs(parsed.query)
+        date_str = query.get('date', [''])[0]
+        self._send(200, build_stub_payload(date_str))
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def build_stub_payload(date_str):
+    """生成与和风天气历史天气接口结构一致的响应"""
+    day = datetime.strptime(date_str, '%Y%m%d') if date_str else datetime.now() - timedelta(days=1)
+    hourly = [{
+        "time": f"{day:%Y-%m-%d}T{hour:02d}:00+08:00",
+        "temp": str(20 + hour % 8),
+        "icon": "100",
+        "text": "晴" if hour % 3 else "多云",
+        "wind360": "90",
+        "windDir": "东风",
+        "windScale": "3",
+        "windSpeed": "12",
+        "humidity": str(50 + hour % 20),
+        "precip": "0.0",
+        "pressure": "1010"
+    } for hour in range(24)]
+    daily = {
+        "date": f"{day:%Y-%m-%d}",
+        "sunrise": "05:30", "sunset": "19:10",
+        "tempMax": "27", "tempMin": "20",
+        "humidity": "60", "precip": "0.0", "pressure": "1010"
+    }
+    return {"code": "200", "weatherDaily": daily, "weatherHourly": hourly}
+
+
+class StubQWeatherServer:
+    """在后台线程运行的本地桩服务
+
+    Args:
+        latency_ms: 每个请求的服务端延迟（毫秒）
+        error_rate: 返回500的比例
+        rate_limited: 返回429的比例
+        seed: 随机种子，保证多次运行的注入结果一致
+    """
+
+    def __init__(self, latency_ms=0, error_rate=0.0, rate_limited=0.0, seed=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubWeatherHandler)
+        self.server.daemon_threads = True
+        self.server.config = {'latency_ms': latency_ms, 'error_rate': error_rate, 'rate_limited': rate_limited}
+        rng = random.Random(seed)
+        rng_lock = threading.Lock()
+
+        def next_random():
+            with rng_lock:
+                return rng.random()
+        self.server.random = next_random
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TimedQWeatherClient(QWeatherClient):
+    """记录每次请求耗时的客户端"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self._latency_lock = threading.Lock()
+
+    def get_historical_weather(self, location_id, date_str, token=None, rate_limiter=None):
+        start = time.perf_counter()
+        try:
+            return super().get_historical_weather(location_id, date_str, token=token, rate_limiter=rate_limiter)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._latency_lock:
+                self.latencies.append(elapsed)
+
+
+class MemoryBackend(StorageBackend):
+    """内存数据库替身：按 (location_id, 时间) 做UPSERT，返回值与其他存储后端一致"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self.hourly = {}
+        self.daily = {}
+        self._lock = threading.Lock()
+
+    def init(self):
+        pass
+
+    def check(self):
+        pass
+
+    def save_locations_weather(self, items, csv_path=None, batch_size=None):
+        result = {'hourly_new': 0, 'hourly_updated': 0, 'hourly_failed': 0,
+                  'daily_new': 0, 'daily_updated': 0, 'daily_failed': 0, 'skipped': []}
+        with self._lock:
+            for location_id, location_name, hourly_data, daily_list in items:
+                for row in build_hourly_rows(hourly_data or [], location_id, location_name, '', ''):
+                    key = (location_id, row[4])
+                    result['hourly_new' if key not in self.hourly else 'hourly_updated'] += 1
+                    self.hourly[key] = row
+                for record in daily_list or []:
+                    row = build_daily_row(record, location_id, location_name, '', '')
+                    key = (location_id, row[4])
+                    result['daily_new' if key not in self.daily else 'daily_updated'] += 1
+                    self.daily[key] = row
+        return result
+
+    def get_complete_location_dates(self, start_date, end_date, hours_per_day=24):
+        return set()
+
+    def get_stats(self, location_name=None):
+        return {'total_hourly': len(self.hourly), 'total_daily': len(self.daily)}
+
+
+def create_benchmark_backend(db, tmp_dir):
+    """按--db参数创建存储后端：memory内存替身，sqlite临时目录中的数据库文件，mysql按DB_*环境变量"""
+    if db == 'memory':
+        return MemoryBackend()
+    if db == 'sqlite':
+        return create_storage_backend('sqlite', path=os.path.join(tmp_dir, "benchmark.db"))
+    return create_storage_backend('mysql')
+
+
+def percentile(values, fraction):
+    """最近秩法计算分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def make_locations(count, csv_path=None):
+    """生成基准测试用的地区列表；指定csv_path时同时写出对应的城市CSV，供后端查询省市信息"""
+    locations = [(f"9{index:08d}", f"基准地区{index}") for index in range(count)]
+    if csv_path:
+        with open(csv_path, 'w', encoding='utf-8') as f:
+            f.write("location_id,location_name,province,city\n")
+            for location_id, location_name in locations:
+                f.write(f"{location_id},{location_name},基准省,基准市\n")
+    return locations
+
+
+def run_benchmark(size, args):
+    """对size个地区跑一轮获取+保存，返回指标字典"""
+    # 延迟导入：主脚本模块名为中文，且只有实际运行时才需要
+    import importlib
+    daily = importlib.import_module('每日自动执行')
+
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(logging.WARNING)
+    if not logger.handlers:
+        logger.addHandler(logging.StreamHandler(sys.stderr))
+
+    with StubQWeatherServer(args.latency_ms, args.error_rate, args.rate_limited, args.seed) as server, \
+            tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, "locations.csv")
+        locations = make_locations(size, csv_path)
+        client = TimedQWeatherClient(pool_size=args.concurrency, base_url=server.base_url)
+        backend = create_benchmark_backend(args.db, tmp_dir)
+        previous = set_storage_backend(backend)
+        # 主脚本可能已按运行环境导入，直接覆盖模块级开关
+        overrides = {'CSV_PATH': csv_path, 'FETCH_RATE_ADAPTIVE': args.adaptive,
+                     'WRITE_SPOOL': False, 'RESPONSE_CACHE': False}
+        previous_values = {name: getattr(daily, name) for name in overrides}
+        for name, value in overrides.items():
+            setattr(daily, name, value)
+        try:
+            start = time.perf_counter()
+            result = daily.get_today_weather_data("benchmark-token", logger, concurrency=args.concurrency,
+                                                  rate_limit=args.rate_limit, client=client, locations=locations)
+            fetch_seconds = time.perf_counter() - start
+            hourly_data, daily_data, success_count = result[0] or [], result[1] or [], result[2]
+
+            save_start = time.perf_counter()
+            saved = daily.save_weather_data_to_db(hourly_data, daily_data, logger) if success_count else False
+            save_seconds = time.perf_counter() - save_start
+        finally:
+            for name, value in previous_values.items():
+                setattr(daily, name, value)
+            set_storage_backend(previous)
+            backend.close()
+            client.close()
+
+    total_seconds = fetch_seconds + save_seconds
+    rows = len(hourly_data) + len(daily_data)
+    latencies = client.latencies
+    return {
+        'locations': size,
+        'success_locations': success_count,
+        'failed_locations': size - success_count,
+        'requests': len(latencies),
+        'hourly_rows': len(hourly_data),
+        'daily_rows': len(daily_data),
+        'saved': bool(saved),
+        'fetch_seconds': round(fetch_seconds, 3),
+        'save_seconds': round(save_seconds, 3),
+        'total_seconds': round(total_seconds, 3),
+        'locations_per_minute': round(success_count / total_seconds * 60, 1) if total_seconds else None,
+        'rows_per_second': round(rows / total_seconds, 1) if total_seconds else None,
+        'save_rows_per_second': round(rows / save_seconds, 1) if save_seconds else None,
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': round(daily.get_peak_rss_mb() or 0, 1)
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="天气数据收集端到端基准测试")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="地区数量列表，逗号分隔")
+    parser.add_argument("--latency-ms", type=float, default=20, help="桩服务每个请求的延迟（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务返回500的比例")
+    parser.add_argument("--rate-limited", type=float, default=0.0, help="桩服务返回429的比例")
+    parser.add_argument("--seed", type=int, default=0, help="错误注入的随机种子")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv('FETCH_CONCURRENCY', '8')),
+                        help="并发请求数")
+    parser.add_argument("--rate-limit", type=float, default=1000, help="客户端每秒请求数上限")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="使用AIMD自适应限流（以--rate-limit为上限），默认固定速率")
+    parser.add_argument("--db", choices=["memory", "sqlite", "mysql"], default="memory",
+                        help="memory: 内存数据库替身；sqlite: 临时SQLite文件；mysql: 使用DB_*环境变量配置的真实数据库")
+    parser.add_argument("--output", default=None, help="结果JSON写入的文件，默认输出到标准输出")
+    parser.add_argument("--in-process", action="store_true",
+                        help="所有规模在同一进程中运行（默认每个规模单独起子进程，峰值内存互不影响）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+
+    results = []
+    for size in sizes:
+        if args.in_process or len(sizes) == 1:
+            results.append(run_benchmark(size, args))
+            continue
+        # 子进程只跑一个规模，结果写入临时文件（mysql模式下保存函数会向标准输出打印日志）
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            result_path = os.path.join(tmp_dir, "result.json")
+            command = [sys.executable, os.path.abspath(__file__), "--sizes", str(size),
+                       "--latency-ms", str(args.latency_ms), "--error-rate", str(args.error_rate),
+                       "--rate-limited", str(args.rate_limited), "--seed", str(args.seed),
+                       "--concurrency", str(args.concurrency), "--rate-limit", str(args.rate_limit),
+                       "--db", args.db, "--output", result_path] + (["--adaptive"] if args.adaptive else [])
+            env = dict(os.environ, **HERMETIC_ENV)
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL, env=env)
+            with open(result_path, encoding='utf-8') as f:
+                results.extend(json.load(f)['results'])
+
+    report = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'rate_limited': args.rate_limited,
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+            'rate_limit': args.rate_limit,
+            'adaptive': args.adaptive,
+            'db': args.db
+        },
+        'results': results
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+城市列表索引
+城市CSV只在首次使用（或文件被修改）时读取一次，之后按location_id在内存中查找
+"""
+
+import csv
+import os
+import threading
+
+# 全局缓存：CSV绝对路径 -> {'mtime': 修改时间, 'rows': 有效行列表, 'index': location_id索引}
+_location_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _read_location_csv(csv_path):
+    """读取城市CSV，返回 (有效行列表, location_id索引)"""
+    rows = []
+    index = {}
+    with open(csv_path, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            location_id = str(row.get('location_id') or '').strip()
+            entry = {
+                'location_id': location_id,
+                'location_name': str(row.get('location_name') or '').strip(),
+                'province': str(row.get('province') or '').strip(),
+                'city': str(row.get('city') or '').strip()
+            }
+
+            # 过滤掉注释行和无效行
+            if not location_id or location_id.startswith('#'):
+                continue
+            rows.append(entry)
+
+            # 同一location_id出现多次时，优先保留省市信息完整的第一行
+            existing = index.get(location_id)
+            if existing is None or (not (existing['province'] and existing['city'])
+                                    and entry['province'] and entry['city']):
+                index[location_id] = entry
+    return rows, index
+
+
+def _get_cache_entry(csv_path):
+    """获取CSV对应的缓存项，路径或文件修改时间变化时重新加载"""
+    path = os.path.abspath(csv_path)
+    mtime = os.path.getmtime(path)
+
+    entry = _location_cache.get(path)
+    if entry is not None and entry['mtime'] == mtime:
+        return entry
+
+    with _cache_lock:
+        entry = _location_cache.get(path)
+        if entry is None or entry['mtime'] != mtime:
+            rows, index = _read_location_csv(path)
+            entry = {'mtime': mtime, 'rows': rows, 'index': index}
+            _location_cache[path] = entry
+    return entry
+
+
+def load_location_rows(csv_path):
+    """返回CSV中的所有有效行（按文件顺序），每行为包含location_id/location_name/province/city的字典"""
+    return _get_cache_entry(csv_path)['rows']
+
+
+def load_location_index(csv_path):
+    """返回 location_id -> 行字典 的索引"""
+    return _get_cache_entry(csv_path)['index']
+
+
+def _candidate_paths(csv_path=None):
+    """按优先级返回可用的CSV路径：显式传入的路径，其次是环境变量CITY_CSV_PATH"""
+    paths = []
+    for path in (csv_path, os.getenv('CITY_CSV_PATH')):
+        if path and os.path.exists(path) and path not in paths:
+            paths.append(path)
+    return paths
+
+
+def lookup_locations(location_ids, csv_path=None):
+    """批量查询省市信息
+
+    Args:
+        location_ids: location_id的可迭代对象
+        csv_path: CSV文件路径，找不到时再尝试环境变量CITY_CSV_PATH
+
+    Returns:
+        dict: location_id -> {'province': ..., 'city': ...}，缺少省市信息的id不会出现在结果中
+    """
+    pending = {str(location_id).strip() for location_id in location_ids if location_id}
+    result = {}
+
+    for path in _candidate_paths(csv_path):
+        if not pending:
+            break
+        try:
+            index = load_location_index(path)
+        except Exception:
+            # 如果指定路径失败，继续尝试其他方式
+            continue
+        for location_id in list(pending):
+            entry = index.get(location_id)
+            if entry and entry['province'] and entry['city']:
+                result[location_id] = {'province': entry['province'], 'city': entry['city']}
+                pending.discard(location_id)
+
+    return result
+
+
+def clear_location_cache():
+    """清空索引缓存，下次查询时重新读取CSV"""
+    with _cache_lock:
+        _location_cache.clear()
@@ -5,15 +5,19 @@ MySQL数据库连接工具
 """
 
 import pymysql
-import pandas as pd
-from datetime import datetime
+from pymysql.constants import ER, SERVER_STATUS
+from datetime import datetime, timedelta
 import logging
-
-# 全局缓存变量
-_location_cache = {}
+import threading
+import time
+from contextlib import contextmanager
 
 import os
 
+from location_index import load_location_index, lookup_locations
+from run_metrics import get_metrics
+from weather_rows import DB_BATCH_SIZE, build_daily_row as _build_daily_row, build_hourly_rows as _build_hourly_rows
+
 # 从环境变量获取数据库配置
 DB_CONFIG = {
     'host': os.getenv('DB_HOST', 'localhost'),
@@ -24,8 +28,109 @@ DB_CONFIG = {
     'autocommit': True
 }
 
+# 连接池配置：最大连接数、连接最长复用时间（秒）、等待空闲连接的超时时间（秒）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '3600'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+
+# 统计模式：counters 读取计数表（精确，由写入方在同一事务中维护）；approx 读取information_schema估算值
+STATS_MODE = os.getenv('STATS_MODE', 'counters')
+
+# 分区配置：新建hourly_weather时是否按月RANGE分区，以及提前创建的月份数
+HOURLY_PARTITIONING = os.getenv('HOURLY_PARTITIONING', '0') == '1'
+PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', '3'))
+# 容纳第一个月分区之前的数据（新建分区表后回溯写入的历史数据）的分区
+HISTORY_PARTITION = 'p_history'
+
+# 小时数据存储格式：wide 每行保存地区名称和文字字段；compact 事实表只保存location_id和字典编码，
+# 地区信息放在locations维表，hourly_weather变为还原原有列的兼容视图
+HOURLY_LAYOUT = os.getenv('HOURLY_LAYOUT', 'wide')
+COMPACT_HOURLY_TABLE = 'hourly_weather_compact'
+
+# 只有这些与数据本身有关的错误才二分拆批隔离到单行；连接断开、锁等待超时等操作性错误
+# 拆批也不会成功，直接抛出，由调用方保留数据（如本地暂存区）等待重试
+ROW_DATA_ERRORS = (pymysql.err.DataError, pymysql.err.IntegrityError, pymysql.err.ProgrammingError)
+
+# 写入时加锁读取已存在的行，并发写入相同键的事务可能互相死锁，被InnoDB回滚的一方整批重试的次数
+DB_DEADLOCK_RETRIES = int(os.getenv('DB_DEADLOCK_RETRIES', '3'))
+
+# 小时数据UPSERT语句，executemany会将其改写为多行VALUES
+HOURLY_UPSERT_SQL = """
+INSERT INTO hourly_weather 
+(location_id, location_name, province, city, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa, 
+ wind_scale, wind_dir, text)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+location_name = VALUES(location_name),
+province = VALUES(province),
+city = VALUES(city),
+temp_celsius = VALUES(temp_celsius),
+humidity_percent = VALUES(humidity_percent),
+precip_mm = VALUES(precip_mm),
+pressure_hpa = VALUES(pressure_hpa),
+wind_scale = VALUES(wind_scale),
+wind_dir = VALUES(wind_dir),
+text = VALUES(text)
+"""
+
+# 紧凑格式的小时数据UPSERT语句，风力等级、风向、天气现象为weather_codes中的编码
+COMPACT_HOURLY_UPSERT_SQL = f"""
+INSERT INTO {COMPACT_HOURLY_TABLE}
+(location_id, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa,
+ wind_scale_code, wind_dir_code, text_code)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+temp_celsius = VALUES(temp_celsius),
+humidity_percent = VALUES(humidity_percent),
+precip_mm = VALUES(precip_mm),
+pressure_hpa = VALUES(pressure_hpa),
+wind_scale_code = VALUES(wind_scale_code),
+wind_dir_code = VALUES(wind_dir_code),
+text_code = VALUES(text_code)
+"""
+
+# 地区维表UPSERT语句
+LOCATION_UPSERT_SQL = """
+INSERT INTO locations (location_id, location_name, province, city)
+VALUES (%s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+location_name = VALUES(location_name),
+province = VALUES(province),
+city = VALUES(city)
+"""
+
+# 紧凑格式下需要字典编码的列：(weather_codes中的类别, 小时数据行中的下标)
+CODED_HOURLY_COLUMNS = (('wind_scale', 9), ('wind_dir', 10), ('text', 11))
+
+# 计数表增量更新语句（与数据写入在同一事务内执行）
+ROW_COUNT_UPSERT_SQL = """
+INSERT INTO weather_row_counts (table_name, location_id, date, location_name, province, row_count)
+VALUES (%s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+location_name = VALUES(location_name),
+province = VALUES(province),
+row_count = row_count + VALUES(row_count)
+"""
+
+# 每日数据UPSERT语句（直接使用API的weatherDaily字段）
+DAILY_UPSERT_SQL = """
+INSERT INTO daily_weather 
+(location_id, location_name, province, city, date, temp_min_celsius, 
+ temp_max_celsius, humidity_percent, precip_mm, pressure_hpa)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+location_name = VALUES(location_name),
+province = VALUES(province),
+city = VALUES(city),
+temp_min_celsius = VALUES(temp_min_celsius),
+temp_max_celsius = VALUES(temp_max_celsius),
+humidity_percent = VALUES(humidity_percent),
+precip_mm = VALUES(precip_mm),
+pressure_hpa = VALUES(pressure_hpa)
+"""
+
 def get_mysql_connection():
-    """获取MySQL数据库连接"""
+    """获取MySQL数据库连接（新建连接，调用方负责关闭；批量任务请使用连接池）"""
     try:
         connection = pymysql.connect(**DB_CONFIG)
         return connection
@@ -33,10 +138,147 @@ def get_mysql_connection():
         logging.error(f"数据库连接失败: {e}")
         raise
 
+class MySQLConnectionPool:
+    """线程安全的MySQL连接池
+
+    - 借出时先ping检查连接是否可用，不可用则重新建立
+    - 连接创建超过recycle秒后不再复用，关闭后重建
+    - 连接总数不超过size，全部借出时阻塞等待，有连接归还或被丢弃时唤醒
+
+    Args:
+        size: 最大连接数
+        recycle: 连接最长复用时间（秒），<=0表示不限制
+        timeout: 等待空闲连接的超时时间（秒）
+        connect: 建立新连接的函数，默认使用get_mysql_connection
+    """
+
+    def __init__(self, size=None, recycle=None, timeout=None, connect=None):
+        self.size = max(1, int(size or DB_POOL_SIZE))
+        self.recycle = DB_POOL_RECYCLE if recycle is None else recycle
+        self.timeout = DB_POOL_TIMEOUT if timeout is None else timeout
+        self._connect = connect or get_mysql_connection
+        self._idle = []  # 后进先出，优先复用最近用过的热连接
+        self._created_at = {}
+        self._count = 0
+        # 同一个条件变量保护_idle和_count：归还连接或丢弃连接（腾出名额）时都唤醒等待者
+        self._cond = threading.Condition()
+
+    def _new_connection(self):
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            if self._created_at.pop(id(conn), None) is not None:
+                self._count -= 1
+                self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, conn):
+        created_at = self._created_at.get(id(conn))
+        return self.recycle > 0 and created_at is not None and time.monotonic() - created_at > self.recycle
+
+    def _take(self):
+        """等待空闲连接或空余名额：返回空闲连接；返回None表示已在锁内占好名额，由调用方新建连接"""
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._count < self.size:
+                    self._count += 1  # 先在锁内占位，避免并发时创建超过size个连接
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"等待数据库连接超时（{self.timeout}秒，连接池大小{self.size}）")
+                self._cond.wait(remaining)
+
+    def acquire(self):
+        """借出一个可用连接"""
+        while True:
+            conn = self._take()
+            if conn is None:
+                return self._new_connection()
+            if self._is_expired(conn):
+                self._discard(conn)
+                continue
+            try:
+                conn.ping(reconnect=False)
+                return conn
+            except Exception:
+                self._discard(conn)
+
+    def release(self, conn):
+        """归还连接，未结束的事务会被回滚，已断开的连接直接丢弃"""
+        try:
+            if conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        if not conn.open or self._is_expired(conn):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器方式借用连接，退出时自动归还"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close_all(self):
+        """关闭所有空闲连接（借出中的连接在归还时照常处理）"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """获取进程内共享的连接池（懒加载）"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = MySQLConnectionPool()
+        return _pool
+
+def acquire_mysql_connection():
+    """从共享连接池借出连接，用完后调用release_mysql_connection归还"""
+    return get_connection_pool().acquire()
+
+def release_mysql_connection(conn):
+    """把连接归还共享连接池"""
+    get_connection_pool().release(conn)
+
+@contextmanager
+def mysql_connection():
+    """从共享连接池借用连接的上下文管理器：with mysql_connection() as conn: ..."""
+    with get_connection_pool().connection() as conn:
+        yield conn
+
 def init_mysql_database():
     """初始化MySQL数据库表结构"""
     try:
-        conn = get_mysql_connection()
+        conn = acquire_mysql_connection()
         cursor = conn.cursor()
         
         # 创建统一的小时天气数据表
@@ -91,8 +333,45 @@ def init_mysql_database():
             "CREATE INDEX IF NOT EXISTS idx_daily_location_name ON daily_weather(location_name)"
         ]
         
-        cursor.execute(create_hourly_table)
+        # 按 (表, 地区, 日期) 维护的行数计数表，统计查询不再扫描事实表
+        create_row_counts_table = """
+        CREATE TABLE IF NOT EXISTS weather_row_counts (
+            table_name VARCHAR(20) NOT NULL COMMENT 'hourly或daily',
+            location_id VARCHAR(20) NOT NULL,
+            date DATE NOT NULL,
+            location_name VARCHAR(50),
+            province VARCHAR(50),
+            row_count INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (table_name, location_id, date),
+            KEY idx_row_counts_date (table_name, date),
+            KEY idx_row_counts_province (table_name, province),
+            KEY idx_row_counts_location_name (table_name, location_name)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+        """
+        
+        if HOURLY_LAYOUT == 'compact':
+            _create_compact_hourly_tables(cursor)
+        else:
+            if _table_type(cursor, 'hourly_weather') == 'VIEW':
+                raise ValueError("hourly_weather已是紧凑格式的兼容视图，请设置环境变量 HOURLY_LAYOUT=compact")
+            if HOURLY_PARTITIONING and not _table_exists(cursor, 'hourly_weather'):
+                current_month = _month_start(datetime.now().date())
+                create_hourly_table = _partitioned_hourly_ddl(
+                    'hourly_weather', current_month, _add_months(current_month, PARTITION_MONTHS_AHEAD)
+                )
+            cursor.execute(create_hourly_table)
+        
         cursor.execute(create_daily_table)
+        cursor.execute(create_row_counts_table)
+        
+        partitioned = _is_hourly_partitioned(cursor)
+        if HOURLY_LAYOUT == 'compact':
+            # 紧凑事实表的索引已在建表语句中定义，hourly_weather是视图，不能建索引
+            create_indexes = [sql for sql in create_indexes if ' ON hourly_weather' not in sql]
+        elif partitioned:
+            # 分区表的主键已是(location_id, datetime)，只保留datetime二级索引，减少索引维护
+            create_indexes = [sql for sql in create_indexes
+                              if ' ON hourly_weather' not in sql or 'idx_hourly_datetime ' in sql]
         
         for index_sql in create_indexes:
             try:
@@ -102,6 +381,17 @@ def init_mysql_database():
                 pass
         
         conn.commit()
+        
+        if partitioned:
+            _ensure_hourly_partitions(cursor, PARTITION_MONTHS_AHEAD)
+        
+        # 计数表为空但已有历史数据时（首次升级），做一次性的全量统计
+        cursor.execute("SELECT EXISTS(SELECT 1 FROM weather_row_counts), EXISTS(SELECT 1 FROM hourly_weather)")
+        has_counts, has_hourly = cursor.fetchone()
+        if has_hourly and not has_counts:
+            print("🧮 首次初始化计数表，统计已有数据...")
+            _rebuild_row_counts(conn)
+        
         print("✅ MySQL数据库表结构初始化完成（统一表结构）")
         
     except Exception as e:
@@ -109,130 +399,947 @@ def init_mysql_database():
         raise
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_mysql_connection(conn)
+
+def _create_compact_hourly_tables(cursor):
+    """创建紧凑格式所需的地区维表、字典表、事实表和兼容视图"""
+    if _table_type(cursor, 'hourly_weather') == 'BASE TABLE':
+        raise ValueError("hourly_weather仍是宽表，请先执行 layout migrate 迁移为紧凑格式")
+    cursor.execute(LOCATIONS_DDL)
+    cursor.execute(WEATHER_CODES_DDL)
+    if HOURLY_PARTITIONING and not _table_exists(cursor, COMPACT_HOURLY_TABLE):
+        current_month = _month_start(datetime.now().date())
+        cursor.execute(_compact_hourly_ddl(COMPACT_HOURLY_TABLE, current_month,
+                                           _add_months(current_month, PARTITION_MONTHS_AHEAD)))
+    else:
+        cursor.execute(_compact_hourly_ddl(COMPACT_HOURLY_TABLE))
+    if not _column_exists(cursor, COMPACT_HOURLY_TABLE, 'id'):
+        # 早期版本创建的紧凑事实表没有id列，补上后兼容视图才能提供原有的id
+        print(f"🔧 为 {COMPACT_HOURLY_TABLE} 添加自增id列（需要重建表，数据量大时耗时较长）...")
+        cursor.execute(f"ALTER TABLE {COMPACT_HOURLY_TABLE} "
+                       f"ADD COLUMN id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT FIRST, ADD KEY idx_hourly_id (id)")
+    cursor.execute(COMPACT_HOURLY_VIEW_SQL)
+
+def _table_type(cursor, table_name):
+    """返回表类型（'BASE TABLE'或'VIEW'），不存在时返回None"""
+    cursor.execute(
+        "SELECT TABLE_TYPE FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+        (table_name,)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _table_exists(cursor, table_name):
+    return _table_type(cursor, table_name) is not None
+
+def _column_exists(cursor, table_name, column_name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+        "AND COLUMN_NAME = %s",
+        (table_name, column_name)
+    )
+    return cursor.fetchone() is not None
+
+def _month_start(day):
+    return day.replace(day=1)
+
+def _add_months(month, count):
+    """给月初日期加减若干个月"""
+    index = month.year * 12 + month.month - 1 + count
+    return month.replace(year=index // 12, month=index % 12 + 1, day=1)
+
+def _partition_name(month):
+    return f"p{month:%Y%m}"
+
+def _month_partition_clause(month):
+    return f"PARTITION {_partition_name(month)} VALUES LESS THAN ('{_add_months(month, 1):%Y-%m-%d}')"
+
+def _hourly_partition_sql(first_month, last_month):
+    """按月RANGE分区子句：p_history容纳first_month之前的数据，p_future兜底容纳尚未预建分区的月份
+    
+    没有p_history时回溯写入的历史数据都会落入第一个月分区，无法按月清理。
+    """
+    partitions = [f"PARTITION {HISTORY_PARTITION} VALUES LESS THAN ('{first_month:%Y-%m-%d}')"]
+    month = first_month
+    while month <= last_month:
+        partitions.append(_month_partition_clause(month))
+        month = _add_months(month, 1)
+    partitions.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+    partition_sql = ",\n            ".join(partitions)
+    return f"""PARTITION BY RANGE COLUMNS(datetime) (
+            {partition_sql}
+        )"""
+
+def _partitioned_hourly_ddl(table_name, first_month, last_month):
+    """按月RANGE分区的小时数据表DDL
+    
+    分区表的唯一键必须包含分区列，因此以(location_id, datetime)作主键，不再使用自增id。
+    """
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            location_id VARCHAR(20) NOT NULL,
+            location_name VARCHAR(50),
+            province VARCHAR(50),
+            city VARCHAR(50),
+            datetime DATETIME NOT NULL,
+            temp_celsius DECIMAL(4,1),
+            humidity_percent DECIMAL(4,1),
+            precip_mm DECIMAL(6,2),
+            pressure_hpa DECIMAL(6,1),
+            wind_scale VARCHAR(5),
+            wind_dir VARCHAR(10),
+            text VARCHAR(20),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (location_id, datetime),
+            KEY idx_hourly_datetime (datetime)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci 
+        STATS_SAMPLE_PAGES=100 STATS_AUTO_RECALC=1
+        {_hourly_partition_sql(first_month, last_month)}
+        """
+
+def _compact_hourly_ddl(table_name, first_month=None, last_month=None):
+    """紧凑格式的小时数据表DDL
+    
+    不保存地区名称和文字列，风力等级、风向、天气现象存为weather_codes中的SMALLINT编码；
+    以(location_id, datetime)作聚簇主键，同一地区的连续小时数据落在相邻的页中。
+    保留原表的自增id供兼容视图使用（分区表的唯一键必须包含分区列，所以只建普通索引）。
+    指定月份范围时按月RANGE分区。
+    """
+    partition_sql = _hourly_partition_sql(first_month, last_month) if first_month else ""
+    return f"""
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+            location_id VARCHAR(20) NOT NULL,
+            datetime DATETIME NOT NULL,
+            temp_celsius DECIMAL(4,1),
+            humidity_percent DECIMAL(4,1),
+            precip_mm DECIMAL(6,2),
+            pressure_hpa DECIMAL(6,1),
+            wind_scale_code SMALLINT UNSIGNED,
+            wind_dir_code SMALLINT UNSIGNED,
+            text_code SMALLINT UNSIGNED,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (location_id, datetime),
+            KEY idx_hourly_datetime (datetime),
+            KEY idx_hourly_id (id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci 
+        STATS_SAMPLE_PAGES=100 STATS_AUTO_RECALC=1
+        {partition_sql}
+        """
+
+def hourly_storage_table():
+    """实际保存小时数据的表：宽表格式为hourly_weather，紧凑格式为hourly_weather_compact"""
+    return COMPACT_HOURLY_TABLE if HOURLY_LAYOUT == 'compact' else 'hourly_weather'
+
+def _hourly_storage_ddl(table_name, first_month, last_month):
+    if HOURLY_LAYOUT == 'compact':
+        return _compact_hourly_ddl(table_name, first_month, last_month)
+    return _partitioned_hourly_ddl(table_name, first_month, last_month)
+
+# 地区维表：由城市CSV和写入方维护，紧凑格式的事实表只保存location_id
+LOCATIONS_DDL = """
+CREATE TABLE IF NOT EXISTS locations (
+    location_id VARCHAR(20) NOT NULL PRIMARY KEY,
+    location_name VARCHAR(50),
+    province VARCHAR(50) COMMENT '省份',
+    city VARCHAR(50) COMMENT '城市',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    KEY idx_locations_name (location_name),
+    KEY idx_locations_province (province)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+"""
+
+# 字典表：风力等级、风向、天气现象的文本 <-> 编码
+WEATHER_CODES_DDL = """
+CREATE TABLE IF NOT EXISTS weather_codes (
+    code SMALLINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+    category VARCHAR(20) NOT NULL COMMENT 'wind_scale/wind_dir/text',
+    value VARCHAR(20) NOT NULL,
+    UNIQUE KEY unique_category_value (category, value)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_bin
+"""
+
+# 兼容视图：按原hourly_weather的列（含自增id）还原紧凑格式的数据，读取方无需修改
+COMPACT_HOURLY_VIEW_SQL = f"""
+CREATE OR REPLACE VIEW hourly_weather AS
+SELECT
+    h.id,
+    h.location_id,
+    l.location_name,
+    l.province,
+    l.city,
+    h.datetime,
+    h.temp_celsius,
+    h.humidity_percent,
+    h.precip_mm,
+    h.pressure_hpa,
+    ws.value AS wind_scale,
+    wd.value AS wind_dir,
+    tx.value AS text,
+    h.created_at
+FROM {COMPACT_HOURLY_TABLE} h
+LEFT JOIN locations l ON l.location_id = h.location_id
+LEFT JOIN weather_codes ws ON ws.code = h.wind_scale_code
+LEFT JOIN weather_codes wd ON wd.code = h.wind_dir_code
+LEFT JOIN weather_codes tx ON tx.code = h.text_code
+"""
+
+def _get_partition_names(cursor, table_name=None):
+    table_name = table_name or hourly_storage_table()
+    cursor.execute(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+        "ORDER BY PARTITION_ORDINAL_POSITION",
+        (table_name,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def _is_hourly_partitioned(cursor):
+    return bool(_get_partition_names(cursor))
+
+def _partition_months(partition_names):
+    """从分区名(pYYYYMM)解析出月份列表"""
+    months = []
+    for name in partition_names:
+        try:
+            months.append(datetime.strptime(name, 'p%Y%m').date())
+        except ValueError:
+            continue
+    return months
+
+def _ensure_hourly_partitions(cursor, months_ahead):
+    """预建到"当前月 + months_ahead"为止的月分区，拆分的是空的p_future分区，只改元数据"""
+    months = _partition_months(_get_partition_names(cursor))
+    if not months:
+        return []
+    target = _add_months(_month_start(datetime.now().date()), months_ahead)
+    month = _add_months(max(months), 1)
+    new_months = []
+    while month <= target:
+        new_months.append(month)
+        month = _add_months(month, 1)
+    if new_months:
+        clauses = [_month_partition_clause(month) for month in new_months]
+        clauses.append("PARTITION p_future VALUES LESS THAN (MAXVALUE)")
+        cursor.execute(f"ALTER TABLE {hourly_storage_table()} REORGANIZE PARTITION p_future "
+                       f"INTO ({', '.join(clauses)})")
+        print(f"✅ 已预建分区: {', '.join(_partition_name(month) for month in new_months)}")
+    return new_months
+
+def ensure_hourly_partitions(months_ahead=None):
+    """为分区表预建未来月份的分区（init_mysql_database每次运行都会调用）"""
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if not _is_hourly_partitioned(cursor):
+                raise ValueError(f"{hourly_storage_table()}不是分区表，请先执行分区迁移")
+            return _ensure_hourly_partitions(cursor, months_ahead)
+        finally:
+            cursor.close()
+
+def list_hourly_partitions():
+    """列出小时数据表的分区及其估算行数"""
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                "SELECT PARTITION_NAME, PARTITION_DESCRIPTION, TABLE_ROWS FROM information_schema.PARTITIONS "
+                "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL "
+                "ORDER BY PARTITION_ORDINAL_POSITION",
+                (hourly_storage_table(),)
+            )
+            return [{'name': name, 'less_than': bound, 'rows': int(rows or 0)}
+                    for name, bound, rows in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+def migrate_hourly_to_partitioned(months_ahead=None, chunk_days=7):
+    """把现有的单表hourly_weather迁移为按月分区表（紧凑格式时迁移hourly_weather_compact）
+    
+    先建好分区新表，再按日期分块复制数据（每块一条INSERT ... SELECT，走datetime索引），
+    最后原子地RENAME交换，旧表保留为<表名>_old，确认无误后可手动删除。
+    迁移期间请暂停收集任务，避免复制完成后到交换前的写入丢失。
+    
+    Returns:
+        bool: 执行了迁移返回True，已经是分区表返回False
+    """
+    months_ahead = PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    table = hourly_storage_table()
+    if HOURLY_LAYOUT == 'compact':
+        columns = ("location_id, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa, "
+                   "wind_scale_code, wind_dir_code, text_code, created_at")
+    else:
+        columns = ("location_id, location_name, province, city, datetime, temp_celsius, humidity_percent, "
+                   "precip_mm, pressure_hpa, wind_scale, wind_dir, text, created_at")
+    
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            if _is_hourly_partitioned(cursor):
+                print(f"✅ {table}已经是分区表，无需迁移")
+                return False
+            
+            cursor.execute(f"SELECT MIN(datetime), MAX(datetime) FROM {table}")
+            first, last = cursor.fetchone()
+            today = datetime.now().date()
+            first_month = _month_start(first.date() if first else today)
+            last_month = _add_months(_month_start(max(last.date(), today) if last else today), months_ahead)
+            
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_new")
+            cursor.execute(_hourly_storage_ddl(f"{table}_new", first_month, last_month))
+            print(f"✅ 已创建分区表 {table}_new（{_partition_name(first_month)} ~ {_partition_name(last_month)}）")
+            
+            if first is not None:
+                day = first.date()
+                copied = 0
+                while day <= last.date():
+                    chunk_end = day + timedelta(days=chunk_days)
+                    cursor.execute(
+                        f"INSERT IGNORE INTO {table}_new ({columns}) "
+                        f"SELECT {columns} FROM {table} WHERE datetime >= %s AND datetime < %s",
+                        (day.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d'))
+                    )
+                    conn.commit()
+                    copied += cursor.rowcount
+                    print(f"📦 已复制至 {min(chunk_end - timedelta(days=1), last.date())}，累计{copied}条")
+                    day = chunk_end
+            
+            cursor.execute(f"DROP TABLE IF EXISTS {table}_old")
+            cursor.execute(f"RENAME TABLE {table} TO {table}_old, {table}_new TO {table}")
+            print(f"✅ 分区迁移完成，原表已重命名为 {table}_old")
+            return True
+        finally:
+            cursor.close()
+
+def drop_hourly_partitions_before(keep_months, archive=False):
+    """按分区清理过期的小时数据：保留最近keep_months个月（含当月），更早的分区整块清理
+    
+    DROP/TRUNCATE PARTITION只改元数据，不像逐行DELETE那样产生大量undo和索引维护。
+    archive=True时先用EXCHANGE PARTITION把分区数据换到独立的归档表
+    <表名>_archive_YYYYMM（p_history换到<表名>_archive_before_YYYYMM，同样只改元数据）。
+    有p_history的表把清空后的过期分区合并进p_history（空分区的REORGANIZE不复制数据），
+    p_history的上界推进到清理边界，之后回溯写入的过期数据仍然落在p_history，随下次清理一并删除；
+    p_history与第一个过期的月分区一起清理。
+    
+    Returns:
+        list: 清理的分区名
+    """
+    if keep_months < 1:
+        raise ValueError("keep_months至少为1")
+    cutoff = _add_months(_month_start(datetime.now().date()), -(keep_months - 1))
+    table = hourly_storage_table()
+    
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            names = _get_partition_names(cursor)
+            if not names:
+                raise ValueError(f"{table}不是分区表，请先执行分区迁移")
+            monthly = [(name, month) for name in names
+                       for month in _partition_months([name])]
+            expired = [(name, month) for name, month in monthly if _add_months(month, 1) <= cutoff]
+            if not expired:
+                print(f"✅ 没有早于 {cutoff} 的分区需要清理")
+                return []
+            has_history = HISTORY_PARTITION in names
+            bound = _add_months(expired[-1][1], 1)
+            cleared = [name for name, _ in expired]
+            archive_names = {name: name[1:] for name in cleared}
+            if has_history:
+                cleared.insert(0, HISTORY_PARTITION)
+                archive_names[HISTORY_PARTITION] = f"before_{monthly[0][1]:%Y%m}"
+            
+            if archive:
+                for name in cleared:
+                    archive_table = f"{table}_archive_{archive_names[name]}"
+                    created = not _table_exists(cursor, archive_table)
+                    cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive_table} LIKE {table}")
+                    if created:
+                        # 只对刚建的归档表去掉分区，已存在（重复执行）的归档表本来就不是分区表
+                        cursor.execute(f"ALTER TABLE {archive_table} REMOVE PARTITIONING")
+                    else:
+                        cursor.execute(f"SELECT EXISTS(SELECT 1 FROM {archive_table})")
+                        if cursor.fetchone()[0]:
+                            # 上次执行在交换后中断，再次交换会把归档数据换回分区
+                            print(f"📦 {archive_table} 已有归档数据，跳过分区 {name} 的交换")
+                            continue
+                    cursor.execute(f"ALTER TABLE {table} EXCHANGE PARTITION {name} WITH TABLE {archive_table}")
+                    print(f"📦 分区 {name} 已归档到 {archive_table}")
+            
+            if has_history:
+                if not archive:
+                    cursor.execute(f"ALTER TABLE {table} TRUNCATE PARTITION {', '.join(cleared)}")
+                cursor.execute(
+                    f"ALTER TABLE {table} REORGANIZE PARTITION {', '.join(cleared)} INTO "
+                    f"(PARTITION {HISTORY_PARTITION} VALUES LESS THAN ('{bound:%Y-%m-%d}'))"
+                )
+            else:
+                # 旧版本创建的分区表没有p_history，直接删除过期分区
+                cursor.execute(f"ALTER TABLE {table} DROP PARTITION {', '.join(cleared)}")
+            cursor.execute("DELETE FROM weather_row_counts WHERE table_name = 'hourly' AND date < %s",
+                           (bound.strftime('%Y-%m-%d'),))
+            conn.commit()
+            _notify_write('hourly', None)
+            print(f"✅ 已清理分区: {', '.join(cleared)}")
+            return cleared
+        finally:
+            cursor.close()
+
+def migrate_hourly_to_compact(chunk_days=7, csv_path=None):
+    """把宽表hourly_weather迁移为紧凑格式
+    
+    1. 创建locations维表和weather_codes字典表，用城市CSV和现有数据填充
+    2. 创建hourly_weather_compact（原表是分区表时按相同的月份范围分区），按日期分块复制并编码；
+       原表有自增id时原样保留，读取方按id查询或排序的结果不变（分区宽表没有id，复制时重新生成）
+    3. 原表重命名为hourly_weather_wide_old，创建同名兼容视图hourly_weather
+    
+    迁移完成后请设置 HOURLY_LAYOUT=compact；迁移期间请暂停收集任务。
+    
+    Returns:
+        bool: 执行了迁移返回True，已经是紧凑格式返回False
+    """
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            table_type = _table_type(cursor, 'hourly_weather')
+            if table_type == 'VIEW':
+                print("✅ hourly_weather已经是紧凑格式的兼容视图，无需迁移")
+                return False
+            if table_type is None:
+                raise ValueError("hourly_weather不存在，请直接设置 HOURLY_LAYOUT=compact 后初始化数据库")
+            
+            cursor.execute(LOCATIONS_DDL)
+            cursor.execute(WEATHER_CODES_DDL)
+            cursor.execute("""
+            INSERT INTO locations (location_id, location_name, province, city)
+            SELECT location_id, MAX(location_name), MAX(province), MAX(city)
+            FROM hourly_weather
+            GROUP BY location_id
+            ON DUPLICATE KEY UPDATE location_id = location_id
+            """)
+            for category, column in (('wind_scale', 'wind_scale'), ('wind_dir', 'wind_dir'), ('text', 'text')):
+                cursor.execute(
+                    f"INSERT IGNORE INTO weather_codes (category, value) "
+                    f"SELECT DISTINCT %s, {column} FROM hourly_weather WHERE {column} IS NOT NULL",
+                    (category,)
+                )
+            conn.commit()
+            _load_weather_codes(cursor)
+            print(f"✅ 地区维表和字典表已填充（字典项{len(_weather_codes)}个）")
+            
+            cursor.execute("SELECT MIN(datetime), MAX(datetime) FROM hourly_weather")
+            first, last = cursor.fetchone()
+            first_month = last_month = None
+            source_months = _partition_months(_get_partition_names(cursor, 'hourly_weather'))
+            if source_months:
+                first_month, last_month = min(source_months), max(source_months)
+            cursor.execute(f"DROP TABLE IF EXISTS {COMPACT_HOURLY_TABLE}")
+            cursor.execute(_compact_hourly_ddl(COMPACT_HOURLY_TABLE, first_month, last_month))
+            print(f"✅ 已创建紧凑事实表 {COMPACT_HOURLY_TABLE}")
+            
+            if first is not None:
+                id_column, id_value = ("id, ", "h.id, ") if _column_exists(cursor, 'hourly_weather', 'id') else ("", "")
+                day = first.date()
+                copied = 0
+                while day <= last.date():
+                    chunk_end = day + timedelta(days=chunk_days)
+                    cursor.execute(f"""
+                    INSERT IGNORE INTO {COMPACT_HOURLY_TABLE}
+                    ({id_column}location_id, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa,
+                     wind_scale_code, wind_dir_code, text_code, created_at)
+                    SELECT {id_value}h.location_id, h.datetime, h.temp_celsius, h.humidity_percent, h.precip_mm,
+                           h.pressure_hpa, ws.code, wd.code, tx.code, h.created_at
+                    FROM hourly_weather h
+                    LEFT JOIN weather_codes ws ON ws.category = 'wind_scale' AND ws.value = h.wind_scale
+                    LEFT JOIN weather_codes wd ON wd.category = 'wind_dir' AND wd.value = h.wind_dir
+                    LEFT JOIN weather_codes tx ON tx.category = 'text' AND tx.value = h.text
+                    WHERE h.datetime >= %s AND h.datetime < %s
+                    """, (day.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d')))
+                    conn.commit()
+                    copied += cursor.rowcount
+                    print(f"📦 已复制至 {min(chunk_end - timedelta(days=1), last.date())}，累计{copied}条")
+                    day = chunk_end
+            
+            cursor.execute("DROP TABLE IF EXISTS hourly_weather_wide_old")
+            cursor.execute("RENAME TABLE hourly_weather TO hourly_weather_wide_old")
+            cursor.execute(COMPACT_HOURLY_VIEW_SQL)
+            print("✅ 紧凑格式迁移完成，原表已重命名为 hourly_weather_wide_old，请设置 HOURLY_LAYOUT=compact")
+        finally:
+            cursor.close()
+    
+    if csv_path or os.getenv('CITY_CSV_PATH'):
+        sync_locations_from_csv(csv_path)
+    return True
+
+def sync_locations_from_csv(csv_path=None, batch_size=None):
+    """把城市CSV中的地区写入locations维表（按location_id UPSERT）
+    
+    Args:
+        csv_path: 城市CSV路径，默认使用环境变量CITY_CSV_PATH
+        batch_size: 每批行数，默认使用DB_BATCH_SIZE
+    
+    Returns:
+        int: 写入的地区数
+    """
+    csv_path = csv_path or os.getenv('CITY_CSV_PATH')
+    if not csv_path or not os.path.exists(csv_path):
+        raise ValueError("未找到城市CSV，请通过 csv_path 参数或环境变量 CITY_CSV_PATH 指定")
+    
+    rows = [(entry['location_id'], entry['location_name'], entry['province'], entry['city'])
+            for entry in load_location_index(csv_path).values()]
+    batch_size = max(1, int(batch_size or DB_BATCH_SIZE))
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(LOCATIONS_DDL)
+            for start in range(0, len(rows), batch_size):
+                cursor.executemany(LOCATION_UPSERT_SQL, rows[start:start + batch_size])
+        finally:
+            cursor.close()
+    with _dimension_lock:
+        _known_locations.update({row[0]: row[1:] for row in rows})
+    print(f"✅ 地区维表已同步: {len(rows)}个地区（{csv_path}）")
+    return len(rows)
+
+# 进程内的字典编码和地区维表缓存，紧凑格式写入时用来避免重复查询
+_weather_codes = {}    # (类别, 文本) -> 编码
+_known_locations = {}  # location_id -> (location_name, province, city)
+_dimension_lock = threading.Lock()
+
+def _load_weather_codes(cursor, keys=None):
+    """从weather_codes读取编码到进程内缓存，keys为None时读取全部"""
+    if keys is None:
+        cursor.execute("SELECT category, value, code FROM weather_codes")
+    else:
+        keys = list(keys)
+        cursor.execute(
+            f"SELECT category, value, code FROM weather_codes "
+            f"WHERE (category, value) IN ({', '.join(['(%s, %s)'] * len(keys))})",
+            [value for key in keys for value in key]
+        )
+    with _dimension_lock:
+        for category, value, code in cursor.fetchall():
+            _weather_codes[(category, value)] = code
+
+def _resolve_weather_codes(cursor, keys):
+    """返回 (类别, 文本) -> 编码，缓存中没有的先从数据库读取，仍没有的插入字典表"""
+    missing = [key for key in keys if key not in _weather_codes]
+    if missing:
+        if not _weather_codes:
+            _load_weather_codes(cursor)
+            missing = [key for key in missing if key not in _weather_codes]
+        if missing:
+            cursor.executemany("INSERT IGNORE INTO weather_codes (category, value) VALUES (%s, %s)", missing)
+            _load_weather_codes(cursor, missing)
+    return {key: _weather_codes.get(key) for key in keys}
+
+def _sync_location_dimension(cursor, locations):
+    """把一批 (location_id, location_name, province, city) 写入地区维表，跳过缓存中已一致的地区"""
+    changed = sorted(entry for entry in set(locations) if _known_locations.get(entry[0]) != entry[1:])
+    if changed:
+        cursor.executemany(LOCATION_UPSERT_SQL, changed)
+        with _dimension_lock:
+            _known_locations.update({entry[0]: entry[1:] for entry in changed})
+
+def _compact_hourly_rows(cursor, rows):
+    """把HOURLY_UPSERT_SQL参数行转换为COMPACT_HOURLY_UPSERT_SQL参数行，同时维护地区维表和字典表
+    
+    维表和字典表的写入都是幂等的，在数据事务之外（自动提交）执行，
+    数据批次回滚时不会让进程内缓存与数据库不一致。
+    """
+    _sync_location_dimension(cursor, [row[:4] for row in rows])
+    keys = {(category, str(row[index])) for row in rows for category, index in CODED_HOURLY_COLUMNS
+            if row[index] is not None}
+    codes = _resolve_weather_codes(cursor, keys)
+    compact_rows = []
+    for row in rows:
+        encoded = [codes.get((category, str(row[index]))) if row[index] is not None else None
+                   for category, index in CODED_HOURLY_COLUMNS]
+        compact_rows.append((row[0], row[4], row[5], row[6], row[7], row[8], *encoded))
+    return compact_rows
+
+def _count_locked_rows(cursor):
+    """按 (location_id, 'YYYY-MM-DD') 统计加锁读取到的行数"""
+    counts = {}
+    for location_id, day in cursor.fetchall():
+        key = (location_id, day.strftime('%Y-%m-%d'))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def _count_existing_hourly(cursor, rows):
+    """统计一批小时数据中已存在于小时数据表的行数，按 (location_id, 'YYYY-MM-DD') 分组
+
+    FOR UPDATE加锁读取（含尚不存在的键的间隙锁）：另一个事务同时写入相同的键时会等待本事务提交，
+    再读到已提交的行，不会两边都把同一行记为新增，计数表不会重复累加。
+    """
+    placeholders = ', '.join(['(%s, %s)'] * len(rows))
+    params = [value for row in rows for value in (row[0], row[4])]
+    cursor.execute(
+        f"SELECT location_id, DATE(datetime) FROM {hourly_storage_table()} "
+        f"WHERE (location_id, datetime) IN ({placeholders}) FOR UPDATE",
+        params
+    )
+    return _count_locked_rows(cursor)
+
+def _count_existing_daily(cursor, rows):
+    """统计一批每日数据中已存在于daily_weather的行数，按 (location_id, 'YYYY-MM-DD') 分组（加锁读取，同上）"""
+    placeholders = ', '.join(['(%s, %s)'] * len(rows))
+    params = [value for row in rows for value in (row[0], row[4])]
+    cursor.execute(
+        f"SELECT location_id, date FROM daily_weather "
+        f"WHERE (location_id, date) IN ({placeholders}) FOR UPDATE",
+        params
+    )
+    return _count_locked_rows(cursor)
+
+# 写入监听：数据提交后回调 callback(table_name, dates)，table_name为'hourly'或'daily'，
+# dates为涉及的'YYYY-MM-DD'集合（None表示无法确定范围），供读取端的结果缓存失效
+_write_listeners = []
+
+def add_write_listener(callback):
+    """注册数据写入监听函数"""
+    if callback not in _write_listeners:
+        _write_listeners.append(callback)
+
+def remove_write_listener(callback):
+    if callback in _write_listeners:
+        _write_listeners.remove(callback)
+
+def _notify_write(table_name, dates):
+    for callback in list(_write_listeners):
+        try:
+            callback(table_name, dates)
+        except Exception as e:
+            logging.warning(f"写入监听回调失败: {e}")
+
+def _row_count_increments(table_name, rows, existing):
+    """根据一批写入行和其中已存在的行数，计算计数表的增量参数（只包含有新增行的分组）"""
+    totals = {}
+    names = {}
+    for row in rows:
+        key = (row[0], str(row[4])[:10])
+        totals[key] = totals.get(key, 0) + 1
+        names[key] = (row[1], row[2])
+    increments = []
+    for key in sorted(totals):  # 固定加锁顺序，减少并发写入时的死锁
+        new_count = totals[key] - existing.get(key, 0)
+        if new_count > 0:
+            location_name, province = names[key]
+            increments.append((table_name, key[0], key[1], location_name, province, new_count))
+    return increments
+
+def _upsert_batch(conn, upsert_sql, rows, count_existing, table_name, prepare=None):
+    """在一个事务中写入一批数据并更新计数表，返回 (新增数, 更新数)
+
+    多行UPSERT的rowcount是 新增×1 + 有变化的更新×2 + 无变化的更新×0 的总和，
+    无法区分"新增"和"无变化"，所以先在同一事务内加锁统计已存在的行数：
+    已存在的记为更新（与逐行写入时rowcount != 1的统计口径一致），其余记为新增。
+    并发写入相同键的事务死锁时，被回滚的一方整批重试，最多DB_DEADLOCK_RETRIES次。
+    prepare(cursor, rows)用于在事务开始前把行转换为upsert_sql的参数（如紧凑格式编码）。
+    """
+    metrics = get_metrics()
+    cursor = conn.cursor()
+    try:
+        write_rows = prepare(cursor, rows) if prepare else rows
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            conn.begin()
+            try:
+                existing = count_existing(cursor, rows)
+                cursor.executemany(upsert_sql, write_rows)
+                increments = _row_count_increments(table_name, rows, existing)
+                if increments:
+                    cursor.executemany(ROW_COUNT_UPSERT_SQL, increments)
+                conn.commit()
+                break
+            except pymysql.err.OperationalError as e:
+                if e.args[0] != ER.LOCK_DEADLOCK or attempt >= DB_DEADLOCK_RETRIES:
+                    raise
+                conn.rollback()
+                attempt += 1
+                metrics.inc('qweather_db_deadlock_retries_total', backend='mysql', table=table_name)
+                time.sleep(0.05 * attempt)
+        metrics.observe('qweather_db_batch_seconds', time.perf_counter() - started, backend='mysql', table=table_name)
+    except Exception:
+        conn.rollback()
+        metrics.inc('qweather_db_batch_errors_total', backend='mysql', table=table_name)
+        raise
+    finally:
+        cursor.close()
+    _notify_write(table_name, {str(row[4])[:10] for row in rows})
+    existing_total = sum(existing.values())
+    metrics.inc('qweather_rows_written_total', len(rows) - existing_total, table=table_name, kind='new')
+    metrics.inc('qweather_rows_written_total', existing_total, table=table_name, kind='updated')
+    return (len(rows) - existing_total, existing_total)
+
+def _upsert_with_bisect(conn, upsert_sql, rows, count_existing, table_name, label, prepare=None):
+    """写入一批数据，整批因数据错误失败时二分拆批重试，把错误隔离到单行，返回 (新增数, 更新数, 失败行数)
 
-def save_hourly_to_mysql(hourly_data, location_id, location_name, csv_path=None):
+    只对ROW_DATA_ERRORS拆批，其他错误（连接断开等）原样抛出，整批视为未写入。
+    """
+    try:
+        return _upsert_batch(conn, upsert_sql, rows, count_existing, table_name, prepare) + (0,)
+    except ROW_DATA_ERRORS as e:
+        if len(rows) == 1:
+            print(f"⚠️  保存{label}数据失败({rows[0][0]} {rows[0][4]}): {e}")
+            get_metrics().inc('qweather_rows_written_total', table=table_name, kind='failed')
+            return (0, 0, 1)
+        middle = len(rows) // 2
+        left = _upsert_with_bisect(conn, upsert_sql, rows[:middle], count_existing, table_name, label, prepare)
+        right = _upsert_with_bisect(conn, upsert_sql, rows[middle:], count_existing, table_name, label, prepare)
+        return tuple(a + b for a, b in zip(left, right))
+
+def _save_rows_in_batches(conn, upsert_sql, rows, count_existing, table_name, batch_size, label, prepare=None):
+    batch_size = max(1, int(batch_size or DB_BATCH_SIZE))
+    new_count = 0
+    duplicate_count = 0
+    failed_count = 0
+    for start in range(0, len(rows), batch_size):
+        batch_new, batch_updated, batch_failed = _upsert_with_bisect(
+            conn, upsert_sql, rows[start:start + batch_size], count_existing, table_name, label, prepare)
+        new_count += batch_new
+        duplicate_count += batch_updated
+        failed_count += batch_failed
+    return (new_count, duplicate_count, failed_count)
+
+def save_hourly_rows_mysql(conn, rows, batch_size=None, location_name=''):
+    """按批写入已转换好的小时数据行，每批一次往返、一次提交
+
+    Args:
+        conn: 数据库连接
+        rows: HOURLY_UPSERT_SQL参数元组列表（紧凑格式时自动编码后写入）
+        batch_size: 每批行数，默认使用DB_BATCH_SIZE
+        location_name: 仅用于错误提示
+
+    Returns:
+        tuple: (新增数, 更新数, 失败行数)，失败行数为二分重试后仍无法写入而被跳过的行
+    """
+    if HOURLY_LAYOUT == 'compact':
+        return _save_rows_in_batches(conn, COMPACT_HOURLY_UPSERT_SQL, rows, _count_existing_hourly, 'hourly',
+                                     batch_size, f"{location_name}小时", _compact_hourly_rows)
+    return _save_rows_in_batches(conn, HOURLY_UPSERT_SQL, rows, _count_existing_hourly, 'hourly',
+                                 batch_size, f"{location_name}小时")
+
+def save_daily_rows_mysql(conn, rows, batch_size=None, location_name=''):
+    """按批写入已转换好的每日数据行，参数与返回值同save_hourly_rows_mysql"""
+    return _save_rows_in_batches(conn, DAILY_UPSERT_SQL, rows, _count_existing_daily, 'daily',
+                                 batch_size, f"{location_name}每日")
+
+def save_locations_weather_mysql(items, csv_path=None, batch_size=None):
+    """批量保存多个地区的小时和每日数据，所有地区共用一个连接、按批提交
+
+    Args:
+        items: 可迭代对象，元素为 (location_id, location_name, hourly_data, daily_list)
+        csv_path: 城市CSV路径，用于查询省市信息
+        batch_size: 每批行数，默认使用DB_BATCH_SIZE
+
+    Returns:
+        dict: hourly_new/hourly_updated/hourly_failed/daily_new/daily_updated/daily_failed 计数，
+              以及 skipped（缺少省市信息而未保存的location_id列表）
+    """
+    items = list(items)
+    metrics = get_metrics()
+    with metrics.timer('qweather_stage_seconds', stage='location_lookup'):
+        location_infos = get_locations_province_city([item[0] for item in items], csv_path)
+    
+    hourly_rows = []
+    daily_rows = []
+    skipped = []
+    with metrics.timer('qweather_stage_seconds', stage='build_rows'):
+        for location_id, location_name, hourly_data, daily_list in items:
+            location_info = location_infos.get(location_id)
+            if not location_info:
+                print(f"⚠️  未找到location_id '{location_id}' 对应的省市信息，跳过{location_name}")
+                skipped.append(location_id)
+                continue
+            province = location_info['province']
+            city = location_info['city']
+            if hourly_data:
+                hourly_rows.extend(_build_hourly_rows(hourly_data, location_id, location_name, province, city))
+            for record in daily_list or []:
+                daily_rows.append(_build_daily_row(record, location_id, location_name, province, city))
+    
+    result = {'hourly_new': 0, 'hourly_updated': 0, 'hourly_failed': 0,
+              'daily_new': 0, 'daily_updated': 0, 'daily_failed': 0, 'skipped': skipped}
+    if not hourly_rows and not daily_rows:
+        return result
+    
+    with metrics.timer('qweather_stage_seconds', stage='db_write'), mysql_connection() as conn:
+        if hourly_rows:
+            result['hourly_new'], result['hourly_updated'], result['hourly_failed'] = \
+                save_hourly_rows_mysql(conn, hourly_rows, batch_size)
+        if daily_rows:
+            result['daily_new'], result['daily_updated'], result['daily_failed'] = \
+                save_daily_rows_mysql(conn, daily_rows, batch_size)
+    return result
+
+def save_hourly_to_mysql(hourly_data, location_id, location_name, csv_path=None, batch_size=None):
     """保存小时天气数据到MySQL（统一使用hourly_weather表）"""
     if not hourly_data:
         print("⚠️  没有小时数据需要保存")
         return
     
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
+        conn = acquire_mysql_connection()
         
-        # 准备插入语句
-        insert_sql = """
-        INSERT INTO hourly_weather 
-        (location_id, location_name, province, city, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa, 
-         wind_scale, wind_dir, text)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        location_name = VALUES(location_name),
-        province = VALUES(province),
-        city = VALUES(city),
-        temp_celsius = VALUES(temp_celsius),
-        humidity_percent = VALUES(humidity_percent),
-        precip_mm = VALUES(precip_mm),
-        pressure_hpa = VALUES(pressure_hpa),
-        wind_scale = VALUES(wind_scale),
-        wind_dir = VALUES(wind_dir),
-        text = VALUES(text)
-        """
-        
-        new_count = 0
-        duplicate_count = 0
+        # 获取省市信息（同一地区的所有小时记录相同）
+        try:
+            location_info = get_location_province_city(location_id, csv_path)
+        except ValueError as e:
+            print(f"⚠️  保存小时数据失败: {e}")
+            return
         
-        for hour_data in hourly_data:
-            try:
-                # 准备数据 - 根据API实际返回的字段名
-                # 转换时间格式：从 "2025-07-21T00:00+08:00" 到 "2025-07-21 00:00:00"
-                time_str = hour_data['time']
-                if 'T' in time_str:
-                    # 提取日期和时间部分，去掉时区信息
-                    datetime_str = time_str.split('T')[0] + ' ' + time_str.split('T')[1].split('+')[0]
-                else:
-                    datetime_str = time_str
-                
-                # 获取省市信息
-                location_info = get_location_province_city(location_id, csv_path)
-                province = location_info['province']
-                city = location_info['city']
-                
-                data = (
-                    location_id,
-                    location_name,
-                    province,  # 使用动态省市信息
-                    city,      # 使用动态省市信息
-                    datetime_str,  # 转换后的时间格式
-                    hour_data.get('temp'),
-                    hour_data.get('humidity'),
-                    hour_data.get('precip', 0.0),  # 处理None值
-                    hour_data.get('pressure'),
-                    hour_data.get('windScale'),  # 使用windScale而不是windSpeed
-                    hour_data.get('windDir'),
-                    hour_data.get('text')   # 天气现象描述
-                )
-                
-                cursor.execute(insert_sql, data)
-                
-                if cursor.rowcount == 1:
-                    new_count += 1
-                else:
-                    duplicate_count += 1
-                    
-            except Exception as e:
-                print(f"⚠️  保存小时数据失败: {e}")
-                continue
+        rows = _build_hourly_rows(hourly_data, location_id, location_name,
+                                  location_info['province'], location_info['city'])
         
-        conn.commit()
+        new_count, duplicate_count, failed_count = save_hourly_rows_mysql(conn, rows, batch_size, location_name)
         print(f"✅ 小时数据保存完成: 新增{new_count}条，更新{duplicate_count}条")
+        if failed_count:
+            print(f"⚠️  {failed_count}条小时数据写入失败，已跳过")
         
     except Exception as e:
         print(f"❌ 保存小时数据失败: {e}")
         raise
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_mysql_connection(conn)
+
+# 从小时数据汇总每日数据的INSERT ... SELECT模板，{location_filter}用于限定地区
+DAILY_SUMMARY_SQL = """
+INSERT INTO daily_weather 
+(location_id, location_name, province, city, date, temp_min_celsius, 
+ temp_max_celsius, humidity_percent, precip_mm, pressure_hpa)
+SELECT 
+    location_id,
+    MAX(location_name),
+    MAX(province),
+    MAX(city),
+    DATE(datetime) as date,
+    MIN(temp_celsius),
+    MAX(temp_celsius),
+    ROUND(AVG(humidity_percent), 1),
+    SUM(COALESCE(precip_mm, 0)),
+    ROUND(AVG(pressure_hpa), 1)
+FROM hourly_weather 
+WHERE datetime >= %s AND datetime < %s{location_filter}
+GROUP BY location_id, DATE(datetime)
+ON DUPLICATE KEY UPDATE
+location_name = VALUES(location_name),
+province = VALUES(province),
+city = VALUES(city),
+temp_min_celsius = VALUES(temp_min_celsius),
+temp_max_celsius = VALUES(temp_max_celsius),
+humidity_percent = VALUES(humidity_percent),
+precip_mm = VALUES(precip_mm),
+pressure_hpa = VALUES(pressure_hpa)
+"""
+
+def _aggregate_daily_range(conn, start_date, end_date, location_ids=None):
+    """按日期范围（含两端）从hourly_weather重新汇总daily_weather，可限定地区，返回受影响行数
+    
+    条件为datetime范围（加location_id时为(location_id, datetime)范围），可以走索引，不扫描全表。
+    """
+    params = [start_date.strftime('%Y-%m-%d'), (end_date + timedelta(days=1)).strftime('%Y-%m-%d')]
+    location_filter = ""
+    if location_ids:
+        location_filter = f" AND location_id IN ({', '.join(['%s'] * len(location_ids))})"
+        params.extend(location_ids)
+    
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        cursor.execute(DAILY_SUMMARY_SQL.format(location_filter=location_filter), params)
+        affected = cursor.rowcount
+        # 汇总可能新增每日记录，在同一事务内重算该范围的每日计数
+        _refresh_daily_row_counts(cursor, start_date, end_date, location_ids)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    
+    dates = set()
+    day = start_date
+    while day <= end_date:
+        dates.add(day.strftime('%Y-%m-%d'))
+        day += timedelta(days=1)
+    _notify_write('daily', dates)
+    return affected
+
+def calculate_daily_summaries_for_pairs(pairs, batch_size=None):
+    """增量汇总：只重新计算指定 (location_id, 日期) 组合的每日数据
+    
+    Args:
+        pairs: 可迭代对象，元素为 (location_id, 日期)，日期可以是datetime.date或'YYYYMMDD'/'YYYY-MM-DD'字符串
+        batch_size: 每条语句最多包含的地区数，默认使用DB_BATCH_SIZE
+    
+    Returns:
+        int: 汇总的组合数
+    """
+    by_date = {}
+    for location_id, day in pairs:
+        if isinstance(day, str):
+            day = datetime.strptime(day.replace('-', ''), '%Y%m%d').date()
+        by_date.setdefault(day, set()).add(location_id)
+    
+    batch_size = max(1, int(batch_size or DB_BATCH_SIZE))
+    total = 0
+    with mysql_connection() as conn:
+        for day in sorted(by_date):
+            location_ids = sorted(by_date[day])
+            for start in range(0, len(location_ids), batch_size):
+                _aggregate_daily_range(conn, day, day, location_ids[start:start + batch_size])
+            total += len(location_ids)
+    print(f"✅ 增量汇总完成: {total}组 (地区, 日期)")
+    return total
+
+def rebuild_daily_summaries_mysql(start_date=None, end_date=None):
+    """全量重建：逐日从hourly_weather重新汇总daily_weather
+    
+    每天一条语句、一次提交，避免对整张表做一次性GROUP BY。
+    不指定日期时使用hourly_weather中的最早和最晚日期。
+    
+    Returns:
+        int: 处理的天数
+    """
+    with mysql_connection() as conn:
+        if start_date is None or end_date is None:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"SELECT MIN(datetime), MAX(datetime) FROM {hourly_storage_table()}")
+                first, last = cursor.fetchone()
+            finally:
+                cursor.close()
+            if first is None:
+                print("⚠️  hourly_weather中没有数据，无需重建")
+                return 0
+            start_date = start_date or first.date()
+            end_date = end_date or last.date()
+        
+        day = start_date
+        days = 0
+        while day <= end_date:
+            _aggregate_daily_range(conn, day, day)
+            day += timedelta(days=1)
+            days += 1
+    print(f"✅ 每日汇总全量重建完成: {start_date} ~ {end_date} 共{days}天")
+    return days
 
 def calculate_daily_summaries_mysql(location_id, location_name, csv_path=None):
-    """计算并保存每日天气汇总到MySQL（统一使用daily_weather表）"""
+    """计算并保存指定地区所有日期的每日天气汇总到MySQL（统一使用daily_weather表）"""
     try:
-        conn = get_mysql_connection()
-        
-        # 查询聚合数据
-        query = """
-        INSERT INTO daily_weather 
-        (location_id, location_name, date, min_temp, max_temp, avg_temp, total_precip, 
-         avg_wind_speed, avg_humidity, record_count)
-        SELECT 
-            location_id,
-            location_name,
-            DATE(datetime) as date,
-            MIN(temp_celsius) as min_temp,
-            MAX(temp_celsius) as max_temp,
-            AVG(temp_celsius) as avg_temp,
-            SUM(COALESCE(precip_mm, 0)) as total_precip,
-            AVG(wind_speed_kmh) as avg_wind_speed,
-            AVG(humidity_percent) as avg_humidity,
-            COUNT(*) as record_count
-        FROM hourly_weather 
-        WHERE location_id = %s AND location_name = %s
-        GROUP BY location_id, location_name, DATE(datetime)
-        ON DUPLICATE KEY UPDATE
-        location_name = VALUES(location_name),
-        min_temp = VALUES(min_temp),
-        max_temp = VALUES(max_temp),
-        avg_temp = VALUES(avg_temp),
-        total_precip = VALUES(total_precip),
-        avg_wind_speed = VALUES(avg_wind_speed),
-        avg_humidity = VALUES(avg_humidity),
-        record_count = VALUES(record_count)
-        """
+        conn = acquire_mysql_connection()
         
         cursor = conn.cursor()
-        cursor.execute(query, (location_id, location_name))
-        conn.commit()
+        cursor.execute(f"SELECT MIN(datetime), MAX(datetime) FROM {hourly_storage_table()} WHERE location_id = %s",
+                       (location_id,))
+        first, last = cursor.fetchone()
+        cursor.close()
+        if first is not None:
+            _aggregate_daily_range(conn, first.date(), last.date(), [location_id])
         
         print("✅ 每日天气汇总计算完成")
         
@@ -241,86 +1348,31 @@ def calculate_daily_summaries_mysql(location_id, location_name, csv_path=None):
         raise
     finally:
         if 'conn' in locals():
-            conn.close()
-
+            release_mysql_connection(conn)
 
-
-def save_districts_hourly_to_mysql(hourly_data, location_id, location_name, csv_path=None):
-    """保存区县小时天气数据到MySQL"""
+def save_districts_hourly_to_mysql(hourly_data, location_id, location_name, csv_path=None, batch_size=None):
+    """保存区县小时天气数据到MySQL（批量写入，每批一次提交）"""
     if not hourly_data:
         print("⚠️  没有区县小时数据需要保存")
         return
     
     try:
-        conn = get_mysql_connection()
-        cursor = conn.cursor()
+        conn = acquire_mysql_connection()
         
-        # 准备插入语句
-        insert_sql = """
-        INSERT INTO hourly_weather 
-        (location_id, location_name, province, city, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa, 
-         wind_scale, wind_dir, text)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        location_name = VALUES(location_name),
-        province = VALUES(province),
-        city = VALUES(city),
-        temp_celsius = VALUES(temp_celsius),
-        humidity_percent = VALUES(humidity_percent),
-        precip_mm = VALUES(precip_mm),
-        pressure_hpa = VALUES(pressure_hpa),
-        wind_scale = VALUES(wind_scale),
-        wind_dir = VALUES(wind_dir),
-        text = VALUES(text)
-        """
-        
-        new_count = 0
-        duplicate_count = 0
+        # 获取省市信息（同一地区的所有小时记录相同）
+        try:
+            location_info = get_location_province_city(location_id, csv_path)
+        except ValueError as e:
+            print(f"⚠️  保存区县{location_name}小时数据失败: {e}")
+            return (0, 0)
         
-        for hour_data in hourly_data:
-            try:
-                # 准备数据 - 根据API实际返回的字段名
-                # 转换时间格式：从 "2025-07-21T00:00+08:00" 到 "2025-07-21 00:00:00"
-                time_str = hour_data['time']
-                if 'T' in time_str:
-                    # 提取日期和时间部分，去掉时区信息
-                    datetime_str = time_str.split('T')[0] + ' ' + time_str.split('T')[1].split('+')[0]
-                else:
-                    datetime_str = time_str
-                
-                # 获取省市信息
-                location_info = get_location_province_city(location_id, csv_path)
-                province = location_info['province']
-                city = location_info['city']
-                
-                data = (
-                    location_id,
-                    location_name,
-                    province,  # 使用动态省市信息
-                    city,      # 使用动态省市信息
-                    datetime_str,  # 转换后的时间格式
-                    hour_data.get('temp'),
-                    hour_data.get('humidity'),
-                    hour_data.get('precip', 0.0),  # 处理None值
-                    hour_data.get('pressure'),
-                    hour_data.get('windScale'),  # 使用windScale而不是windSpeed
-                    hour_data.get('windDir'),
-                    hour_data.get('text')   # 天气现象描述
-                )
-                
-                cursor.execute(insert_sql, data)
-                
-                if cursor.rowcount == 1:
-                    new_count += 1
-                else:
-                    duplicate_count += 1
-                    
-            except Exception as e:
-                print(f"⚠️  保存区县{location_name}小时数据失败: {e}")
-                continue
+        rows = _build_hourly_rows(hourly_data, location_id, location_name,
+                                  location_info['province'], location_info['city'])
         
-        conn.commit()
+        new_count, duplicate_count, failed_count = save_hourly_rows_mysql(conn, rows, batch_size, location_name)
         print(f"✅ 区县{location_name}小时数据保存完成: 新增{new_count}条，更新{duplicate_count}条")
+        if failed_count:
+            print(f"⚠️  区县{location_name}有{failed_count}条小时数据写入失败，已跳过")
         return (new_count, duplicate_count)
         
     except Exception as e:
@@ -328,59 +1380,23 @@ def save_districts_hourly_to_mysql(hourly_data, location_id, location_name, csv_
         raise
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_mysql_connection(conn)
 
 def calculate_districts_daily_summaries_mysql():
-    """计算并保存所有区县每日天气汇总到MySQL"""
+    """计算并保存所有区县每日天气汇总到MySQL（全量重建，逐日处理）"""
     try:
-        conn = get_mysql_connection()
-        
-        # 查询聚合数据
-        query = """
-        INSERT INTO daily_weather 
-        (location_id, location_name, date, min_temp, max_temp, avg_temp, total_precip, 
-         avg_wind_speed, avg_humidity, record_count)
-        SELECT 
-            location_id,
-            location_name,
-            DATE(datetime) as date,
-            MIN(temp_celsius) as min_temp,
-            MAX(temp_celsius) as max_temp,
-            AVG(temp_celsius) as avg_temp,
-            SUM(COALESCE(precip_mm, 0)) as total_precip,
-            AVG(wind_speed_kmh) as avg_wind_speed,
-            AVG(humidity_percent) as avg_humidity,
-            COUNT(*) as record_count
-        FROM hourly_weather 
-        GROUP BY location_id, location_name, DATE(datetime)
-        ON DUPLICATE KEY UPDATE
-        location_name = VALUES(location_name),
-        min_temp = VALUES(min_temp),
-        max_temp = VALUES(max_temp),
-        avg_temp = VALUES(avg_temp),
-        total_precip = VALUES(total_precip),
-        avg_wind_speed = VALUES(avg_wind_speed),
-        avg_humidity = VALUES(avg_humidity),
-        record_count = VALUES(record_count)
-        """
-        
-        cursor = conn.cursor()
-        cursor.execute(query)
-        conn.commit()
-        
+        rebuild_daily_summaries_mysql()
         print("✅ 区县每日天气汇总计算完成")
-        
     except Exception as e:
         print(f"❌ 计算区县每日汇总失败: {e}")
         raise
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 
 def get_location_province_city(location_id, csv_path=None):
     """根据location_id获取省市信息 - 支持动态CSV路径
     
+    CSV只在首次查询（或文件修改后）读取一次，之后从内存索引中查找。
+    
     Args:
         location_id: 位置ID
         csv_path: CSV文件路径，如果为None则使用环境变量或默认映射
@@ -391,41 +1407,11 @@ def get_location_province_city(location_id, csv_path=None):
     if not location_id:
         raise ValueError("location_id不能为空")
     
-    # 如果提供了csv_path，优先使用
-    if csv_path and os.path.exists(csv_path):
-        try:
-            import csv
-            with open(csv_path, 'r', encoding='utf-8-sig') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    loc_id = row.get('location_id', '').strip()
-                    province = row.get('province', '').strip()
-                    city = row.get('city', '').strip()
-                    
-                    if loc_id == location_id and province and city:
-                        return {'province': province, 'city': city}
-        except Exception:
-            # 如果指定路径失败，继续尝试其他方式
-            pass
-    
-    # 使用环境变量指定的CSV路径
-    env_csv_path = os.getenv('CITY_CSV_PATH')
-    if env_csv_path and os.path.exists(env_csv_path):
-        try:
-            import csv
-            with open(env_csv_path, 'r', encoding='utf-8-sig') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    loc_id = row.get('location_id', '').strip()
-                    province = row.get('province', '').strip()
-                    city = row.get('city', '').strip()
-                    
-                    if loc_id == location_id and province and city:
-                        return {'province': province, 'city': city}
-        except Exception:
-            pass
+    location_info = lookup_locations([location_id], csv_path).get(str(location_id).strip())
+    if location_info:
+        return location_info
     
-        # 未找到省市信息，提供有意义的错误提示
+    # 未找到省市信息，提供有意义的错误提示
     raise ValueError(
         f"未找到location_id '{location_id}' 对应的省市信息。\n"
         f"请通过以下方式之一提供城市信息：\n"
@@ -434,6 +1420,88 @@ def get_location_province_city(location_id, csv_path=None):
         f"3. 确保CSV文件包含 location_id, province, city 列"
     )
 
+def get_locations_province_city(location_ids, csv_path=None):
+    """批量获取省市信息
+    
+    Args:
+        location_ids: location_id列表
+        csv_path: CSV文件路径，如果为None则使用环境变量
+    
+    Returns:
+        dict: location_id -> {'province': ..., 'city': ...}，未找到的id不包含在结果中
+    """
+    return lookup_locations(location_ids, csv_path)
+
+def get_complete_location_dates(start_date, end_date, hours_per_day=24):
+    """查询日期范围内已完整入库的 (location_id, 日期) 组合
+    
+    "完整"指当天有至少hours_per_day条小时记录且有每日记录。一次分组查询完成，
+    按datetime范围过滤可以走idx_hourly_datetime索引，不扫描全表。
+    
+    Args:
+        start_date / end_date: 起止日期（datetime.date，包含两端）
+        hours_per_day: 每天应有的小时记录数
+    
+    Returns:
+        set: {(location_id, 'YYYYMMDD'), ...}
+    """
+    query = f"""
+    SELECT h.location_id, h.day
+    FROM (
+        SELECT location_id, DATE(datetime) AS day, COUNT(*) AS hour_count
+        FROM {hourly_storage_table()}
+        WHERE datetime >= %s AND datetime < %s
+        GROUP BY location_id, DATE(datetime)
+        HAVING hour_count >= %s
+    ) h
+    JOIN daily_weather d ON d.location_id = h.location_id AND d.date = h.day
+    """
+    end_exclusive = end_date + timedelta(days=1)
+    
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, (start_date.strftime('%Y-%m-%d'), end_exclusive.strftime('%Y-%m-%d'), hours_per_day))
+            return {(location_id, day.strftime('%Y%m%d')) for location_id, day in cursor.fetchall()}
+        finally:
+            cursor.close()
+
+def get_location_date_coverage(start_date, end_date):
+    """查询日期范围内每个 (location_id, 日期) 已入库的小时记录数和是否有每日记录，用于缺口检测
+    
+    两次按日期范围过滤的分组查询（走idx_hourly_datetime和idx_daily_date索引），不扫描全表。
+    没有任何数据的组合不会出现在结果中。
+    
+    Args:
+        start_date / end_date: 起止日期（datetime.date，包含两端）
+    
+    Returns:
+        dict: {(location_id, 'YYYYMMDD'): (小时记录数, 是否有每日记录), ...}
+    """
+    hourly_query = f"""
+    SELECT location_id, DATE(datetime) AS day, COUNT(*)
+    FROM {hourly_storage_table()}
+    WHERE datetime >= %s AND datetime < %s
+    GROUP BY location_id, DATE(datetime)
+    """
+    daily_query = "SELECT location_id, date FROM daily_weather WHERE date >= %s AND date <= %s"
+    end_exclusive = end_date + timedelta(days=1)
+    
+    coverage = {}
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(hourly_query, (start_date.strftime('%Y-%m-%d'), end_exclusive.strftime('%Y-%m-%d')))
+            for location_id, day, hour_count in cursor.fetchall():
+                coverage[(location_id, day.strftime('%Y%m%d'))] = (hour_count, False)
+            cursor.execute(daily_query, (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')))
+            for location_id, day in cursor.fetchall():
+                key = (location_id, day.strftime('%Y%m%d'))
+                coverage[key] = (coverage.get(key, (0, False))[0], True)
+        finally:
+            cursor.close()
+    return coverage
+
 def save_daily_weather_mysql(weather_daily_data, location_id, location_name, csv_path=None):
     """直接保存API返回的weatherDaily数据到MySQL"""
     if not weather_daily_data:
@@ -441,7 +1509,7 @@ def save_daily_weather_mysql(weather_daily_data, location_id, location_name, csv
         return (0, 0)
     
     try:
-        conn = get_mysql_connection()
+        conn = acquire_mysql_connection()
         cursor = conn.cursor()
         
         
@@ -450,52 +1518,28 @@ def save_daily_weather_mysql(weather_daily_data, location_id, location_name, csv
         province = location_info['province']
         city = location_info['city']
         
-        # 准备插入语句（使用新的字段名）
-        insert_sql = """
-        INSERT INTO daily_weather 
-        (location_id, location_name, province, city, date, temp_min_celsius, 
-         temp_max_celsius, humidity_percent, precip_mm, pressure_hpa)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON DUPLICATE KEY UPDATE
-        location_name = VALUES(location_name),
-        province = VALUES(province),
-        city = VALUES(city),
-        temp_min_celsius = VALUES(temp_min_celsius),
-        temp_max_celsius = VALUES(temp_max_celsius),
-        humidity_percent = VALUES(humidity_percent),
-        precip_mm = VALUES(precip_mm),
-        pressure_hpa = VALUES(pressure_hpa)
-        """
-        
         try:
             # 准备数据 - 直接使用API返回的weatherDaily字段
-            data = (
-                location_id,
-                location_name,
-                province,
-                city,
-                weather_daily_data.get('date'),  # 日期
-                weather_daily_data.get('tempMin'),  # 最低温度
-                weather_daily_data.get('tempMax'),  # 最高温度
-                weather_daily_data.get('humidity'),  # 湿度
-                weather_daily_data.get('precip', '0.0'),  # 降水量
-                weather_daily_data.get('pressure')  # 气压
-            )
+            data = _build_daily_row(weather_daily_data, location_id, location_name, province, city)
             
-            cursor.execute(insert_sql, data)
+            conn.begin()
+            cursor.execute(DAILY_UPSERT_SQL, data)
             
             if cursor.rowcount == 1:
                 new_count = 1
                 updated_count = 0
+                cursor.execute(ROW_COUNT_UPSERT_SQL, ('daily', location_id, str(data[4])[:10], location_name, province, 1))
             else:
                 new_count = 0
                 updated_count = 1
                 
             conn.commit()
+            _notify_write('daily', {str(data[4])[:10]})
             print(f"✅ {location_name} 每日数据保存完成: 新增{new_count}条，更新{updated_count}条")
             return (new_count, updated_count)
                 
         except Exception as e:
+            conn.rollback()
             print(f"⚠️  保存每日数据失败: {e}")
             return (0, 0)
         
@@ -504,61 +1548,168 @@ def save_daily_weather_mysql(weather_daily_data, location_id, location_name, csv
         return (0, 0)
     finally:
         if 'conn' in locals():
-            conn.close()
+            release_mysql_connection(conn)
+
+def _rebuild_row_counts(conn):
+    """从事实表全量重建计数表（一次性全表扫描，仅在首次初始化或校准时使用）"""
+    cursor = conn.cursor()
+    try:
+        conn.begin()
+        cursor.execute("DELETE FROM weather_row_counts")
+        cursor.execute("""
+        INSERT INTO weather_row_counts (table_name, location_id, date, location_name, province, row_count)
+        SELECT 'hourly', location_id, DATE(datetime), MAX(location_name), MAX(province), COUNT(*)
+        FROM hourly_weather
+        GROUP BY location_id, DATE(datetime)
+        """)
+        cursor.execute("""
+        INSERT INTO weather_row_counts (table_name, location_id, date, location_name, province, row_count)
+        SELECT 'daily', location_id, date, MAX(location_name), MAX(province), COUNT(*)
+        FROM daily_weather
+        GROUP BY location_id, date
+        """)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def _refresh_daily_row_counts(cursor, start_date, end_date, location_ids=None):
+    """重算日期范围内（可限定地区）的每日数据计数，调用方负责事务"""
+    params = [start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')]
+    location_filter = ""
+    if location_ids:
+        location_filter = f" AND location_id IN ({', '.join(['%s'] * len(location_ids))})"
+        params.extend(location_ids)
+    cursor.execute(
+        f"DELETE FROM weather_row_counts WHERE table_name = 'daily' AND date BETWEEN %s AND %s{location_filter}",
+        params
+    )
+    cursor.execute(f"""
+    INSERT INTO weather_row_counts (table_name, location_id, date, location_name, province, row_count)
+    SELECT 'daily', location_id, date, MAX(location_name), MAX(province), COUNT(*)
+    FROM daily_weather
+    WHERE date BETWEEN %s AND %s{location_filter}
+    GROUP BY location_id, date
+    """, params)
+
+def rebuild_row_counts_mysql():
+    """全量重建计数表，用于校准（例如手工修改过事实表之后）"""
+    with mysql_connection() as conn:
+        _rebuild_row_counts(conn)
+    print("✅ 计数表重建完成")
+
+def _fetch_scalar(conn, sql, params=None):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        value = cursor.fetchone()[0]
+        return int(value or 0)
+    finally:
+        cursor.close()
+
+def get_approximate_table_rows():
+    """从information_schema读取hourly_weather和daily_weather的估算行数（不扫描数据，误差通常在10%以内）"""
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("""
+            SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN (%s, 'daily_weather')
+            """, (hourly_storage_table(),))
+            rows = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+    return {'total_hourly': int(rows.get(hourly_storage_table()) or 0),
+            'total_daily': int(rows.get('daily_weather') or 0)}
 
-def get_mysql_stats(location_name=None):
+def get_stats_breakdown(by='province', table_name='hourly', start_date=None, end_date=None):
+    """按地区、省份或日期分组统计行数（读取计数表，不扫描事实表）
+    
+    Args:
+        by: 'location'、'province' 或 'date'
+        table_name: 'hourly' 或 'daily'
+        start_date / end_date: 可选的日期范围（datetime.date，包含两端）
+    
+    Returns:
+        list: [{'key': 分组值, 'row_count': 行数}, ...]，按行数从多到少排列（按日期分组时按日期排列）
+    """
+    group_columns = {
+        'location': "CONCAT(location_name, '(', location_id, ')')",
+        'province': 'province',
+        'date': 'date'
+    }
+    if by not in group_columns:
+        raise ValueError(f"不支持的分组方式: {by}（可选 location/province/date）")
+    
+    conditions = ["table_name = %s"]
+    params = [table_name]
+    if start_date:
+        conditions.append("date >= %s")
+        params.append(start_date.strftime('%Y-%m-%d'))
+    if end_date:
+        conditions.append("date <= %s")
+        params.append(end_date.strftime('%Y-%m-%d'))
+    order_by = "group_key" if by == 'date' else "total DESC"
+    
+    with mysql_connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                f"SELECT {group_columns[by]} AS group_key, SUM(row_count) AS total FROM weather_row_counts "
+                f"WHERE {' AND '.join(conditions)} GROUP BY group_key ORDER BY {order_by}",
+                params
+            )
+            return [{'key': key, 'row_count': int(total)} for key, total in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+def get_mysql_stats(location_name=None, mode=None):
     """获取MySQL数据库统计信息
     
     Args:
         location_name: 指定城市名称，如果为None则返回所有数据
+        mode: 'counters'（计数表，精确）或 'approx'（information_schema估算），默认使用STATS_MODE；
+              指定城市时总是使用计数表
     """
+    mode = mode or STATS_MODE
     try:
-        conn = get_mysql_connection()
+        if mode == 'approx' and not location_name:
+            return get_approximate_table_rows()
+        
+        conn = acquire_mysql_connection()
+        count_sql = "SELECT SUM(row_count) FROM weather_row_counts WHERE table_name = %s"
+        total_hourly = _fetch_scalar(conn, count_sql, ('hourly',))
+        total_daily = _fetch_scalar(conn, count_sql, ('daily',))
         
         if location_name:
-            # 获取指定城市的记录数
-            target_hourly = pd.read_sql_query(
-                "SELECT COUNT(*) as count FROM hourly_weather WHERE location_name = %s", 
-                conn, params=[location_name]
-            ).iloc[0]['count']
-            
-            target_daily = pd.read_sql_query(
-                "SELECT COUNT(*) as count FROM daily_weather WHERE location_name = %s", 
-                conn, params=[location_name]
-            ).iloc[0]['count']
-            
-            other_hourly = pd.read_sql_query(
-                "SELECT COUNT(*) as count FROM hourly_weather WHERE location_name != %s", 
-                conn, params=[location_name]
-            ).iloc[0]['count']
-            
-            other_daily = pd.read_sql_query(
-                "SELECT COUNT(*) as count FROM daily_weather WHERE location_name != %s", 
-                conn, params=[location_name]
-            ).iloc[0]['count']
+            # 获取指定城市的记录数，其他城市 = 总数 - 指定城市
+            target_sql = count_sql + " AND location_name = %s"
+            target_hourly = _fetch_scalar(conn, target_sql, ('hourly', location_name))
+            target_daily = _fetch_scalar(conn, target_sql, ('daily', location_name))
             
             result = {
                 'target_hourly': target_hourly,
                 'target_daily': target_daily,
-                'other_hourly': other_hourly,
-                'other_daily': other_daily
+                'other_hourly': total_hourly - target_hourly,
+                'other_daily': total_daily - target_daily
             }
         else:
             # 获取所有数据的总统计
-            total_hourly = pd.read_sql_query("SELECT COUNT(*) as count FROM hourly_weather", conn).iloc[0]['count']
-            total_daily = pd.read_sql_query("SELECT COUNT(*) as count FROM daily_weather", conn).iloc[0]['count']
-            
             result = {
                 'total_hourly': total_hourly,
                 'total_daily': total_daily
             }
         
-        conn.close()
         return result
         
     except Exception as e:
         print(f"❌ 获取统计信息失败: {e}")
         return None
+    finally:
+        if 'conn' in locals():
+            release_mysql_connection(conn)
 
 if __name__ == "__main__":
     # 测试数据库连接
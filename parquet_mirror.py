@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parquet本地镜像
+每次入库成功后，把当天的小时和每日数据导出到按日期分区的本地Parquet数据集：
+    <PARQUET_MIRROR_DIR>/hourly/day=YYYY-MM-DD/part-0.parquet
+    <PARQUET_MIRROR_DIR>/daily/day=YYYY-MM-DD/part-0.parquet
+分析查询通过内存映射读取Arrow数据，按分区裁剪，不访问MySQL。
+"""
+
+import os
+from datetime import timedelta
+
+import weather_query
+
+# 镜像配置：数据集根目录、Parquet压缩算法
+PARQUET_MIRROR_DIR = os.getenv('PARQUET_MIRROR_DIR', 'data/parquet')
+PARQUET_COMPRESSION = os.getenv('PARQUET_COMPRESSION', 'zstd')
+
+MIRROR_TABLES = ('hourly', 'daily')
+
+
+def _partition_dir(root, table_name, day):
+    return os.path.join(root or PARQUET_MIRROR_DIR, table_name, f"day={day:%Y-%m-%d}")
+
+
+def _write_partition(root, table_name, day, columns):
+    """把一天的数据写为一个Parquet文件：先写临时文件再原子替换，重复导出同一天是幂等的"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.table({name: pa.array(values) for name, values in columns.items()})
+    directory = _partition_dir(root, table_name, day)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "part-0.parquet")
+    tmp_path = path + ".tmp"
+    pq.write_table(table, tmp_path, compression=PARQUET_COMPRESSION)
+    os.replace(tmp_path, path)
+    return table.num_rows
+
+
+def export_day(day, root=None):
+    """从MySQL读取某一天的小时和每日数据，写入镜像中对应的日期分区
+
+    Args:
+        day: datetime.date
+        root: 数据集根目录，默认PARQUET_MIRROR_DIR
+
+    Returns:
+        dict: {'hourly': 行数, 'daily': 行数}，没有数据的表不写文件，行数为0
+    """
+    result = {}
+    for table_name, query in (('hourly', weather_query.query_hourly_range),
+                              ('daily', weather_query.query_daily_range)):
+        columns = query(day, day, output='numpy', use_cache=False)
+        rows = len(next(iter(columns.values())))
+        result[table_name] = _write_partition(root, table_name, day, columns) if rows else 0
+    return result
+
+
+def export_range(start_date, end_date, root=None):
+    """逐日导出日期范围（含两端），返回导出的总行数 {'hourly': ..., 'daily': ...}"""
+    totals = {table_name: 0 for table_name in MIRROR_TABLES}
+    day = start_date
+    while day <= end_date:
+        counts = export_day(day, root)
+        for table_name, count in counts.items():
+            totals[table_name] += count
+        print(f"📦 {day} 已导出: 小时数据{counts['hourly']}条，每日数据{counts['daily']}条")
+        day += timedelta(days=1)
+    return totals
+
+
+def open_dataset(table_name='hourly', root=None):
+    """打开镜像数据集（pyarrow.dataset.Dataset），文件通过内存映射读取"""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    if table_name not in MIRROR_TABLES:
+        raise ValueError(f"不支持的表: {table_name}（可选 hourly/daily）")
+    path = os.path.abspath(os.path.join(root or PARQUET_MIRROR_DIR, table_name))
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"镜像数据集不存在: {path}，请先导出")
+    partitioning = ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+    return ds.dataset(path, format='parquet', partitioning=partitioning,
+                      filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def _build_filter(start_date=None, end_date=None, province=None, city=None, location_ids=None):
+    import pyarrow.dataset as ds
+
+    conditions = []
+    # day是分区列，日期条件只会读取范围内的分区目录
+    if start_date:
+        conditions.append(ds.field('day') >= f"{start_date:%Y-%m-%d}")
+    if end_date:
+        conditions.append(ds.field('day') <= f"{end_date:%Y-%m-%d}")
+    if province:
+        conditions.append(ds.field('province') == province)
+    if city:
+        conditions.append(ds.field('city') == city)
+    if location_ids:
+        conditions.append(ds.field('location_id').isin([str(location_id) for location_id in location_ids]))
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def _format_table(table, output):
+    if output == 'arrow':
+        return table
+    if output == 'pandas':
+        return table.to_pandas()
+    raise ValueError(f"不支持的输出格式: {output}（可选 arrow/pandas）")
+
+
+def read_mirror(table_name='hourly', start_date=None, end_date=None, columns=None, province=None,
+                city=None, location_ids=None, root=None, output='pandas'):
+    """按条件读取镜像数据
+
+    Args:
+        table_name: 'hourly' 或 'daily'
+        start_date / end_date: 日期范围（datetime.date，包含两端）
+        columns: 需要的列，默认全部
+        province / city / location_ids: 可选的过滤条件
+        root: 数据集根目录
+        output: 'pandas' 返回DataFrame；'arrow' 返回pyarrow.Table（不复制数据）
+    """
+    dataset = open_dataset(table_name, root)
+    table = dataset.to_table(columns=columns,
+                             filter=_build_filter(start_date, end_date, province, city, location_ids))
+    return _format_table(table, output)
+
+
+def aggregate_mirror(table_name='hourly', by=('province',), metrics=(('temp_celsius', 'mean'),),
+                     start_date=None, end_date=None, province=None, city=None, location_ids=None,
+                     root=None, output='pandas'):
+    """在镜像数据上分组聚合，例如多月的各省平均温度
+
+    Args:
+        by: 分组列，可以包含分区列day
+        metrics: (列名, 聚合函数) 列表，聚合函数为pyarrow支持的名称，如mean/min/max/sum/count
+        其余参数同read_mirror
+
+    Returns:
+        结果列名为 分组列 + <列名>_<聚合函数>
+    """
+    by = list(by)
+    needed = list(dict.fromkeys(by + [column for column, _ in metrics]))
+    dataset = open_dataset(table_name, root)
+    table = dataset.to_table(columns=needed,
+                             filter=_build_filter(start_date, end_date, province, city, location_ids))
+    return _format_table(table.group_by(by).aggregate(list(metrics)), output)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+和风天气JWT身份认证
+签名用的Ed25519私钥从配置读取，不再写在代码里：
+    JWT_PRIVATE_KEY       - PEM私钥内容（单行环境变量中可以用 \\n 表示换行）
+    JWT_PRIVATE_KEY_FILE  - 或PEM私钥文件路径，默认 ed25519-private.pem
+    JWT_KID / JWT_SUB     - 凭据ID / 项目ID
+TokenManager缓存签好的Token，在过期前JWT_REFRESH_MARGIN秒自动重新签发，多个线程共享同一个实例；
+请求返回401/403时QWeatherClient调用invalidate重新签发，并用新Token重放一次请求。
+"""
+
+import os
+import threading
+import time
+
+from run_metrics import get_metrics
+
+# JWT配置：私钥、凭据ID、项目ID、有效期（秒）、提前续签的时间（秒）
+JWT_PRIVATE_KEY = os.getenv('JWT_PRIVATE_KEY')
+JWT_PRIVATE_KEY_FILE = os.getenv('JWT_PRIVATE_KEY_FILE', 'ed25519-private.pem')
+JWT_KID = os.getenv('JWT_KID', 'KBB6BQNHM5')
+JWT_SUB = os.getenv('JWT_SUB', '46KWJQQATC')
+JWT_TTL = int(os.getenv('JWT_TTL', '36000'))
+JWT_REFRESH_MARGIN = int(os.getenv('JWT_REFRESH_MARGIN', '600'))
+
+# iat比当前时间提前的秒数，避免本机时钟略快于服务器时Token被判为尚未生效
+JWT_IAT_SKEW = 30
+
+
+def load_private_key():
+    """按配置读取PEM私钥：优先JWT_PRIVATE_KEY，其次JWT_PRIVATE_KEY_FILE
+
+    Raises:
+        ValueError: 两者都没有配置
+    """
+    if JWT_PRIVATE_KEY:
+        return JWT_PRIVATE_KEY.replace('\\n', '\n')
+    if JWT_PRIVATE_KEY_FILE and os.path.exists(JWT_PRIVATE_KEY_FILE):
+        with open(JWT_PRIVATE_KEY_FILE, 'r', encoding='utf-8') as f:
+            return f.read()
+    raise ValueError(f"未配置JWT私钥：请设置JWT_PRIVATE_KEY，或把PEM私钥保存到{JWT_PRIVATE_KEY_FILE}"
+                     f"（路径可用JWT_PRIVATE_KEY_FILE修改）")
+
+
+class TokenManager:
+    """线程安全的JWT Token缓存
+
+    get()返回缓存的Token，距过期不足refresh_margin秒时重新签发；
+    invalidate(token)在某个Token被服务器拒绝时调用，只有它仍是当前Token时才重新签发，
+    并发的多个请求同时收到401/403也只会重签一次。
+
+    Args:
+        private_key: PEM私钥，默认按load_private_key()读取
+        kid / sub: 凭据ID / 项目ID，默认JWT_KID / JWT_SUB
+        ttl: 有效期（秒），默认JWT_TTL
+        refresh_margin: 提前续签的时间（秒），默认JWT_REFRESH_MARGIN，最多为有效期的一半
+    """
+
+    def __init__(self, private_key=None, kid=None, sub=None, ttl=None, refresh_margin=None):
+        self.private_key = private_key or load_private_key()
+        self.kid = kid or JWT_KID
+        self.sub = sub or JWT_SUB
+        self.ttl = max(60, int(ttl or JWT_TTL))
+        margin = JWT_REFRESH_MARGIN if refresh_margin is None else refresh_margin
+        self.refresh_margin = min(max(0, int(margin)), self.ttl // 2)
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0
+
+    @property
+    def expires_at(self):
+        """当前Token的过期时间（Unix时间戳），尚未签发时为0"""
+        return self._expires_at
+
+    def get(self):
+        """返回有效的Token，必要时重新签发"""
+        with self._lock:
+            if self._token is None:
+                self._sign('initial')
+            elif time.time() >= self._expires_at - self.refresh_margin:
+                self._sign('expiry')
+            return self._token
+
+    def invalidate(self, token):
+        """token被服务器拒绝（401/403）：它仍是当前Token时重新签发，返回可用于重放的Token"""
+        with self._lock:
+            if token == self._token or self._token is None:
+                self._sign('rejected')
+            return self._token
+
+    def _sign(self, reason):
+        """签发新Token（调用方持有锁）"""
+        import jwt
+
+        now = int(time.time())
+        payload = {'iat': now - JWT_IAT_SKEW, 'exp': now + self.ttl, 'sub': self.sub}
+        self._token = jwt.encode(payload, self.private_key, algorithm="EdDSA", headers={"kid": self.kid})
+        self._expires_at = now + self.ttl
+        get_metrics().inc('qweather_token_signs_total', reason=reason)
+
+
+_shared_manager = None
+_shared_manager_lock = threading.Lock()
+
+
+def get_token_manager():
+    """获取进程内共享的TokenManager（懒加载），常驻调度的多个任务共用同一个缓存的Token"""
+    global _shared_manager
+    with _shared_manager_lock:
+        if _shared_manager is None:
+            _shared_manager = TokenManager()
+        return _shared_manager
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+和风天气API客户端
+复用带连接池的HTTP会话（keep-alive + gzip），避免每次请求重新TCP/TLS握手
+"""
+
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from qweather_auth import TokenManager
+
+# API配置
+API_HOST = os.getenv('QWEATHER_API_HOST', 'jd46h2979n.re.qweatherapi.com')
+API_BASE = f"https://{API_HOST}"
+HISTORICAL_WEATHER_PATH = "/v7/historical/weather"
+
+# Token过期或被轮换时服务器返回的状态码，使用TokenManager时重签后重放一次
+AUTH_FAILURE_STATUSES = (401, 403)
+
+
+class QWeatherClient:
+    """和风天气API客户端，内部持有一个带连接池的requests.Session
+
+    同一个客户端可以被多个线程共享，连接池大小应不小于并发数。
+
+    Args:
+        token: 默认使用的JWT Token（字符串或TokenManager），也可以在每次请求时单独传入
+        pool_size: 连接池大小，通常设置为并发请求数
+        timeout: 单次请求超时时间（秒）
+        base_url: API地址，默认API_BASE（基准测试时指向本地桩服务）
+    """
+
+    def __init__(self, token=None, pool_size=8, timeout=30, base_url=None):
+        self.token = token
+        self.timeout = timeout
+        self.base_url = (base_url or API_BASE).rstrip('/')
+        self.pool_size = max(1, int(pool_size))
+
+        self.session = requests.Session()
+        # 重试由调用方控制，这里不让urllib3自动重试
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "Connection": "keep-alive",
+            "Content-Type": "application/json"
+        })
+
+    def get_historical_weather(self, location_id, date_str, token=None, rate_limiter=None):
+        """请求指定地区某一天的历史天气（/v7/historical/weather），返回原始Response
+
+        token为TokenManager时使用其缓存的Token，返回401/403时重新签发并重放一次请求。
+        rate_limiter为调用方的限流器：调用方在第一次请求前已取过令牌，重放的请求同样先取令牌，
+        Token轮换时各线程的重放请求也计入共享的请求配额。
+        """
+        token = token or self.token
+        if not isinstance(token, TokenManager):
+            return self._get_historical(location_id, date_str, token)
+        bearer = token.get()
+        response = self._get_historical(location_id, date_str, bearer)
+        if response.status_code in AUTH_FAILURE_STATUSES:
+            response.close()
+            bearer = token.invalidate(bearer)
+            if rate_limiter:
+                rate_limiter.acquire()
+            response = self._get_historical(location_id, date_str, bearer)
+        return response
+
+    def _get_historical(self, location_id, date_str, bearer):
+        headers = {"Authorization": f"Bearer {bearer}"}
+        params = {
+            "location": location_id,
+            "date": date_str
+        }
+        return self.session.get(self.base_url + HISTORICAL_WEATHER_PATH, headers=headers,
+                                params=params, timeout=self.timeout)
+
+    def check_connectivity(self, timeout=10):
+        """检查到API主机的网络连通性，失败时抛出requests异常"""
+        return self.session.get(self.base_url, timeout=timeout)
+
+    def close(self):
+        """关闭会话并释放连接池"""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+
+def get_shared_client(pool_size=8):
+    """获取进程内共享的客户端（懒加载），未显式传入客户端的调用方都会使用它"""
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = QWeatherClient(pool_size=pool_size)
+        return _shared_client
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API原始响应缓存
+每个成功的 /v7/historical/weather 响应按 (location_id, 日期) 压缩保存到本地：
+    <RESPONSE_CACHE_DIR>/YYYYMMDD/<location_id>.json.zst   （安装了zstandard时）
+    <RESPONSE_CACHE_DIR>/YYYYMMDD/<location_id>.json.gz    （否则使用标准库gzip）
+重新入库、表结构迁移或修复保存逻辑后，可以用replay从缓存重建数据库，不再调用付费API。
+缓存总大小超过RESPONSE_CACHE_MAX_MB时，按最近访问时间淘汰最旧的文件。
+"""
+
+import gzip
+import os
+import threading
+
+# 缓存配置：是否写入缓存、缓存目录、容量上限（MB）、压缩算法（auto / zstd / gzip）
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', '0') == '1'
+RESPONSE_CACHE_DIR = os.getenv('RESPONSE_CACHE_DIR', 'data/responses')
+RESPONSE_CACHE_MAX_MB = float(os.getenv('RESPONSE_CACHE_MAX_MB', '2048'))
+RESPONSE_CACHE_COMPRESSION = os.getenv('RESPONSE_CACHE_COMPRESSION', 'auto')
+
+SUFFIXES = {'zstd': '.json.zst', 'gzip': '.json.gz'}
+
+# 淘汰时删到容量上限的这个比例以下，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def _resolve_compression(compression):
+    compression = compression or RESPONSE_CACHE_COMPRESSION
+    if compression == 'auto':
+        return 'zstd' if _zstandard() else 'gzip'
+    if compression not in SUFFIXES:
+        raise ValueError(f"不支持的压缩算法: {compression}（可选 auto/zstd/gzip）")
+    if compression == 'zstd' and not _zstandard():
+        raise ImportError("zstd压缩需要安装zstandard: pip install zstandard")
+    return compression
+
+
+def _compress(data, compression):
+    if compression == 'zstd':
+        return _zstandard().ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, path):
+    if path.endswith(SUFFIXES['zstd']):
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise ImportError(f"读取{path}需要安装zstandard: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+class ResponseCache:
+    """线程安全的本地响应缓存
+
+    Args:
+        root: 缓存目录，默认RESPONSE_CACHE_DIR
+        max_bytes: 容量上限（字节），默认RESPONSE_CACHE_MAX_MB；<=0表示不限制
+        compression: 新写入文件使用的压缩算法，默认RESPONSE_CACHE_COMPRESSION；读取时按后缀自动识别
+    """
+
+    def __init__(self, root=None, max_bytes=None, compression=None):
+        self.root = root or RESPONSE_CACHE_DIR
+        self.max_bytes = RESPONSE_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self.compression = _resolve_compression(compression)
+        self._lock = threading.Lock()
+        self._total_bytes = None  # 首次写入时扫描目录得到，之后增量维护
+
+    def _path(self, location_id, date_str, compression):
+        return os.path.join(self.root, date_str, f"{location_id}{SUFFIXES[compression]}")
+
+    def _find(self, location_id, date_str):
+        for compression in SUFFIXES:
+            path = self._path(location_id, date_str, compression)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def contains(self, location_id, date_str):
+        return self._find(location_id, date_str) is not None
+
+    def get(self, location_id, date_str):
+        """读取缓存的原始响应（解压后的bytes），没有缓存时返回None"""
+        path = self._find(location_id, date_str)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # 记录访问时间，淘汰时优先删除最久未用的文件
+        except FileNotFoundError:
+            return None  # 刚好被其他线程淘汰
+        return _decompress(data, path)
+
+    def put(self, location_id, date_str, content):
+        """保存一个原始响应（bytes），同一 (location_id, 日期) 重复写入时覆盖"""
+        compressed = _compress(content, self.compression)
+        path = self._path(location_id, date_str, self.compression)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        with self._lock:
+            previous = self._find(location_id, date_str)
+            replaced = os.path.getsize(previous) if previous else 0
+            os.replace(tmp_path, path)
+            if previous and previous != path:
+                os.remove(previous)  # 换了压缩算法时删除旧格式的文件
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(compressed) - replaced
+            if 0 < self.max_bytes < self._total_bytes:
+                self._evict()
+
+    def _iter_files(self):
+        if not os.path.isdir(self.root):
+            return
+        for day_entry in os.scandir(self.root):
+            if not day_entry.is_dir():
+                continue
+            for entry in os.scandir(day_entry.path):
+                if entry.is_file() and entry.name.endswith(tuple(SUFFIXES.values())):
+                    yield entry
+
+    def _scan_size(self):
+        return sum(entry.stat().st_size for entry in self._iter_files())
+
+    def _evict(self):
+        """按最近访问时间从旧到新删除文件，直到总大小降到上限的EVICT_TARGET_RATIO以下（调用方持有锁）"""
+        files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._iter_files()))
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        removed = 0
+        directories = set()
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+            directories.add(os.path.dirname(path))
+        for directory in directories:
+            if not os.listdir(directory):
+                os.rmdir(directory)  # 整天的文件都被淘汰时删除空目录
+        self._total_bytes = total
+        if removed:
+            print(f"🧹 响应缓存超过{self.max_bytes / 1024 / 1024:.0f}MB，已淘汰{removed}个最久未用的文件")
+
+    def cached_dates(self):
+        """返回缓存中已有的日期（YYYYMMDD）列表"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(entry.name for entry in os.scandir(self.root) if entry.is_dir())
+
+    def cached_location_ids(self, date_str):
+        """返回某一天已缓存的location_id集合"""
+        directory = os.path.join(self.root, date_str)
+        if not os.path.isdir(directory):
+            return set()
+        location_ids = set()
+        for name in os.listdir(directory):
+            for suffix in SUFFIXES.values():
+                if name.endswith(suffix):
+                    location_ids.add(name[:-len(suffix)])
+        return location_ids
+
+    def stats(self):
+        """返回 {'files': 文件数, 'bytes': 总大小, 'dates': 日期数}"""
+        files = 0
+        total = 0
+        for entry in self._iter_files():
+            files += 1
+            total += entry.stat().st_size
+        return {'files': files, 'bytes': total, 'dates': len(self.cached_dates())}
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """获取进程内共享的响应缓存（懒加载）"""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = ResponseCache()
+        return _shared_cache
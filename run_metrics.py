@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行指标
+进程内的计数器、仪表和直方图：请求延迟、重试、各阶段耗时（HTTP、JSON解析、省市查询、行转换、入库）、
+写入行数、数据库批次延迟和流水线队列深度。
+每次运行结束后输出两份文件，便于按夜比较回归：
+    <RUN_REPORT_DIR>/run_<命令>_<时间>.json          机器可读的运行报告
+    <METRICS_TEXTFILE_DIR>/qweather_<命令>.prom     Prometheus textfile（node_exporter textfile collector）
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 指标配置：是否输出报告文件、JSON报告目录、Prometheus textfile目录
+RUN_METRICS = os.getenv('RUN_METRICS', '1') == '1'
+RUN_REPORT_DIR = os.getenv('RUN_REPORT_DIR', 'logs/reports')
+METRICS_TEXTFILE_DIR = os.getenv('METRICS_TEXTFILE_DIR', 'logs/metrics')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+# 指标定义：名称 -> (类型, 说明, 直方图分桶)
+METRIC_DEFINITIONS = {
+    'qweather_request_seconds': ('histogram', 'QWeather API单次HTTP请求耗时（秒）', LATENCY_BUCKETS),
+    'qweather_requests_total': ('counter', 'QWeather API请求数，按结果分类', None),
+    'qweather_retries_total': ('counter', '单个地区获取的重试次数', None),
+    'qweather_request_rate': ('gauge', '自适应限流器当前的请求速率（次/秒）', None),
+    'qweather_rate_decreases_total': ('counter', '自适应限流器降速次数，按原因分类', None),
+    'qweather_stage_seconds': ('histogram', '各处理阶段单次耗时（秒）', LATENCY_BUCKETS),
+    'qweather_db_batch_seconds': ('histogram', '数据库单批写入事务耗时（秒）', LATENCY_BUCKETS),
+    'qweather_db_batch_errors_total': ('counter', '写入失败的数据库批次数', None),
+    'qweather_db_deadlock_retries_total': ('counter', '数据库批次因死锁回滚后重试的次数', None),
+    'qweather_rows_written_total': ('counter', '写入数据库的行数，按新增/更新/失败分类', None),
+    'qweather_queue_depth': ('histogram', '流水线入队时的队列深度', DEPTH_BUCKETS),
+    'qweather_spool_segments_total': ('counter', '本地写入暂存区的段数，按事件分类（written/committed/replayed）', None),
+    'qweather_spool_pending_segments': ('gauge', '本地写入暂存区中等待入库的段数', None),
+    'qweather_job_runs_total': ('counter', '调度守护进程中任务的运行次数，按结果分类（ok/failed/skipped）', None),
+    'qweather_job_last_exit_code': ('gauge', '调度任务最近一次运行的退出码', None),
+    'qweather_job_last_duration_seconds': ('gauge', '调度任务最近一次运行的耗时（秒）', None),
+    'qweather_job_last_finished_timestamp_seconds': ('gauge', '调度任务最近一次运行的结束时间（Unix时间戳）', None),
+    'qweather_token_signs_total': ('counter', 'JWT Token签发次数，按原因分类（initial/expiry/rejected）', None),
+    'qweather_locations': ('gauge', '本次运行的地区数，按状态分类', None),
+    'qweather_run_duration_seconds': ('gauge', '本次运行总耗时（秒）', None),
+    'qweather_run_exit_code': ('gauge', '本次运行的退出码', None),
+    'qweather_run_timestamp_seconds': ('gauge', '本次运行结束时间（Unix时间戳）', None),
+}
+
+# 合并多个分片的报告时取最大值的仪表，其余仪表求和
+MAX_MERGED_GAUGES = {'qweather_request_rate', 'qweather_run_duration_seconds', 'qweather_run_exit_code',
+                     'qweather_run_timestamp_seconds'}
+
+
+def _label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class _Histogram:
+    """固定分桶直方图，另外记录总数、总和与最值"""
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)  # 非累计，落在各桶内的次数（超过最大上界的只计入count）
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """按分桶线性插值估算分位数，落在最大上界之外时返回观测到的最大值"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = self.min
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                upper = min(bound, self.max)
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+            lower = max(bound, self.min)
+        return self.max
+
+    def merge(self, data):
+        """合并to_dict输出的另一个直方图（分桶必须相同）"""
+        if len(data.get('buckets') or []) != len(self.buckets):
+            raise ValueError("直方图分桶不一致，无法合并")
+        for index, bucket_count in enumerate(data['buckets']):
+            self.counts[index] += bucket_count
+        if data['count']:
+            self.count += data['count']
+            self.sum += data['sum']
+            self.min = min(self.min, data['min'])
+            self.max = max(self.max, data['max'])
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.counts),
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / self.count, 6) if self.count else None,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """线程安全的进程内指标注册表
+
+    指标名必须在METRIC_DEFINITIONS中定义，标签以关键字参数传入，例如：
+        metrics.inc('qweather_requests_total', result='ok')
+        with metrics.timer('qweather_stage_seconds', stage='parse'): ...
+
+    Args:
+        parent: 可选的上级注册表，记录的指标同时加上parent_labels写入上级
+            （常驻调度中每个任务有自己的注册表，进程的/metrics仍能看到按任务区分的累计值）
+        parent_labels: 写入上级注册表时附加的标签，如 {'job': 任务名}
+    """
+
+    def __init__(self, parent=None, parent_labels=None):
+        self._lock = threading.Lock()
+        self._parent = parent
+        self._parent_labels = dict(parent_labels or {})
+        self.reset()
+
+    def reset(self):
+        """清空所有指标和运行信息，每次运行开始时调用"""
+        with self._lock:
+            self._values = {}  # (指标名, 标签) -> 数值或_Histogram
+            self._info = {}
+
+    def _definition(self, name, expected_type):
+        definition = METRIC_DEFINITIONS.get(name)
+        if definition is None or definition[0] != expected_type:
+            raise ValueError(f"未定义的{expected_type}指标: {name}")
+        return definition
+
+    def inc(self, name, value=1, **labels):
+        self._definition(name, 'counter')
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+        if self._parent:
+            self._parent.inc(name, value, **{**self._parent_labels, **labels})
+
+    def set_gauge(self, name, value, **labels):
+        self._definition(name, 'gauge')
+        with self._lock:
+            self._values[(name, _label_key(labels))] = value
+        if self._parent:
+            self._parent.set_gauge(name, value, **{**self._parent_labels, **labels})
+
+    def observe(self, name, value, **labels):
+        buckets = self._definition(name, 'histogram')[2]
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._values.get(key)
+            if histogram is None:
+                histogram = self._values[key] = _Histogram(buckets)
+            histogram.observe(value)
+        if self._parent:
+            self._parent.observe(name, value, **{**self._parent_labels, **labels})
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """统计代码块耗时并记入直方图（代码块抛出异常时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def annotate(self, **fields):
+        """记录本次运行的附加信息（如处理日期、地区数），只写入JSON报告"""
+        with self._lock:
+            self._info.update(fields)
+
+    def histogram_summary(self, name):
+        """返回某个直方图各标签组合的 {标签字符串: 统计字典}，用于日志输出"""
+        with self._lock:
+            return {','.join(f"{k}={v}" for k, v in labels) or name: value.to_dict()
+                    for (metric, labels), value in self._values.items() if metric == name}
+
+    def snapshot(self):
+        """返回可JSON序列化的指标快照：{指标名: [{'labels': {...}, 'value': ...}, ...]}"""
+        result = {}
+        with self._lock:
+            for (name, labels), value in sorted(self._values.items(), key=lambda item: item[0]):
+                value = value.to_dict() if isinstance(value, _Histogram) else value
+                result.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            info = dict(self._info)
+        return result, info
+
+    def merge_snapshot(self, metrics):
+        """把snapshot()输出的指标合并进来：计数器和直方图累加，仪表按MAX_MERGED_GAUGES取最大值或求和"""
+        with self._lock:
+            for name, series in metrics.items():
+                definition = METRIC_DEFINITIONS.get(name)
+                if definition is None:
+                    continue
+                metric_type, _, buckets = definition
+                for item in series:
+                    key = (name, _label_key(item['labels']))
+                    value = item['value']
+                    if metric_type == 'histogram':
+                        histogram = self._values.get(key)
+                        if histogram is None:
+                            histogram = self._values[key] = _Histogram(buckets)
+                        histogram.merge(value)
+                    elif key not in self._values:
+                        self._values[key] = value
+                    elif metric_type == 'gauge' and name in MAX_MERGED_GAUGES:
+                        self._values[key] = max(self._values[key], value)
+                    else:
+                        self._values[key] += value
+
+    def value(self, name, **labels):
+        """返回计数器或仪表的当前值，不存在时返回0"""
+        with self._lock:
+            return self._values.get((name, _label_key(labels)), 0)
+
+    def total(self, name, **labels):
+        """返回计数器或仪表在所有标签组合中匹配labels部分的合计"""
+        wanted = set(_label_key(labels))
+        with self._lock:
+            return sum(value for (metric, key), value in self._values.items()
+                       if metric == name and wanted <= set(key) and not isinstance(value, _Histogram))
+
+    def to_prometheus(self, extra_labels=None):
+        """按Prometheus文本格式输出所有指标，extra_labels会附加到每个序列（如分片编号），序列已有的同名标签不覆盖"""
+        extra = _label_key(extra_labels or {})
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda item: item[0])
+            lines = []
+            current = None
+            for (name, labels), value in items:
+                label_names = {label for label, _ in labels}
+                labels = labels + tuple(pair for pair in extra if pair[0] not in label_names)
+                metric_type, help_text, _ = METRIC_DEFINITIONS[name]
+                if name != current:
+                    lines.append(f"# HELP {name} {help_text}")
+                    lines.append(f"# TYPE {name} {metric_type}")
+                    current = name
+                if isinstance(value, _Histogram):
+                    cumulative = 0
+                    for bound, bucket_count in zip(value.buckets, value.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_number(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(labels, ('le', '+Inf'))} {value.count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(value.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {value.count}")
+                else:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_number(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _escape_label_value(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+_metrics = MetricsRegistry()
+_local = threading.local()
+
+
+def get_metrics():
+    """返回当前线程使用的指标注册表：在use_metrics中（如常驻调度的任务）为绑定的注册表，否则为进程内共享的注册表"""
+    return getattr(_local, 'registry', None) or _metrics
+
+
+@contextmanager
+def use_metrics(registry):
+    """在当前线程中把get_metrics()切换为registry，退出时恢复；新开的线程需用bind_metrics包装才会继承"""
+    previous = getattr(_local, 'registry', None)
+    _local.registry = registry
+    try:
+        yield registry
+    finally:
+        _local.registry = previous
+
+
+def bind_metrics(func):
+    """包装要在其他线程中执行的函数，使其记录到调用bind_metrics时当前线程使用的注册表"""
+    registry = get_metrics()
+
+    def wrapper(*args, **kwargs):
+        with use_metrics(registry):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _atomic_write(path, content):
+    """先写临时文件再替换，避免采集端读到写了一半的文件"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _shard_suffix(shard):
+    return f"_shard{shard[0]}of{shard[1]}" if shard else ""
+
+
+def _job_suffix(job):
+    return "_" + re.sub(r'[^\w.-]', '_', job) if job else ""
+
+
+def write_run_report(command, exit_code, started_at, finished_at=None, report_dir=None, textfile_dir=None,
+                     shard=None, job=None, registry=None):
+    """输出本次运行的JSON报告和Prometheus textfile
+
+    Args:
+        command: 运行的命令名（daily / backfill 等），用于文件名和报告内容
+        exit_code: 退出码
+        started_at / finished_at: 开始与结束时间（datetime），finished_at默认为当前时间
+        report_dir / textfile_dir: 输出目录，默认RUN_REPORT_DIR和METRICS_TEXTFILE_DIR
+        shard: 可选的 (分片编号, 分片总数)，写入文件名、报告和Prometheus的shard标签
+        job: 可选的调度任务名，写入文件名、报告和Prometheus的job标签
+        registry: 输出哪个注册表，默认当前线程使用的注册表（见get_metrics）
+
+    Returns:
+        tuple: (JSON报告路径, textfile路径)，RUN_METRICS=0时返回 (None, None)
+    """
+    if not RUN_METRICS:
+        return None, None
+    finished_at = finished_at or datetime.now()
+    duration = (finished_at - started_at).total_seconds()
+    registry = registry or get_metrics()
+    registry.set_gauge('qweather_run_duration_seconds', duration, command=command)
+    registry.set_gauge('qweather_run_exit_code', exit_code, command=command)
+    registry.set_gauge('qweather_run_timestamp_seconds', finished_at.timestamp(), command=command)
+
+    metrics, info = registry.snapshot()
+    report = {
+        'command': command,
+        'shard': f"{shard[0]}/{shard[1]}" if shard else None,
+        'job': job,
+        'exit_code': exit_code,
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'finished_at': finished_at.isoformat(timespec='seconds'),
+        'duration_seconds': round(duration, 3),
+        'info': info,
+        'metrics': metrics,
+    }
+    suffix = _shard_suffix(shard) + _job_suffix(job)
+    report_path = os.path.join(report_dir or RUN_REPORT_DIR,
+                               f"run_{command}{suffix}_{started_at:%Y%m%d_%H%M%S}.json")
+    _atomic_write(report_path, json.dumps(report, ensure_ascii=False, indent=2, default=str))
+    textfile_path = os.path.join(textfile_dir or METRICS_TEXTFILE_DIR, f"qweather_{command}{suffix}.prom")
+    extra_labels = {}
+    if shard:
+        extra_labels['shard'] = f"{shard[0]}/{shard[1]}"
+    if job:
+        extra_labels['job'] = job
+    _atomic_write(textfile_path, registry.to_prometheus(extra_labels))
+    return report_path, textfile_path
+
+
+def merge_run_reports(report_paths, report_dir=None, textfile_dir=None):
+    """合并多个分片（或多台机器）的运行报告为一份汇总
+
+    计数器和直方图累加，地区数等仪表求和，耗时、退出码取最大值。
+    汇总报告写为 run_<命令>_merged_<时间>.json，Prometheus textfile写为 qweather_<命令>.prom。
+
+    Args:
+        report_paths: 各分片JSON报告的路径列表
+        report_dir / textfile_dir: 输出目录，默认RUN_REPORT_DIR和METRICS_TEXTFILE_DIR
+
+    Returns:
+        tuple: (汇总报告dict, JSON报告路径, textfile路径)
+    """
+    reports = []
+    for path in report_paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    if not reports:
+        raise ValueError("没有可合并的运行报告")
+
+    commands = sorted({report['command'] for report in reports})
+    command = commands[0] if len(commands) == 1 else '+'.join(commands)
+    registry = MetricsRegistry()
+    for report in reports:
+        registry.merge_snapshot(report['metrics'])
+
+    started_at = min(datetime.fromisoformat(report['started_at']) for report in reports)
+    finished_at = max(datetime.fromisoformat(report['finished_at']) for report in reports)
+    metrics, _ = registry.snapshot()
+    merged = {
+        'command': command,
+        'merged_from': len(reports),
+        'exit_code': max(report['exit_code'] for report in reports),
+        'started_at': started_at.isoformat(timespec='seconds'),
+        'finished_at': finished_at.isoformat(timespec='seconds'),
+        'duration_seconds': round((finished_at - started_at).total_seconds(), 3),
+        'summary': {
+            'success': registry.value('qweather_locations', status='success'),
+            'failed': registry.value('qweather_locations', status='failed'),
+            'hourly_rows': registry.total('qweather_rows_written_total', table='hourly'),
+            'daily_rows': registry.total('qweather_rows_written_total', table='daily'),
+            'requests': registry.total('qweather_requests_total'),
+            'retries': registry.total('qweather_retries_total'),
+        },
+        'shards': [{'shard': report.get('shard'), 'exit_code': report['exit_code'],
+                    'duration_seconds': report['duration_seconds'], 'info': report.get('info', {}), 'path': path}
+                   for report, path in zip(reports, report_paths)],
+        'metrics': metrics,
+    }
+    report_path = os.path.join(report_dir or RUN_REPORT_DIR, f"run_{command}_merged_{started_at:%Y%m%d_%H%M%S}.json")
+    _atomic_write(report_path, json.dumps(merged, ensure_ascii=False, indent=2, default=str))
+    textfile_path = os.path.join(textfile_dir or METRICS_TEXTFILE_DIR, f"qweather_{command}.prom")
+    _atomic_write(textfile_path, registry.to_prometheus())
+    return merged, report_path, textfile_path
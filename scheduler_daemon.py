@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+常驻调度守护进程
+在一个进程内按cron表达式调度多个收集任务（全国、各省CSV、回溯、缺口补齐等），
+任务之间共享预热的HTTP连接池、数据库连接池和同一个全局限流器（API预算），不再每次冷启动。
+任务状态通过本地HTTP端点查看：
+    GET  /status              - 守护进程和所有任务的状态（JSON）
+    GET  /metrics             - 进程累计的运行指标（Prometheus文本格式）
+    POST /jobs/<任务名>/run   - 立即触发一次任务
+任务配置为JSON文件（SCHEDULER_CONFIG），args与命令行参数相同：
+    {"jobs": [
+        {"name": "national", "cron": "0 2 * * *", "args": []},
+        {"name": "shandong", "cron": "0 11 * * *", "args": ["--csv", "全国城市（区分省）/山东省.csv"]},
+        {"name": "gaps", "cron": "0 6 * * 1", "args": ["gaps", "--start", "today-7", "--end", "yesterday", "--fill"]}
+    ]}
+"""
+
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from run_metrics import get_metrics
+
+# 调度配置：任务配置文件、同时运行的任务数、状态端点地址（端口为0时不启动）
+SCHEDULER_CONFIG = os.getenv('SCHEDULER_CONFIG', 'scheduler.json')
+SCHEDULER_MAX_JOBS = int(os.getenv('SCHEDULER_MAX_JOBS', '2'))
+SCHEDULER_STATUS_HOST = os.getenv('SCHEDULER_STATUS_HOST', '127.0.0.1')
+SCHEDULER_STATUS_PORT = int(os.getenv('SCHEDULER_STATUS_PORT', '8765'))
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+
+# 调度循环最长休眠时间（秒），系统时间被调整后最迟这么久就会重新计算
+MAX_SLEEP_SECONDS = 60
+
+
+def _parse_cron_field(text, low, high):
+    """解析cron的一个字段，支持 * / 数字 / a-b / 步长 /n / 逗号列表"""
+    values = set()
+    for part in text.split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+            if step < 1:
+                raise ValueError(f"无效步长: {text}")
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_text, end_text = part.split('-', 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start  # "5/15" 表示从5开始每15
+        if not low <= start <= end <= high:
+            raise ValueError(f"超出范围 {low}-{high}: {text}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """5字段cron表达式（分 时 日 月 周），按本地时间计算
+
+    周字段0和7都表示周日；日和周都不是*时，两者满足其一即可（与标准cron一致）。
+    另外支持 @hourly / @daily / @weekly / @monthly。
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = CRON_ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式应为5个字段（分 时 日 月 周）: {expression}")
+        try:
+            self.minutes = _parse_cron_field(fields[0], 0, 59)
+            self.hours = _parse_cron_field(fields[1], 0, 23)
+            self.days = _parse_cron_field(fields[2], 1, 31)
+            self.months = _parse_cron_field(fields[3], 1, 12)
+            self.weekdays = {day % 7 for day in _parse_cron_field(fields[4], 0, 7)}
+        except ValueError as e:
+            raise ValueError(f"无效的cron表达式 {expression}: {e}") from None
+        self._any_day = fields[2] == '*'
+        self._any_weekday = fields[4] == '*'
+
+    def _day_matches(self, moment):
+        weekday = (moment.weekday() + 1) % 7  # Python周一为0，cron周日为0
+        if self._any_day and self._any_weekday:
+            return True
+        if self._any_day:
+            return weekday in self.weekdays
+        if self._any_weekday:
+            return moment.day in self.days
+        return moment.day in self.days or weekday in self.weekdays
+
+    def next_after(self, moment):
+        """返回严格晚于moment的下一个触发时间（整分钟）"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)  # 2月29日这类表达式最多等几年
+        while candidate < limit:
+            if candidate.month not in self.months:
+                first_of_month = candidate.replace(day=1, hour=0, minute=0)
+                candidate = (first_of_month + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"cron表达式没有可执行的时间: {self.expression}")
+
+
+class ScheduledJob:
+    """一个调度任务及其运行状态"""
+
+    def __init__(self, name, cron, args):
+        self.name = name
+        self.cron = CronExpression(cron)
+        self.args = list(args)
+        self.next_run = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.last_started_at = None
+        self.last_finished_at = None
+        self.last_exit_code = None
+
+    def to_dict(self):
+        def iso(moment):
+            return moment.isoformat(timespec='seconds') if moment else None
+        duration = None
+        if self.last_started_at and self.last_finished_at and self.last_finished_at >= self.last_started_at:
+            duration = round((self.last_finished_at - self.last_started_at).total_seconds(), 3)
+        return {
+            'name': self.name,
+            'cron': self.cron.expression,
+            'args': self.args,
+            'running': self.running,
+            'next_run': iso(self.next_run),
+            'last_started_at': iso(self.last_started_at),
+            'last_finished_at': iso(self.last_finished_at),
+            'last_duration_seconds': duration,
+            'last_exit_code': self.last_exit_code,
+            'runs': self.runs,
+            'failures': self.failures,
+            'skipped': self.skipped,
+        }
+
+
+def load_jobs(path=None, validate=None):
+    """读取任务配置文件，返回ScheduledJob列表
+
+    Args:
+        path: JSON配置文件路径，默认SCHEDULER_CONFIG
+        validate: 可选回调，以每个任务的args调用，参数无效时抛出ValueError
+
+    Raises:
+        OSError: 配置文件无法读取
+        ValueError: 配置格式、cron表达式或任务参数无效
+    """
+    path = path or SCHEDULER_CONFIG
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    jobs = []
+    names = set()
+    for entry in config.get('jobs', []):
+        name = entry.get('name')
+        if not name or name in names:
+            raise ValueError(f"任务名为空或重复: {name!r}")
+        if 'cron' not in entry:
+            raise ValueError(f"任务 {name} 缺少cron表达式")
+        names.add(name)
+        args = entry.get('args', [])
+        if validate:
+            try:
+                validate(args)
+            except ValueError as e:
+                raise ValueError(f"任务 {name} 的参数无效: {e}") from None
+        jobs.append(ScheduledJob(name, entry['cron'], args))
+    if not jobs:
+        raise ValueError(f"{path} 中没有配置任务")
+    return jobs
+
+
+class JobLoggerAdapter(logging.LoggerAdapter):
+    """在日志前加上任务名，多个任务并发运行时便于区分"""
+
+    def process(self, msg, kwargs):
+        return f"[{self.extra['job']}] {msg}", kwargs
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    """状态端点：/status、/metrics、POST /jobs/<任务名>/run"""
+
+    def do_GET(self):
+        daemon = self.server.scheduler
+        if self.path.rstrip('/') in ('', '/status'):
+            self._send(200, 'application/json; charset=utf-8',
+                       json.dumps(daemon.status(), ensure_ascii=False, indent=2))
+        elif self.path == '/metrics':
+            self._send(200, 'text/plain; version=0.0.4; charset=utf-8', get_metrics().to_prometheus())
+        else:
+            self._send(404, 'application/json; charset=utf-8', json.dumps({'error': 'not found'}))
+
+    def do_POST(self):
+        daemon = self.server.scheduler
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'jobs' or parts[2] != 'run':
+            self._send(404, 'application/json; charset=utf-8', json.dumps({'error': 'not found'}))
+            return
+        result = daemon.trigger(parts[1])
+        status = {'started': 202, 'running': 409, 'unknown': 404}[result]
+        self._send(status, 'application/json; charset=utf-8', json.dumps({'job': parts[1], 'result': result}))
+
+    def _send(self, status, content_type, body):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # 状态查询不写入运行日志
+
+
+class SchedulerDaemon:
+    """按cron表达式调度任务的常驻进程
+
+    同一任务上一次还在运行时跳过本次触发；不同任务最多同时运行max_jobs个。
+
+    Args:
+        jobs: ScheduledJob列表
+        runner: 执行任务的回调 runner(args, logger, name) -> 退出码，在工作线程中调用
+        logger: 日志对象，每个任务使用带任务名前缀的适配器
+        max_jobs: 同时运行的任务数，默认SCHEDULER_MAX_JOBS
+        status_host / status_port: 状态端点地址，默认SCHEDULER_STATUS_HOST / SCHEDULER_STATUS_PORT
+        extra_status: 可选回调，返回的dict会合并到/status的输出中（如当前请求速率）
+    """
+
+    def __init__(self, jobs, runner, logger, max_jobs=None, status_host=None, status_port=None, extra_status=None):
+        self.jobs = {job.name: job for job in jobs}
+        self.runner = runner
+        self.logger = logger
+        self.max_jobs = max(1, int(max_jobs or SCHEDULER_MAX_JOBS))
+        self.status_host = status_host or SCHEDULER_STATUS_HOST
+        self.status_port = SCHEDULER_STATUS_PORT if status_port is None else status_port
+        self.extra_status = extra_status
+        self.started_at = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="job")
+        self._server = None
+
+    def status(self):
+        """返回守护进程和所有任务的状态"""
+        with self._lock:
+            jobs = [job.to_dict() for job in self.jobs.values()]
+        status = {
+            'started_at': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+            'uptime_seconds': round((datetime.now() - self.started_at).total_seconds(), 1) if self.started_at else 0,
+            'max_jobs': self.max_jobs,
+            'running_jobs': [job['name'] for job in jobs if job['running']],
+            'jobs': jobs,
+        }
+        if self.extra_status:
+            status.update(self.extra_status())
+        return status
+
+    def trigger(self, name):
+        """立即运行一次任务，返回 'started' / 'running'（上一次尚未结束）/ 'unknown'"""
+        job = self.jobs.get(name)
+        if job is None:
+            return 'unknown'
+        return 'started' if self._submit(job, reason="手动触发") else 'running'
+
+    def _submit(self, job, reason):
+        with self._lock:
+            if job.running:
+                job.skipped += 1
+                get_metrics().inc('qweather_job_runs_total', job=job.name, result='skipped')
+                self.logger.warning(f"⏭️ 任务 {job.name} 上一次仍在运行，跳过本次{reason}")
+                return False
+            job.running = True
+            job.last_started_at = datetime.now()
+        self.logger.info(f"▶️ 任务 {job.name} 开始（{reason}）: {' '.join(job.args) or '每日收集'}")
+        self._executor.submit(self._run_job, job)
+        return True
+
+    def _run_job(self, job):
+        job_logger = JobLoggerAdapter(self.logger, {'job': job.name})
+        start = time.monotonic()
+        exit_code = 1
+        try:
+            exit_code = self.runner(job.args, job_logger, job.name)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            job_logger.exception(f"❌ 任务异常: {e}")
+        duration = time.monotonic() - start
+        finished_at = datetime.now()
+        with self._lock:
+            job.running = False
+            job.runs += 1
+            job.last_finished_at = finished_at
+            job.last_exit_code = exit_code
+            if exit_code != 0:
+                job.failures += 1
+        metrics = get_metrics()
+        metrics.inc('qweather_job_runs_total', job=job.name, result='ok' if exit_code == 0 else 'failed')
+        metrics.set_gauge('qweather_job_last_exit_code', exit_code, job=job.name)
+        metrics.set_gauge('qweather_job_last_duration_seconds', duration, job=job.name)
+        metrics.set_gauge('qweather_job_last_finished_timestamp_seconds', finished_at.timestamp(), job=job.name)
+        icon = "✅" if exit_code == 0 else "❌"
+        self.logger.info(f"{icon} 任务 {job.name} 结束，退出码{exit_code}，耗时{duration:.1f}秒，"
+                         f"下次运行 {job.next_run:%Y-%m-%d %H:%M}")
+
+    def _start_status_server(self):
+        if not self.status_port:
+            return
+        try:
+            self._server = ThreadingHTTPServer((self.status_host, self.status_port), _StatusHandler)
+        except OSError as e:
+            self.logger.warning(f"⚠️ 状态端点启动失败（{self.status_host}:{self.status_port}）: {e}")
+            return
+        self._server.daemon_threads = True
+        self._server.scheduler = self
+        threading.Thread(target=self._server.serve_forever, name="status-server", daemon=True).start()
+        self.logger.info(f"📡 状态端点: http://{self.status_host}:{self._server.server_address[1]}/status")
+
+    def stop(self):
+        """请求停止调度（可在信号处理函数中调用），正在运行的任务会执行完"""
+        self._stop.set()
+
+    def serve_forever(self):
+        """在当前线程运行调度循环，收到SIGTERM/SIGINT或调用stop()后等待运行中的任务结束再返回"""
+        self.started_at = datetime.now()
+        for job in self.jobs.values():
+            job.next_run = job.cron.next_after(self.started_at)
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *_: self.stop())
+        self._start_status_server()
+        self.logger.info(f"🗓️ 调度守护进程启动: {len(self.jobs)}个任务，最多同时运行{self.max_jobs}个")
+        for job in self.jobs.values():
+            self.logger.info(f"   {job.name}: {job.cron.expression} → 下次 {job.next_run:%Y-%m-%d %H:%M}")
+
+        try:
+            while not self._stop.is_set():
+                now = datetime.now()
+                for job in self.jobs.values():
+                    if job.next_run <= now:
+                        # 先推进下次时间，任务运行得再久也不会在同一分钟内重复触发
+                        job.next_run = job.cron.next_after(now)
+                        self._submit(job, reason="定时触发")
+                next_run = min(job.next_run for job in self.jobs.values())
+                self._stop.wait(min(max((next_run - datetime.now()).total_seconds(), 0.1), MAX_SLEEP_SECONDS))
+        finally:
+            self.logger.info("🛑 调度守护进程停止，等待运行中的任务结束...")
+            self._executor.shutdown(wait=True)
+            if self._server:
+                self._server.shutdown()
+                self._server.server_close()
+        self.logger.info("✅ 调度守护进程已退出")
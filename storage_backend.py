@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储后端
+收集流程只通过StorageBackend接口访问数据库：初始化、批量写入小时和每日数据、统计、已入库查询。
+    mysql  - 现有的MySQL实现（mysql_db_utils）
+    sqlite - 内嵌SQLite（WAL模式），适合单机部署、本地基准测试和无服务器环境
+通过环境变量STORAGE_BACKEND选择，默认mysql。
+"""
+
+import os
+import sqlite3
+import threading
+from datetime import timedelta
+
+from location_index import lookup_locations
+from run_metrics import get_metrics
+from weather_rows import DB_BATCH_SIZE, build_daily_row, build_hourly_rows
+
+# 后端配置：后端类型、SQLite数据库文件路径
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'mysql')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'data/weather.db')
+
+
+class StorageBackend:
+    """存储后端接口，各方法的参数与返回值约定如下"""
+
+    name = None
+
+    def init(self):
+        """创建表结构（幂等）"""
+        raise NotImplementedError
+
+    def check(self):
+        """检查数据库是否可用，不可用时抛出异常"""
+        raise NotImplementedError
+
+    def save_locations_weather(self, items, csv_path=None, batch_size=None):
+        """批量保存多个地区的小时和每日数据
+
+        Args:
+            items: 可迭代对象，元素为 (location_id, location_name, hourly_data, daily_list)
+            csv_path: 城市CSV路径，用于查询省市信息
+            batch_size: 每批行数
+
+        Returns:
+            dict: hourly_new/hourly_updated/hourly_failed/daily_new/daily_updated/daily_failed 计数，
+                  以及 skipped（缺少省市信息而未保存的location_id列表）；
+                  *_failed为被隔离跳过的单行写入失败数，整批无法写入时抛出异常
+        """
+        raise NotImplementedError
+
+    def get_complete_location_dates(self, start_date, end_date, hours_per_day=24):
+        """返回日期范围内已完整入库的 {(location_id, 'YYYYMMDD')}"""
+        raise NotImplementedError
+
+    def get_location_date_coverage(self, start_date, end_date):
+        """返回日期范围内有数据的 {(location_id, 'YYYYMMDD'): (小时记录数, 是否有每日记录)}"""
+        raise NotImplementedError
+
+    def get_stats(self, location_name=None):
+        """返回 {'total_hourly', 'total_daily'}，指定城市时返回 target_*/other_* 计数"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MySQLBackend(StorageBackend):
+    """MySQL后端，直接委托给mysql_db_utils"""
+
+    name = 'mysql'
+
+    def init(self):
+        import mysql_db_utils
+        mysql_db_utils.init_mysql_database()
+
+    def check(self):
+        import mysql_db_utils
+        # 预热连接池，同时验证数据库可达
+        with mysql_db_utils.mysql_connection():
+            pass
+
+    def save_locations_weather(self, items, csv_path=None, batch_size=None):
+        import mysql_db_utils
+        return mysql_db_utils.save_locations_weather_mysql(items, csv_path, batch_size)
+
+    def get_complete_location_dates(self, start_date, end_date, hours_per_day=24):
+        import mysql_db_utils
+        return mysql_db_utils.get_complete_location_dates(start_date, end_date, hours_per_day)
+
+    def get_location_date_coverage(self, start_date, end_date):
+        import mysql_db_utils
+        return mysql_db_utils.get_location_date_coverage(start_date, end_date)
+
+    def get_stats(self, location_name=None):
+        import mysql_db_utils
+        return mysql_db_utils.get_mysql_stats(location_name)
+
+    def close(self):
+        import mysql_db_utils
+        mysql_db_utils.get_connection_pool().close_all()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hourly_weather (
+    location_id TEXT NOT NULL,
+    location_name TEXT,
+    province TEXT,
+    city TEXT,
+    datetime TEXT NOT NULL,
+    temp_celsius REAL,
+    humidity_percent REAL,
+    precip_mm REAL,
+    pressure_hpa REAL,
+    wind_scale TEXT,
+    wind_dir TEXT,
+    text TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (location_id, datetime)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_hourly_datetime ON hourly_weather(datetime);
+
+CREATE TABLE IF NOT EXISTS daily_weather (
+    location_id TEXT NOT NULL,
+    location_name TEXT,
+    province TEXT,
+    city TEXT,
+    date TEXT NOT NULL,
+    temp_min_celsius REAL,
+    temp_max_celsius REAL,
+    humidity_percent REAL,
+    precip_mm REAL,
+    pressure_hpa REAL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (location_id, date)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_daily_date ON daily_weather(date);
+
+CREATE TABLE IF NOT EXISTS weather_row_counts (
+    table_name TEXT NOT NULL,
+    location_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    location_name TEXT,
+    province TEXT,
+    row_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (table_name, location_id, date)
+) WITHOUT ROWID;
+"""
+
+SQLITE_HOURLY_UPSERT_SQL = """
+INSERT INTO hourly_weather
+(location_id, location_name, province, city, datetime, temp_celsius, humidity_percent, precip_mm, pressure_hpa,
+ wind_scale, wind_dir, text)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(location_id, datetime) DO UPDATE SET
+location_name = excluded.location_name,
+province = excluded.province,
+city = excluded.city,
+temp_celsius = excluded.temp_celsius,
+humidity_percent = excluded.humidity_percent,
+precip_mm = excluded.precip_mm,
+pressure_hpa = excluded.pressure_hpa,
+wind_scale = excluded.wind_scale,
+wind_dir = excluded.wind_dir,
+text = excluded.text
+"""
+
+SQLITE_DAILY_UPSERT_SQL = """
+INSERT INTO daily_weather
+(location_id, location_name, province, city, date, temp_min_celsius, temp_max_celsius,
+ humidity_percent, precip_mm, pressure_hpa)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(location_id, date) DO UPDATE SET
+location_name = excluded.location_name,
+province = excluded.province,
+city = excluded.city,
+temp_min_celsius = excluded.temp_min_celsius,
+temp_max_celsius = excluded.temp_max_celsius,
+humidity_percent = excluded.humidity_percent,
+precip_mm = excluded.precip_mm,
+pressure_hpa = excluded.pressure_hpa
+"""
+
+SQLITE_ROW_COUNT_UPSERT_SQL = """
+INSERT INTO weather_row_counts (table_name, location_id, date, location_name, province, row_count)
+VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT(table_name, location_id, date) DO UPDATE SET
+location_name = excluded.location_name,
+province = excluded.province,
+row_count = row_count + excluded.row_count
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    """内嵌SQLite后端
+
+    - WAL模式：写入时读取不被阻塞，synchronous=NORMAL下每次提交不需要fsync主库文件
+    - 一次save_locations_weather在一个事务内完成，行数据用executemany按批写入
+    - 所有线程共用一个连接，写入由锁串行化（SQLite同一时刻只允许一个写事务）
+
+    Args:
+        path: 数据库文件路径，默认SQLITE_PATH；':memory:'表示内存数据库
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=None):
+        self.path = path or SQLITE_PATH
+        self._conn = None
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if self.path != ':memory:' and directory:
+                os.makedirs(directory, exist_ok=True)
+            # isolation_level=None：由代码显式BEGIN/COMMIT控制事务
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn = conn
+        return self._conn
+
+    def init(self):
+        with self._lock:
+            self._connection().executescript(SQLITE_SCHEMA)
+
+    def check(self):
+        with self._lock:
+            self._connection().execute("SELECT 1").fetchone()
+
+    def _existing_counts(self, cursor, table_name, rows):
+        """按 (location_id, 'YYYY-MM-DD') 统计一批行中已存在的行数，每组一次主键范围查询"""
+        keys = {}
+        for row in rows:
+            keys.setdefault((row[0], str(row[4])[:10]), set()).add(str(row[4]))
+        existing = {}
+        for (location_id, day), values in keys.items():
+            if table_name == 'hourly':
+                cursor.execute(
+                    "SELECT datetime FROM hourly_weather WHERE location_id = ? AND datetime >= ? AND datetime < ?",
+                    (location_id, day, day + '~')  # '~'大于日期后的任何时间字符，覆盖当天全部记录
+                )
+            else:
+                cursor.execute("SELECT date FROM daily_weather WHERE location_id = ? AND date = ?",
+                               (location_id, day))
+            count = sum(1 for (value,) in cursor.fetchall() if value in values)
+            if count:
+                existing[(location_id, day)] = count
+        return existing
+
+    def _upsert_rows(self, cursor, table_name, upsert_sql, rows, batch_size):
+        metrics = get_metrics()
+        existing = self._existing_counts(cursor, table_name, rows)
+        for start in range(0, len(rows), batch_size):
+            with metrics.timer('qweather_db_batch_seconds', backend='sqlite', table=table_name):
+                cursor.executemany(upsert_sql, rows[start:start + batch_size])
+
+        totals = {}
+        names = {}
+        for row in rows:
+            key = (row[0], str(row[4])[:10])
+            totals[key] = totals.get(key, 0) + 1
+            names[key] = (row[1], row[2])
+        increments = [(table_name, key[0], key[1], names[key][0], names[key][1], totals[key] - existing.get(key, 0))
+                      for key in sorted(totals) if totals[key] > existing.get(key, 0)]
+        if increments:
+            cursor.executemany(SQLITE_ROW_COUNT_UPSERT_SQL, increments)
+        existing_total = sum(existing.values())
+        return (len(rows) - existing_total, existing_total)
+
+    def save_locations_weather(self, items, csv_path=None, batch_size=None):
+        items = list(items)
+        batch_size = max(1, int(batch_size or DB_BATCH_SIZE))
+        metrics = get_metrics()
+        with metrics.timer('qweather_stage_seconds', stage='location_lookup'):
+            location_infos = lookup_locations([item[0] for item in items], csv_path)
+
+        hourly_rows = []
+        daily_rows = []
+        skipped = []
+        with metrics.timer('qweather_stage_seconds', stage='build_rows'):
+            for location_id, location_name, hourly_data, daily_list in items:
+                location_info = location_infos.get(location_id)
+                if not location_info:
+                    print(f"⚠️  未找到location_id '{location_id}' 对应的省市信息，跳过{location_name}")
+                    skipped.append(location_id)
+                    continue
+                province = location_info['province']
+                city = location_info['city']
+                if hourly_data:
+                    hourly_rows.extend(build_hourly_rows(hourly_data, location_id, location_name, province, city))
+                for record in daily_list or []:
+                    daily_rows.append(build_daily_row(record, location_id, location_name, province, city))
+
+        result = {'hourly_new': 0, 'hourly_updated': 0, 'hourly_failed': 0,
+                  'daily_new': 0, 'daily_updated': 0, 'daily_failed': 0, 'skipped': skipped}
+        if not hourly_rows and not daily_rows:
+            return result
+
+        with metrics.timer('qweather_stage_seconds', stage='db_write'), self._lock:
+            conn = self._connection()
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                if hourly_rows:
+                    result['hourly_new'], result['hourly_updated'] = self._upsert_rows(
+                        cursor, 'hourly', SQLITE_HOURLY_UPSERT_SQL, hourly_rows, batch_size)
+                if daily_rows:
+                    result['daily_new'], result['daily_updated'] = self._upsert_rows(
+                        cursor, 'daily', SQLITE_DAILY_UPSERT_SQL, daily_rows, batch_size)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                metrics.inc('qweather_db_batch_errors_total', backend='sqlite', table='all')
+                raise
+            finally:
+                cursor.close()
+        # 整个事务提交后才计入写入行数
+        for table_name in ('hourly', 'daily'):
+            metrics.inc('qweather_rows_written_total', result[f'{table_name}_new'], table=table_name, kind='new')
+            metrics.inc('qweather_rows_written_total', result[f'{table_name}_updated'], table=table_name, kind='updated')
+        return result
+
+    def get_complete_location_dates(self, start_date, end_date, hours_per_day=24):
+        query = """
+        SELECT h.location_id, h.day
+        FROM (
+            SELECT location_id, substr(datetime, 1, 10) AS day, COUNT(*) AS hour_count
+            FROM hourly_weather
+            WHERE datetime >= ? AND datetime < ?
+            GROUP BY location_id, day
+            HAVING hour_count >= ?
+        ) h
+        JOIN daily_weather d ON d.location_id = h.location_id AND d.date = h.day
+        """
+        end_exclusive = end_date + timedelta(days=1)
+        with self._lock:
+            rows = self._connection().execute(
+                query, (start_date.strftime('%Y-%m-%d'), end_exclusive.strftime('%Y-%m-%d'), hours_per_day)
+            ).fetchall()
+        return {(location_id, day.replace('-', '')) for location_id, day in rows}
+
+    def get_location_date_coverage(self, start_date, end_date):
+        hourly_query = """
+        SELECT location_id, substr(datetime, 1, 10) AS day, COUNT(*)
+        FROM hourly_weather
+        WHERE datetime >= ? AND datetime < ?
+        GROUP BY location_id, day
+        """
+        daily_query = "SELECT location_id, date FROM daily_weather WHERE date >= ? AND date <= ?"
+        end_exclusive = end_date + timedelta(days=1)
+        with self._lock:
+            conn = self._connection()
+            hourly_rows = conn.execute(
+                hourly_query, (start_date.strftime('%Y-%m-%d'), end_exclusive.strftime('%Y-%m-%d'))
+            ).fetchall()
+            daily_rows = conn.execute(
+                daily_query, (start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+            ).fetchall()
+        coverage = {(location_id, day.replace('-', '')): (hour_count, False)
+                    for location_id, day, hour_count in hourly_rows}
+        for location_id, day in daily_rows:
+            key = (location_id, day.replace('-', ''))
+            coverage[key] = (coverage.get(key, (0, False))[0], True)
+        return coverage
+
+    def get_stats(self, location_name=None):
+        count_sql = "SELECT COALESCE(SUM(row_count), 0) FROM weather_row_counts WHERE table_name = ?"
+        try:
+            with self._lock:
+                conn = self._connection()
+                total_hourly = conn.execute(count_sql, ('hourly',)).fetchone()[0]
+                total_daily = conn.execute(count_sql, ('daily',)).fetchone()[0]
+                if not location_name:
+                    return {'total_hourly': total_hourly, 'total_daily': total_daily}
+                target_sql = count_sql + " AND location_name = ?"
+                target_hourly = conn.execute(target_sql, ('hourly', location_name)).fetchone()[0]
+                target_daily = conn.execute(target_sql, ('daily', location_name)).fetchone()[0]
+        except Exception as e:
+            print(f"❌ 获取统计信息失败: {e}")
+            return None
+        return {
+            'target_hourly': target_hourly,
+            'target_daily': target_daily,
+            'other_hourly': total_hourly - target_hourly,
+            'other_daily': total_daily - target_daily
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_BACKENDS = {
+    'mysql': MySQLBackend,
+    'sqlite': SQLiteBackend
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_storage_backend(name=None, **kwargs):
+    """按名称新建存储后端实例"""
+    name = name or STORAGE_BACKEND
+    if name not in _BACKENDS:
+        raise ValueError(f"不支持的存储后端: {name}（可选 {'/'.join(_BACKENDS)}）")
+    return _BACKENDS[name](**kwargs)
+
+
+def get_storage_backend():
+    """获取进程内共享的存储后端（懒加载，类型由STORAGE_BACKEND决定）"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_storage_backend()
+        return _backend
+
+
+def set_storage_backend(backend):
+    """替换进程内共享的存储后端（基准测试、嵌入使用时注入自定义实现），返回原来的后端"""
+    global _backend
+    with _backend_lock:
+        previous = _backend
+        _backend = backend
+        return previous
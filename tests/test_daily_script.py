@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""每日自动执行.py：重试队列、分片，以及入库失败时暂存区的处理"""
+
+import argparse
+import importlib
+import logging
+import os
+import threading
+
+import pytest
+
+import write_spool
+
+daily = importlib.import_module('每日自动执行')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的time.monotonic"""
+    now = [1000.0]
+    monkeypatch.setattr(daily.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_retry_queue_backoff_is_capped_and_jittered(clock):
+    retry = daily.RetryQueue(max_attempts=10, base_delay=1, max_delay=4)
+    location = ('101', '北京')
+    delays = []
+    for _ in range(5):
+        retry.record_attempt(location[0])
+        delays.append(retry.schedule(location))
+    for attempt, delay in enumerate(delays, start=1):
+        upper = min(4, 2 ** (attempt - 1))
+        assert upper * 0.5 <= delay <= upper
+
+
+def test_retry_queue_stops_after_max_attempts(clock):
+    retry = daily.RetryQueue(max_attempts=2, base_delay=1, max_delay=10)
+    location = ('101', '北京')
+    retry.record_attempt(location[0])
+    assert retry.schedule(location) is not None
+    retry.record_attempt(location[0])
+    assert retry.schedule(location) is None
+    assert retry.attempts(location[0]) == 2
+
+
+def test_retry_queue_pops_only_due_locations(clock):
+    retry = daily.RetryQueue(max_attempts=5, base_delay=10, max_delay=60)
+    first, second = ('101', '北京'), ('202', '上海')
+    retry.record_attempt(first[0])
+    first_delay = retry.schedule(first)
+    for _ in range(3):
+        retry.record_attempt(second[0])
+    retry.schedule(second)  # 第三次重试，间隔20~40秒
+    assert retry.pop_due() == []
+    assert retry.next_delay() == pytest.approx(first_delay)
+    clock[0] += 10
+    assert retry.pop_due() == [first]
+    clock[0] += 30
+    assert retry.pop_due() == [second]
+    assert len(retry) == 0 and retry.next_delay() is None
+
+
+@pytest.mark.parametrize('value, expected', [('0/1', (0, 1)), ('3/4', (3, 4))])
+def test_parse_shard_accepts_valid_values(value, expected):
+    assert daily.parse_shard(value) == expected
+
+
+@pytest.mark.parametrize('value', ['4/4', '-1/4', '0/0', '1', 'a/4', '1/2/3'])
+def test_parse_shard_rejects_invalid_values(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        daily.parse_shard(value)
+
+
+def test_apply_shard_partitions_every_location_exactly_once():
+    locations = [(str(101010100 + i), f"地区{i}") for i in range(200)]
+    logger = logging.getLogger('test')
+    shards = [daily.apply_shard(locations, (index, 4), logger) for index in range(4)]
+    assert sorted(location for shard in shards for location in shard) == sorted(locations)
+    assert daily.apply_shard(locations, None, logger) is locations
+
+
+class FakeBackend:
+    def __init__(self, error=None):
+        self.error = error
+
+    def init(self):
+        pass
+
+    def save_locations_weather(self, items, csv_path=None, batch_size=None):
+        if self.error:
+            raise self.error
+        return {'hourly_new': 1, 'hourly_updated': 0, 'daily_new': 1, 'daily_updated': 0,
+                'hourly_failed': 0, 'daily_failed': 0, 'skipped': []}
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    spool = write_spool.WriteSpool(str(tmp_path))
+    monkeypatch.setattr(daily, 'WRITE_SPOOL', True)
+    monkeypatch.setattr(write_spool, '_shared_spool', spool)
+    return spool
+
+
+HOURLY = [{'location_id': '101010100', 'location_name': '北京', 'fxTime': '2024-01-01T00:00+08:00'}]
+DAILY = [{'location_id': '101010100', 'location_name': '北京', 'fxDate': '2024-01-01'}]
+
+
+def test_failed_save_keeps_data_in_spool(spool, monkeypatch, tmp_path):
+    backend = FakeBackend(ConnectionError('MySQL server has gone away'))
+    monkeypatch.setattr(daily, 'get_storage_backend', lambda: backend)
+    assert daily.save_weather_data_to_db(HOURLY, DAILY, logging.getLogger('test'), 'cities.csv') is False
+    pending = spool.pending()
+    assert len(pending) == 1
+    items, csv_path = spool.read(pending[0])
+    assert csv_path == 'cities.csv'
+    assert items == [('101010100', '北京', HOURLY, DAILY)]
+    assert os.listdir(tmp_path) == [os.path.basename(pending[0])]
+
+
+def test_successful_save_commits_spool_segment(spool, monkeypatch, tmp_path):
+    monkeypatch.setattr(daily, 'get_storage_backend', lambda: FakeBackend())
+    assert daily.save_weather_data_to_db(HOURLY, DAILY, logging.getLogger('test'), 'cities.csv') is True
+    assert os.listdir(tmp_path) == []
+
+
+def test_spool_commit_error_after_successful_save_is_not_a_failure(spool, monkeypatch):
+    monkeypatch.setattr(daily, 'get_storage_backend', lambda: FakeBackend())
+
+    def broken_commit(path):
+        raise OSError('Read-only file system')
+
+    monkeypatch.setattr(spool, 'commit', broken_commit)
+    released = []
+    monkeypatch.setattr(spool, 'release', released.append)
+    assert daily.save_weather_data_to_db(HOURLY, DAILY, logging.getLogger('test'), 'cities.csv') is True
+    assert released == []  # 已入库的段不能放回待回放，否则会重复写入
+
+
+def test_spool_release_error_does_not_escape(spool, monkeypatch):
+    monkeypatch.setattr(daily, 'get_storage_backend', lambda: FakeBackend(ConnectionError('gone away')))
+
+    def broken_release(path):
+        raise OSError('Read-only file system')
+
+    monkeypatch.setattr(spool, 'release', broken_release)
+    assert daily.save_weather_data_to_db(HOURLY, DAILY, logging.getLogger('test'), 'cities.csv') is False
+
+
+def test_pipeline_stops_writers_and_closes_client_when_fetch_fails(monkeypatch):
+    closed = []
+
+    class FakeClient:
+        def __init__(self, pool_size=None):
+            pass
+
+        def close(self):
+            closed.append(True)
+
+    saved = []
+
+    class RecordingBackend(FakeBackend):
+        def save_locations_weather(self, items, csv_path=None, batch_size=None):
+            saved.extend(item[0] for item in items)
+            return super().save_locations_weather(items, csv_path, batch_size)
+
+    def failing_fetch(token, locations, date_str, logger, on_success, on_done=None, **kwargs):
+        on_success('101010100', '北京', HOURLY, DAILY)
+        raise RuntimeError('fetch crashed')
+
+    monkeypatch.setattr(daily, 'WRITE_SPOOL', False)
+    monkeypatch.setattr(daily, 'QWeatherClient', FakeClient)
+    monkeypatch.setattr(daily, 'get_storage_backend', lambda: RecordingBackend())
+    monkeypatch.setattr(daily, 'fetch_locations', failing_fetch)
+    with pytest.raises(RuntimeError):
+        daily.run_streaming_pipeline(None, logging.getLogger('test'), date_str='20240101',
+                                     locations=[('101010100', '北京')], writers=2, csv_path='cities.csv')
+    assert closed == [True]
+    assert saved == ['101010100']  # 出错前已入队的数据照常写完
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith('db-writer-')]
+
+
+def test_fetch_all_closes_own_client_when_fetch_fails(monkeypatch):
+    closed = []
+
+    class FakeClient:
+        def __init__(self, pool_size=None):
+            pass
+
+        def close(self):
+            closed.append(True)
+
+    def failing_fetch(*args, **kwargs):
+        raise RuntimeError('fetch crashed')
+
+    monkeypatch.setattr(daily, 'QWeatherClient', FakeClient)
+    monkeypatch.setattr(daily, 'fetch_locations', failing_fetch)
+    with pytest.raises(RuntimeError):
+        daily.get_today_weather_data(None, logging.getLogger('test'), locations=[('101010100', '北京')])
+    assert closed == [True]
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""mysql_db_utils 中不依赖数据库连接的部分：连接池、二分拆批、计数表增量、死锁重试"""
+
+import threading
+import time
+from datetime import date
+
+import pymysql
+import pytest
+
+import mysql_db_utils
+
+
+def _rows(*location_ids):
+    return [(location_id, f"地区{location_id}", '省', None, '2024-01-01 00:00:00') for location_id in location_ids]
+
+
+@pytest.fixture
+def upsert_calls(monkeypatch):
+    """把_upsert_batch换成假实现：含location_id为'bad'的批次抛出DataError，其余全部记为新增"""
+    calls = []
+
+    def fake_upsert_batch(conn, upsert_sql, rows, count_existing, table_name, prepare=None):
+        calls.append(list(rows))
+        if any(row[0] == 'bad' for row in rows):
+            raise pymysql.err.DataError(1406, 'Data too long')
+        return (len(rows), 0)
+
+    monkeypatch.setattr(mysql_db_utils, '_upsert_batch', fake_upsert_batch)
+    return calls
+
+
+def test_bisect_isolates_bad_row(upsert_calls):
+    rows = _rows('1', '2', '3', 'bad', '5', '6', '7', '8')
+    result = mysql_db_utils._upsert_with_bisect(None, '', rows, None, 'hourly_weather', '小时')
+    assert result == (7, 0, 1)
+
+
+def test_save_rows_in_batches_sums_failed_rows(upsert_calls):
+    rows = _rows('1', 'bad', '3', '4', 'bad', '6')
+    result = mysql_db_utils._save_rows_in_batches(None, '', rows, None, 'daily_weather', 3, '每日')
+    assert result == (4, 0, 2)
+
+
+def test_bisect_reraises_connection_loss(monkeypatch):
+    calls = []
+
+    def lost_connection(conn, upsert_sql, rows, count_existing, table_name, prepare=None):
+        calls.append(list(rows))
+        raise pymysql.err.OperationalError(2013, 'Lost connection to MySQL server during query')
+
+    monkeypatch.setattr(mysql_db_utils, '_upsert_batch', lost_connection)
+    with pytest.raises(pymysql.err.OperationalError):
+        mysql_db_utils._upsert_with_bisect(None, '', _rows('1', '2', '3', '4'), None, 'hourly_weather', '小时')
+    assert len(calls) == 1  # 不拆批，整批视为未写入
+
+
+def test_row_count_increments_groups_by_location_and_date():
+    rows = [
+        ('101', '北京', '北京市', None, '2024-01-01 00:00:00'),
+        ('101', '北京', '北京市', None, '2024-01-01 01:00:00'),
+        ('101', '北京', '北京市', None, '2024-01-02 00:00:00'),
+        ('202', '上海', '上海市', None, '2024-01-01 00:00:00'),
+    ]
+    increments = mysql_db_utils._row_count_increments('hourly_weather', rows, {('101', '2024-01-01'): 1})
+    assert increments == [
+        ('hourly_weather', '101', '2024-01-01', '北京', '北京市', 1),
+        ('hourly_weather', '101', '2024-01-02', '北京', '北京市', 1),
+        ('hourly_weather', '202', '2024-01-01', '上海', '上海市', 1),
+    ]
+
+
+def test_row_count_increments_skips_groups_without_new_rows():
+    rows = [('101', '北京', '北京市', None, '2024-01-01')] * 2
+    assert mysql_db_utils._row_count_increments('daily_weather', rows, {('101', '2024-01-01'): 2}) == []
+
+
+class FakeConnection:
+    def __init__(self):
+        self.open = True
+        self.server_status = 0
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        if not self.open:
+            raise pymysql.err.OperationalError(2006, 'MySQL server has gone away')
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+        self.closed = True
+
+
+def _pool(**kwargs):
+    created = []
+
+    def connect():
+        conn = FakeConnection()
+        created.append(conn)
+        return conn
+
+    return mysql_db_utils.MySQLConnectionPool(connect=connect, **kwargs), created
+
+
+def test_pool_reuses_released_connection():
+    pool, created = _pool(size=2, recycle=0, timeout=1)
+    with pool.connection() as first:
+        pass
+    with pool.connection() as second:
+        assert second is first
+    assert len(created) == 1
+
+
+def test_pool_times_out_when_exhausted():
+    pool, _ = _pool(size=1, recycle=0, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+
+
+def test_pool_waiter_wakes_when_connection_is_discarded():
+    pool, created = _pool(size=1, recycle=0, timeout=5)
+    conn = pool.acquire()
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    conn.open = False  # 数据库重启：归还时连接已断开，被丢弃而不是放回空闲列表
+    pool.release(conn)
+    waiter.join(timeout=2)
+    assert not waiter.is_alive()
+    assert conn.closed
+    assert acquired == [created[1]]
+
+
+def test_pool_discards_expired_connection():
+    pool, created = _pool(size=1, recycle=0.01, timeout=1)
+    conn = pool.acquire()
+    time.sleep(0.02)
+    pool.release(conn)
+    assert conn.closed
+    assert pool.acquire() is created[1]
+
+
+class ScriptedCursor:
+    """按顺序返回预设的SELECT结果；executemany调用时可按预设抛出异常"""
+
+    def __init__(self, selects, upsert_errors=()):
+        self.selects = list(selects)
+        self.upsert_errors = list(upsert_errors)
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        self._result = self.selects.pop(0)
+
+    def fetchall(self):
+        return self._result
+
+    def executemany(self, sql, params):
+        self.executed.append(sql)
+        if sql is not mysql_db_utils.ROW_COUNT_UPSERT_SQL and self.upsert_errors:
+            raise self.upsert_errors.pop(0)
+
+    def close(self):
+        pass
+
+
+class ScriptedConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+DAILY_ROWS = [('101', '北京', '北京市', None, '2024-01-01'), ('101', '北京', '北京市', None, '2024-01-02')]
+
+
+def test_existing_rows_are_read_with_locks():
+    cursor = ScriptedCursor([[('101', date(2024, 1, 1))]])
+    conn = ScriptedConnection(cursor)
+    result = mysql_db_utils._upsert_batch(conn, 'UPSERT', DAILY_ROWS, mysql_db_utils._count_existing_daily, 'daily')
+    assert result == (1, 1)
+    assert cursor.executed[0].rstrip().endswith('FOR UPDATE')
+
+
+def test_deadlocked_batch_is_retried(monkeypatch):
+    monkeypatch.setattr(mysql_db_utils.time, 'sleep', lambda seconds: None)
+    deadlock = pymysql.err.OperationalError(1213, 'Deadlock found when trying to get lock')
+    # 第一次被回滚前读到0行；重试时另一个事务已提交了第一天的数据
+    cursor = ScriptedCursor([[], [('101', date(2024, 1, 1))]], upsert_errors=[deadlock])
+    conn = ScriptedConnection(cursor)
+    result = mysql_db_utils._upsert_batch(conn, 'UPSERT', DAILY_ROWS, mysql_db_utils._count_existing_daily, 'daily')
+    assert result == (1, 1)
+    assert conn.rollbacks == 1 and conn.commits == 1
+
+
+def test_deadlock_retries_are_bounded(monkeypatch):
+    monkeypatch.setattr(mysql_db_utils.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(mysql_db_utils, 'DB_DEADLOCK_RETRIES', 1)
+    deadlocks = [pymysql.err.OperationalError(1213, 'Deadlock') for _ in range(2)]
+    cursor = ScriptedCursor([[], []], upsert_errors=deadlocks)
+    with pytest.raises(pymysql.err.OperationalError):
+        mysql_db_utils._upsert_batch(ScriptedConnection(cursor), 'UPSERT', DAILY_ROWS,
+                                     mysql_db_utils._count_existing_daily, 'daily')
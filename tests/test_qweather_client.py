@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""qweather_client：Token被拒绝后的重放"""
+
+from qweather_auth import TokenManager
+from qweather_client import QWeatherClient
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+    def close(self):
+        pass
+
+
+class FakeTokenManager(TokenManager):
+    def __init__(self):
+        self.tokens = ['old', 'new']
+
+    def get(self):
+        return self.tokens[0]
+
+    def invalidate(self, token):
+        if token == self.tokens[0]:
+            self.tokens.pop(0)
+        return self.tokens[0]
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+def test_auth_replay_acquires_rate_limiter_token(monkeypatch):
+    client = QWeatherClient(token=FakeTokenManager())
+    sent = []
+
+    def fake_get(location_id, date_str, bearer):
+        sent.append(bearer)
+        return FakeResponse(401 if bearer == 'old' else 200)
+
+    monkeypatch.setattr(client, '_get_historical', fake_get)
+    limiter = CountingLimiter()
+    response = client.get_historical_weather('101010100', '20240101', rate_limiter=limiter)
+    assert response.status_code == 200
+    assert sent == ['old', 'new']
+    assert limiter.acquired == 1  # 第一次请求的令牌由调用方获取，重放时再取一个
+    client.close()
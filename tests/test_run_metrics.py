@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""run_metrics：注册表、按任务隔离的指标与运行报告"""
+
+import json
+import threading
+from datetime import datetime
+
+import run_metrics
+from run_metrics import MetricsRegistry, bind_metrics, get_metrics, use_metrics, write_run_report
+
+
+def test_registry_counters_gauges_and_histograms():
+    registry = MetricsRegistry()
+    registry.inc('qweather_requests_total', result='ok')
+    registry.inc('qweather_requests_total', 2, result='ok')
+    registry.set_gauge('qweather_locations', 5, status='success')
+    registry.observe('qweather_request_seconds', 0.2)
+    assert registry.value('qweather_requests_total', result='ok') == 3
+    assert registry.value('qweather_locations', status='success') == 5
+    metrics, _ = registry.snapshot()
+    assert metrics['qweather_request_seconds'][0]['value']['count'] == 1
+
+
+def test_job_registry_is_isolated_and_forwards_with_job_label(monkeypatch):
+    process = MetricsRegistry()
+    monkeypatch.setattr(run_metrics, '_metrics', process)
+    registries = {name: MetricsRegistry(parent=process, parent_labels={'job': name}) for name in ('a', 'b')}
+    both_started = threading.Barrier(2)
+
+    def job(name, requests):
+        with use_metrics(registries[name]):
+            def worker():
+                get_metrics().inc('qweather_requests_total', result='ok')
+            both_started.wait()
+            threads = [threading.Thread(target=bind_metrics(worker)) for _ in range(requests)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            get_metrics().set_gauge('qweather_locations', requests, status='success')
+
+    jobs = [threading.Thread(target=job, args=('a', 3)), threading.Thread(target=job, args=('b', 5))]
+    for thread in jobs:
+        thread.start()
+    for thread in jobs:
+        thread.join()
+
+    assert registries['a'].value('qweather_requests_total', result='ok') == 3
+    assert registries['b'].value('qweather_requests_total', result='ok') == 5
+    assert registries['a'].value('qweather_locations', status='success') == 3
+    assert process.value('qweather_requests_total', result='ok', job='b') == 5
+    assert process.value('qweather_locations', status='success', job='a') == 3
+    assert get_metrics() is process
+
+
+def test_repeated_job_reports_keep_unchanged_gauges(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_metrics, 'RUN_METRICS', True)
+    process = MetricsRegistry()
+    for run in range(2):
+        registry = MetricsRegistry(parent=process, parent_labels={'job': 'nightly'})
+        registry.set_gauge('qweather_locations', 10, status='success')
+        started_at = datetime(2024, 1, 1 + run, 6, 0)
+        report_path, textfile_path = write_run_report('daily', 0, started_at, report_dir=str(tmp_path),
+                                                      textfile_dir=str(tmp_path), job='nightly', registry=registry)
+    with open(report_path, encoding='utf-8') as f:
+        report = json.load(f)
+    assert report['job'] == 'nightly'
+    assert report['metrics']['qweather_locations'] == [{'labels': {'status': 'success'}, 'value': 10}]
+    with open(textfile_path, encoding='utf-8') as f:
+        assert 'qweather_locations{status="success",job="nightly"} 10' in f.read()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""scheduler_daemon：cron表达式与任务配置"""
+
+import json
+from datetime import datetime
+
+import pytest
+
+from scheduler_daemon import CronExpression, load_jobs
+
+
+@pytest.mark.parametrize('expression, moment, expected', [
+    ('*/15 * * * *', datetime(2024, 1, 1, 10, 7, 30), datetime(2024, 1, 1, 10, 15)),
+    ('0 6 * * *', datetime(2024, 1, 1, 6, 0), datetime(2024, 1, 2, 6, 0)),
+    ('30 2 * * 1-5', datetime(2024, 1, 5, 3, 0), datetime(2024, 1, 8, 2, 30)),  # 周五之后是下周一
+    ('0 0 * * 7', datetime(2024, 1, 1, 0, 0), datetime(2024, 1, 7, 0, 0)),  # 7与0都表示周日
+    ('0 0 1 * *', datetime(2024, 1, 31, 23, 59), datetime(2024, 2, 1, 0, 0)),
+    ('0 0 29 2 *', datetime(2024, 3, 1), datetime(2028, 2, 29, 0, 0)),
+    ('@hourly', datetime(2024, 12, 31, 23, 30), datetime(2025, 1, 1, 0, 0)),
+    ('5/20 * * * *', datetime(2024, 1, 1, 0, 26), datetime(2024, 1, 1, 0, 45)),
+])
+def test_next_after(expression, moment, expected):
+    assert CronExpression(expression).next_after(moment) == expected
+
+
+def test_day_and_weekday_match_either():
+    # 每月13日或每周五
+    cron = CronExpression('0 0 13 * 5')
+    assert cron.next_after(datetime(2024, 1, 1)) == datetime(2024, 1, 5)
+    assert cron.next_after(datetime(2024, 1, 12, 1)) == datetime(2024, 1, 13)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '* 24 * * *', '0 0 0 * *', '*/0 * * * *', 'x * * * *'])
+def test_invalid_expression(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+def test_impossible_date_raises():
+    with pytest.raises(ValueError):
+        CronExpression('0 0 31 2 *').next_after(datetime(2024, 1, 1))
+
+
+def _write_config(tmp_path, jobs):
+    path = tmp_path / 'scheduler.json'
+    path.write_text(json.dumps({'jobs': jobs}), encoding='utf-8')
+    return str(path)
+
+
+def test_load_jobs(tmp_path):
+    path = _write_config(tmp_path, [{'name': 'daily', 'cron': '0 6 * * *', 'args': ['--date', 'today']}])
+    jobs = load_jobs(path)
+    assert [(job.name, job.cron.expression, job.args) for job in jobs] == [('daily', '0 6 * * *', ['--date', 'today'])]
+
+
+@pytest.mark.parametrize('jobs', [
+    [],
+    [{'name': 'daily'}],
+    [{'name': 'daily', 'cron': '@daily'}, {'name': 'daily', 'cron': '@hourly'}],
+    [{'name': 'daily', 'cron': '0 25 * * *'}],
+])
+def test_load_jobs_rejects_invalid_config(tmp_path, jobs):
+    with pytest.raises(ValueError):
+        load_jobs(_write_config(tmp_path, jobs))
+
+
+def test_load_jobs_validates_args(tmp_path):
+    def validate(args):
+        if args:
+            raise ValueError(f"未知参数: {args[0]}")
+
+    path = _write_config(tmp_path, [{'name': 'daily', 'cron': '@daily', 'args': ['--bogus']}])
+    with pytest.raises(ValueError, match='daily'):
+        load_jobs(path, validate=validate)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""write_spool：段文件的认领、提交、放回与回放"""
+
+import os
+
+import pytest
+
+import write_spool
+from write_spool import CLAIM_MARK, WriteSpool, replay_pending
+
+ITEMS = [
+    ('101010100', '北京', [{'fxTime': '2024-01-01T00:00+08:00', 'temp': '1'}], [{'fxDate': '2024-01-01'}]),
+    ('101020100', '上海', [], [{'fxDate': '2024-01-01'}]),
+]
+
+
+class FakeBackend:
+    """save_locations_weather按预设结果返回或抛出异常，并记录收到的items"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.saved = []
+
+    def save_locations_weather(self, items, csv_path=None, batch_size=None):
+        if self.error:
+            raise self.error
+        self.saved.append(list(items))
+        return {'hourly_new': 1, 'hourly_updated': 0, 'daily_new': 2, 'daily_updated': 0,
+                'hourly_failed': 0, 'daily_failed': 0, 'skipped': []}
+
+
+@pytest.fixture
+def spool(tmp_path):
+    return WriteSpool(str(tmp_path))
+
+
+def test_written_segment_is_claimed_until_released(spool):
+    segment = spool.write(ITEMS, 'cities.csv')
+    assert segment.endswith(f"{CLAIM_MARK}{os.getpid()}")
+    assert spool.pending() == []
+    pending_path = spool.release(segment)
+    assert spool.pending() == [pending_path]
+    items, csv_path = spool.read(pending_path)
+    assert csv_path == 'cities.csv'
+    assert [item[0] for item in items] == ['101010100', '101020100']
+
+
+def test_commit_removes_segment(spool):
+    segment = spool.write(ITEMS)
+    spool.commit(segment)
+    assert not os.path.exists(segment)
+    assert spool.pending() == []
+    spool.commit(segment)  # 重复提交（已被手动清理）不报错
+
+
+def test_claim_is_exclusive(spool):
+    pending_path = spool.release(spool.write(ITEMS))
+    claimed_path = spool.claim(pending_path)
+    assert claimed_path is not None
+    assert spool.claim(pending_path) is None
+    assert spool.pending() == []
+
+
+def test_segment_claimed_by_dead_process_is_pending_again(spool, monkeypatch):
+    pending_path = spool.release(spool.write(ITEMS))
+    orphan_path = f"{pending_path}{CLAIM_MARK}999999"
+    os.rename(pending_path, orphan_path)
+    monkeypatch.setattr(write_spool, '_pid_alive', lambda pid: pid != 999999)
+    assert spool.pending() == [orphan_path]
+
+
+def test_replay_keeps_segments_when_database_fails(spool):
+    first = spool.release(spool.write(ITEMS))
+    second = spool.release(spool.write(ITEMS))
+    result = replay_pending(FakeBackend(ConnectionError('MySQL server has gone away')), spool)
+    assert result['replayed'] == 0
+    assert result['remaining'] == 2
+    assert result['error'] == 'MySQL server has gone away'
+    assert spool.pending() == [first, second]
+
+
+def test_replay_commits_each_segment_once(spool):
+    spool.release(spool.write(ITEMS))
+    spool.release(spool.write(ITEMS[:1]))
+    backend = FakeBackend()
+    result = replay_pending(backend, spool)
+    assert result['replayed'] == 2
+    assert result['locations'] == 3
+    assert result['daily_new'] == 4
+    assert spool.pending() == []
+    assert replay_pending(backend, spool)['replayed'] == 0
+    assert len(backend.saved) == 2
+
+
+def test_replay_only_given_segments(spool):
+    own = spool.release(spool.write(ITEMS))
+    other = spool.release(spool.write(ITEMS))
+    result = replay_pending(FakeBackend(), spool, segments=[own])
+    assert result['replayed'] == 1
+    assert spool.pending() == [other]
+
+
+def test_replay_quarantines_corrupt_segment(spool):
+    corrupt = spool.release(spool.write(ITEMS))
+    with open(corrupt, 'wb') as f:
+        f.write(b'not gzip')
+    good = spool.release(spool.write(ITEMS))
+    result = replay_pending(FakeBackend(), spool)
+    assert result['replayed'] == 1
+    assert spool.pending() == []
+    assert os.path.exists(corrupt + '.corrupt')
+    assert not os.path.exists(good)
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+天气数据查询
+按地区列表、省份、城市查询时间范围内的数据，或查询每个地区最近N小时的数据。
+结果通过服务端游标分块读取，按列直接转换为NumPy数组或pandas DataFrame，
+并缓存在进程内的LRU+TTL结果缓存中，写入方提交数据后按日期使相关缓存失效。
+失效通知只在写入数据的同一进程内生效：其他进程（如调度守护进程、另一个读取程序）写入的数据，
+要等缓存条目超过QUERY_CACHE_TTL过期后才能读到，对实时性有要求时调小QUERY_CACHE_TTL或传入use_cache=False。
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+
+import pymysql
+
+import mysql_db_utils
+
+# 查询配置：结果缓存条数、缓存有效期（秒）、服务端游标每次读取的行数
+QUERY_CACHE_SIZE = int(os.getenv('QUERY_CACHE_SIZE', '128'))
+QUERY_CACHE_TTL = float(os.getenv('QUERY_CACHE_TTL', '300'))
+QUERY_FETCH_SIZE = int(os.getenv('QUERY_FETCH_SIZE', '5000'))
+
+# 列定义：(列名, SELECT表达式, 类型)，类型为 float / datetime / date / str
+# DECIMAL列加0E0转为DOUBLE，pymysql直接返回float，不再逐行构造Decimal对象
+HOURLY_COLUMNS = (
+    ('location_id', 'location_id', 'str'),
+    ('location_name', 'location_name', 'str'),
+    ('province', 'province', 'str'),
+    ('city', 'city', 'str'),
+    ('datetime', 'datetime', 'datetime'),
+    ('temp_celsius', 'temp_celsius + 0E0', 'float'),
+    ('humidity_percent', 'humidity_percent + 0E0', 'float'),
+    ('precip_mm', 'precip_mm + 0E0', 'float'),
+    ('pressure_hpa', 'pressure_hpa + 0E0', 'float'),
+    ('wind_scale', 'wind_scale', 'str'),
+    ('wind_dir', 'wind_dir', 'str'),
+    ('text', 'text', 'str'),
+)
+
+DAILY_COLUMNS = (
+    ('location_id', 'location_id', 'str'),
+    ('location_name', 'location_name', 'str'),
+    ('province', 'province', 'str'),
+    ('city', 'city', 'str'),
+    ('date', 'date', 'date'),
+    ('temp_min_celsius', 'temp_min_celsius + 0E0', 'float'),
+    ('temp_max_celsius', 'temp_max_celsius + 0E0', 'float'),
+    ('humidity_percent', 'humidity_percent + 0E0', 'float'),
+    ('precip_mm', 'precip_mm + 0E0', 'float'),
+    ('pressure_hpa', 'pressure_hpa + 0E0', 'float'),
+)
+
+
+class QueryCache:
+    """线程安全的LRU+TTL结果缓存
+
+    每个条目记录所依赖的表和日期范围，写入方提交数据后调用invalidate，
+    只淘汰日期范围与写入日期有交集的条目。日期范围为None的条目（如最近N小时）
+    在该表有任何写入时都会被淘汰。失效只对本进程内的写入生效，其他进程的写入依靠TTL过期。
+
+    查询开始前用generation()记下失效代数，put时代数已变化（查询期间发生过写入）则不缓存，
+    避免写入前开始的查询把旧结果放回缓存。
+
+    Args:
+        maxsize: 最多缓存的结果数，<=0表示不缓存
+        ttl: 条目有效期（秒），<=0表示不按时间过期
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = QUERY_CACHE_SIZE if maxsize is None else maxsize
+        self.ttl = QUERY_CACHE_TTL if ttl is None else ttl
+        self._entries = OrderedDict()  # key -> (写入时间, 表名, 起始日期, 结束日期, 结果)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if self.ttl > 0 and time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[4]
+
+    def generation(self):
+        """当前的失效代数，每次invalidate加1"""
+        with self._lock:
+            return self._generation
+
+    def put(self, key, table_name, start_date, end_date, value, generation=None):
+        """缓存结果；generation为查询开始前的generation()，之后发生过失效时不缓存"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic(), table_name, start_date, end_date, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, table_name, dates=None):
+        """淘汰依赖table_name且日期范围包含dates中任一日期的条目，dates为None时淘汰该表的全部条目"""
+        if dates is not None:
+            dates = {date.fromisoformat(day) if isinstance(day, str) else day for day in dates}
+        with self._lock:
+            self._generation += 1
+            for key, (_, entry_table, start_date, end_date, _) in list(self._entries.items()):
+                if entry_table != table_name:
+                    continue
+                if dates is None or start_date is None or any(start_date <= day <= end_date for day in dates):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = QueryCache()
+mysql_db_utils.add_write_listener(_cache.invalidate)
+
+
+def get_query_cache():
+    """返回进程内共享的结果缓存（可查看hits/misses或手动clear）"""
+    return _cache
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, str):
+        return datetime.strptime(value.replace('-', ''), '%Y%m%d').date()
+    return value
+
+
+def _fetch_columns(sql, params, columns):
+    """用服务端游标分块读取结果，按列收集后转换为NumPy数组（只读）"""
+    import numpy as np
+
+    values = [[] for _ in columns]
+    with mysql_db_utils.mysql_connection() as conn:
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(sql, params)
+            while True:
+                chunk = cursor.fetchmany(QUERY_FETCH_SIZE)
+                if not chunk:
+                    break
+                for column_values, chunk_values in zip(values, zip(*chunk)):
+                    column_values.extend(chunk_values)
+        finally:
+            cursor.close()
+
+    result = {}
+    for (name, _, kind), column_values in zip(columns, values):
+        if kind == 'float':
+            array = np.array(column_values, dtype=np.float64)  # NULL转为NaN
+        elif kind == 'datetime':
+            array = np.array(column_values, dtype='datetime64[s]')
+        elif kind == 'date':
+            array = np.array(column_values, dtype='datetime64[D]')
+        else:
+            array = np.array(column_values, dtype=object)
+        array.flags.writeable = False  # 结果会被缓存复用，禁止原地修改
+        result[name] = array
+    return result
+
+
+def _format_result(columns, output):
+    if output == 'numpy':
+        return columns
+    if output == 'pandas':
+        import pandas as pd
+        return pd.DataFrame(columns)
+    raise ValueError(f"不支持的输出格式: {output}（可选 numpy/pandas）")
+
+
+def _run_query(key, table_name, start_date, end_date, sql, params, columns, output, use_cache):
+    result = _cache.get(key) if use_cache else None
+    if result is None:
+        generation = _cache.generation()
+        result = _fetch_columns(sql, params, columns)
+        if use_cache:
+            _cache.put(key, table_name, start_date, end_date, result, generation)
+    return _format_result(result, output)
+
+
+def _range_query(table_name, filter_sql, filter_params, start_date, end_date, output, use_cache):
+    start_date = _to_date(start_date)
+    end_date = _to_date(end_date)
+    if start_date > end_date:
+        raise ValueError(f"开始日期{start_date}晚于结束日期{end_date}")
+
+    if table_name == 'hourly':
+        columns = HOURLY_COLUMNS
+        source = 'hourly_weather'
+        range_sql = "datetime >= %s AND datetime < %s"
+        order_by = "location_id, datetime"
+    else:
+        columns = DAILY_COLUMNS
+        source = 'daily_weather'
+        range_sql = "date >= %s AND date < %s"
+        order_by = "location_id, date"
+    select_sql = ', '.join(f"{expression} AS {name}" for name, expression, _ in columns)
+    where_sql = f"{range_sql} AND {filter_sql}" if filter_sql else range_sql
+    sql = f"SELECT {select_sql} FROM {source} WHERE {where_sql} ORDER BY {order_by}"
+    params = [start_date.strftime('%Y-%m-%d'), (end_date + timedelta(days=1)).strftime('%Y-%m-%d')]
+    params.extend(filter_params)
+
+    key = (table_name, filter_sql, tuple(filter_params), start_date, end_date)
+    return _run_query(key, table_name, start_date, end_date, sql, params, columns, output, use_cache)
+
+
+def _location_filter(location_ids):
+    location_ids = sorted({str(location_id).strip() for location_id in location_ids if location_id})
+    if not location_ids:
+        raise ValueError("location_ids不能为空")
+    return f"location_id IN ({', '.join(['%s'] * len(location_ids))})", location_ids
+
+
+def query_hourly_by_locations(location_ids, start_date, end_date, output='pandas', use_cache=True):
+    """查询指定地区在日期范围内（含两端）的小时数据
+
+    Args:
+        location_ids: location_id列表
+        start_date / end_date: datetime.date或'YYYY-MM-DD'/'YYYYMMDD'字符串
+        output: 'pandas' 返回DataFrame；'numpy' 返回 列名 -> 只读ndarray 的字典
+        use_cache: 是否使用结果缓存
+
+    Returns:
+        按 (location_id, datetime) 排序的结果
+    """
+    filter_sql, filter_params = _location_filter(location_ids)
+    return _range_query('hourly', filter_sql, filter_params, start_date, end_date, output, use_cache)
+
+
+def query_hourly_range(start_date, end_date, output='pandas', use_cache=True):
+    """查询所有地区在日期范围内的小时数据，参数与返回值同query_hourly_by_locations"""
+    return _range_query('hourly', None, [], start_date, end_date, output, use_cache)
+
+
+def query_hourly_by_province(province, start_date, end_date, output='pandas', use_cache=True):
+    """查询某省份所有地区在日期范围内的小时数据，参数与返回值同query_hourly_by_locations"""
+    return _range_query('hourly', "province = %s", [province], start_date, end_date, output, use_cache)
+
+
+def query_hourly_by_city(city, start_date, end_date, output='pandas', use_cache=True):
+    """查询某城市所有地区在日期范围内的小时数据，参数与返回值同query_hourly_by_locations"""
+    return _range_query('hourly', "city = %s", [city], start_date, end_date, output, use_cache)
+
+
+def query_daily_by_locations(location_ids, start_date, end_date, output='pandas', use_cache=True):
+    """查询指定地区在日期范围内的每日数据，参数与返回值同query_hourly_by_locations"""
+    filter_sql, filter_params = _location_filter(location_ids)
+    return _range_query('daily', filter_sql, filter_params, start_date, end_date, output, use_cache)
+
+
+def query_daily_range(start_date, end_date, output='pandas', use_cache=True):
+    """查询所有地区在日期范围内的每日数据，参数与返回值同query_hourly_by_locations"""
+    return _range_query('daily', None, [], start_date, end_date, output, use_cache)
+
+
+def query_latest_hours(location_ids, hours=24, output='pandas', use_cache=True):
+    """查询每个地区已入库的最近hours小时的数据（以各地区最新一条记录的时间为准）
+
+    Args:
+        location_ids: location_id列表
+        hours: 小时数
+        output / use_cache: 同query_hourly_by_locations
+    """
+    filter_sql, filter_params = _location_filter(location_ids)
+    hours = int(hours)
+    select_sql = ', '.join(f"{expression.replace(name, 'h.' + name, 1)} AS {name}"
+                           for name, expression, _ in HOURLY_COLUMNS)
+    # 先在存储表上按主键求每个地区的最新时间，再按 (location_id, datetime) 范围取数据
+    sql = f"""
+    SELECT {select_sql}
+    FROM hourly_weather h
+    JOIN (
+        SELECT location_id, MAX(datetime) AS latest
+        FROM {mysql_db_utils.hourly_storage_table()}
+        WHERE {filter_sql}
+        GROUP BY location_id
+    ) m ON h.location_id = m.location_id
+    WHERE h.datetime > m.latest - INTERVAL %s HOUR
+    ORDER BY h.location_id, h.datetime
+    """
+    params = list(filter_params) + [hours]
+    key = ('latest', tuple(filter_params), hours)
+    # 最近N小时依赖的日期不确定，有任何小时数据写入都会失效
+    return _run_query(key, 'hourly', None, None, sql, params, HOURLY_COLUMNS, output, use_cache)
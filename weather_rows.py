@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+API记录到数据库行的转换
+各存储后端共用同一套列顺序：
+    小时数据: (location_id, location_name, province, city, datetime, temp_celsius, humidity_percent,
+              precip_mm, pressure_hpa, wind_scale, wind_dir, text)
+    每日数据: (location_id, location_name, province, city, date, temp_min_celsius, temp_max_celsius,
+              humidity_percent, precip_mm, pressure_hpa)
+"""
+
+import os
+
+# 批量写入配置：每批写入的行数（每批一次往返、一次提交），各存储后端共用
+DB_BATCH_SIZE = int(os.getenv('DB_BATCH_SIZE', '500'))
+
+
+def convert_api_time(time_str):
+    """转换API时间格式：从 "2025-07-21T00:00+08:00" 到 "2025-07-21 00:00"（去掉时区信息）"""
+    if 'T' in time_str:
+        return time_str.split('T')[0] + ' ' + time_str.split('T')[1].split('+')[0]
+    return time_str
+
+def build_hourly_rows(hourly_data, location_id, location_name, province, city):
+    """把API返回的小时记录转换为小时数据行元组，无法转换的记录会被跳过"""
+    rows = []
+    for hour_data in hourly_data:
+        try:
+            # 准备数据 - 根据API实际返回的字段名
+            rows.append((
+                location_id,
+                location_name,
+                province,  # 使用动态省市信息
+                city,      # 使用动态省市信息
+                convert_api_time(hour_data['time']),  # 转换后的时间格式
+                hour_data.get('temp'),
+                hour_data.get('humidity'),
+                hour_data.get('precip', 0.0),  # 处理None值
+                hour_data.get('pressure'),
+                hour_data.get('windScale'),  # 使用windScale而不是windSpeed
+                hour_data.get('windDir'),
+                hour_data.get('text')   # 天气现象描述
+            ))
+        except Exception as e:
+            print(f"⚠️  {location_name}小时数据格式错误: {e}")
+    return rows
+
+def build_daily_row(weather_daily_data, location_id, location_name, province, city):
+    """把API返回的weatherDaily记录转换为每日数据行元组"""
+    return (
+        location_id,
+        location_name,
+        province,
+        city,
+        weather_daily_data.get('date'),  # 日期
+        weather_daily_data.get('tempMin'),  # 最低温度
+        weather_daily_data.get('tempMax'),  # 最高温度
+        weather_daily_data.get('humidity'),  # 湿度
+        weather_daily_data.get('precip', '0.0'),  # 降水量
+        weather_daily_data.get('pressure')  # 气压
+    )
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地写入暂存区（write-behind spool）
+获取到的每一批数据在写入数据库之前，先写成一个压缩的JSONL段文件：
+    <WRITE_SPOOL_DIR>/seg-<时间>-<进程号>-<序号>.jsonl.gz
+数据库提交成功后删除该段；数据库不可用时段文件保留在磁盘上，
+恢复后由replay_pending批量回放，获取和入库互不阻塞，已获取的数据不会因为数据库故障而丢失。
+正在入库或回放的段改名为 <段文件>.claimed-<进程号> 由该进程独占，
+多个分片或调度任务共用同一暂存目录时，同一段不会被同时写入两次。
+"""
+
+import gzip
+import itertools
+import json
+import os
+import threading
+from datetime import datetime
+
+from run_metrics import get_metrics
+
+# 暂存配置：是否启用（默认关闭，需要时设置WRITE_SPOOL=1开启）、暂存目录
+WRITE_SPOOL = os.getenv('WRITE_SPOOL', '0') == '1'
+WRITE_SPOOL_DIR = os.getenv('WRITE_SPOOL_DIR', 'data/spool')
+
+SEGMENT_SUFFIX = '.jsonl.gz'
+CLAIM_MARK = '.claimed-'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _unclaimed_path(path):
+    """段文件的原始路径（去掉认领后缀）"""
+    return path.split(CLAIM_MARK, 1)[0]
+
+
+class WriteSpool:
+    """线程安全的本地暂存区
+
+    每个段文件只写一次（先写临时文件、fsync后原子改名），之后只会被整体回放和删除。
+    write返回的段由本进程认领，入库成功后commit删除，失败时release放回待回放；
+    进程退出时仍处于认领状态的段，在pending中重新出现。
+    第一行是段头（csv_path等元信息），其余每行一个地区：
+    {"location_id": ..., "location_name": ..., "hourly": [...], "daily": [...]}
+
+    Args:
+        root: 暂存目录，默认WRITE_SPOOL_DIR
+    """
+
+    def __init__(self, root=None):
+        self.root = root or WRITE_SPOOL_DIR
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def write(self, items, csv_path=None):
+        """把一批 (location_id, location_name, hourly_data, daily_list) 持久化为一个段，返回已认领的段文件路径"""
+        os.makedirs(self.root, exist_ok=True)
+        with self._lock:
+            seq = next(self._seq)
+        name = f"seg-{datetime.now():%Y%m%d%H%M%S%f}-{os.getpid()}-{seq:06d}{SEGMENT_SUFFIX}"
+        path = os.path.join(self.root, name)
+        tmp_path = path + '.tmp'
+        # 压缩级别1：暂存在入库的关键路径上，优先速度
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=1) as f:
+            f.write(json.dumps({'csv_path': csv_path, 'created_at': datetime.now().isoformat(timespec='seconds')},
+                               ensure_ascii=False) + "\n")
+            for location_id, location_name, hourly_data, daily_list in items:
+                f.write(json.dumps({'location_id': location_id, 'location_name': location_name,
+                                    'hourly': hourly_data or [], 'daily': daily_list or []},
+                                   ensure_ascii=False) + "\n")
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        claimed_path = f"{path}{CLAIM_MARK}{os.getpid()}"
+        os.replace(tmp_path, claimed_path)
+        get_metrics().inc('qweather_spool_segments_total', event='written')
+        return claimed_path
+
+    def claim(self, path):
+        """原子改名认领一个待回放的段，返回认领后的路径；已被其他进程认领或删除时返回None"""
+        claimed_path = f"{_unclaimed_path(path)}{CLAIM_MARK}{os.getpid()}"
+        if path == claimed_path:
+            return path
+        try:
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            return None
+        return claimed_path
+
+    def release(self, path):
+        """入库失败，放回待回放状态，返回段文件的原始路径"""
+        pending_path = _unclaimed_path(path)
+        os.replace(path, pending_path)
+        return pending_path
+
+    def commit(self, path):
+        """段中的数据已提交到数据库，删除段文件"""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # 已被手动清理
+        get_metrics().inc('qweather_spool_segments_total', event='committed')
+
+    def pending(self):
+        """返回尚未入库的段文件路径（按写入时间排序），包括认领进程已退出的段"""
+        if not os.path.isdir(self.root):
+            return []
+        paths = []
+        for name in os.listdir(self.root):
+            if name.endswith(SEGMENT_SUFFIX):
+                paths.append(os.path.join(self.root, name))
+                continue
+            base, mark, pid = name.partition(CLAIM_MARK)
+            if mark and base.endswith(SEGMENT_SUFFIX) and pid.isdigit() and not _pid_alive(int(pid)):
+                paths.append(os.path.join(self.root, name))
+        return sorted(paths)
+
+    def read(self, path):
+        """读取一个段，返回 (items, csv_path)"""
+        items = []
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            for line in f:
+                record = json.loads(line)
+                items.append((record['location_id'], record['location_name'], record['hourly'], record['daily']))
+        return items, header.get('csv_path')
+
+    def stats(self):
+        """返回 {'segments': 段数, 'bytes': 总大小}"""
+        segments = self.pending()
+        total = 0
+        for path in segments:
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                continue
+        return {'segments': len(segments), 'bytes': total}
+
+
+def replay_pending(backend, spool=None, logger=None, csv_path=None, on_replayed=None, segments=None):
+    """把暂存区中的段按写入顺序批量写入数据库，每段提交成功后删除
+
+    每段先原子改名认领再读取，多个进程同时回放时每段只由一个进程写入，计数表不会重复累加。
+    遇到数据库错误时停止回放（数据库大概率仍不可用），剩余的段留待下次。
+
+    Args:
+        backend: StorageBackend
+        spool: WriteSpool，默认按WRITE_SPOOL_DIR新建
+        logger: 可选的日志对象
+        csv_path: 段头中没有记录CSV路径时使用的城市CSV
+        on_replayed: 可选回调，每段提交成功后以 (段路径, items, save_locations_weather的结果) 调用
+        segments: 只回放这些段（如本次运行暂存的段），默认回放全部待入库的段
+
+    Returns:
+        dict: replayed（回放成功的段数）、remaining（剩余段数）、locations、
+              hourly_new/hourly_updated/daily_new/daily_updated/failed_rows，以及error（停止回放的原因，没有则为None）
+    """
+    spool = spool or WriteSpool()
+    log = logger.info if logger else print
+    warn = logger.warning if logger else print
+    result = {'replayed': 0, 'remaining': 0, 'locations': 0, 'hourly_new': 0, 'hourly_updated': 0,
+              'daily_new': 0, 'daily_updated': 0, 'failed_rows': 0, 'error': None}
+    segments = spool.pending() if segments is None else list(segments)
+    if segments:
+        log(f"📦 回放本地暂存区的{len(segments)}个段: {spool.root}")
+    for index, path in enumerate(segments):
+        claimed_path = spool.claim(path)
+        if claimed_path is None:
+            continue  # 已被其他进程认领或回放
+        try:
+            items, segment_csv_path = spool.read(claimed_path)
+        except (OSError, EOFError, ValueError) as e:
+            # 损坏的段不会自行恢复，改名隔离，避免每次回放都卡在这里
+            corrupt_path = _unclaimed_path(path) + '.corrupt'
+            os.replace(claimed_path, corrupt_path)
+            warn(f"⚠️ 暂存段损坏，已隔离为 {corrupt_path}: {e}")
+            continue
+        try:
+            saved = backend.save_locations_weather(items, segment_csv_path or csv_path)
+        except Exception as e:
+            spool.release(claimed_path)
+            result['error'] = str(e)
+            result['remaining'] = len(segments) - index
+            warn(f"⚠️ 暂存区回放中止（数据库仍不可用？）: {e}，剩余{result['remaining']}个段")
+            break
+        spool.commit(claimed_path)
+        get_metrics().inc('qweather_spool_segments_total', event='replayed')
+        if on_replayed:
+            on_replayed(path, items, saved)
+        result['replayed'] += 1
+        result['locations'] += len(items) - len(saved['skipped'])
+        for key in ('hourly_new', 'hourly_updated', 'daily_new', 'daily_updated'):
+            result[key] += saved[key]
+        result['failed_rows'] += saved['hourly_failed'] + saved['daily_failed']
+    if result['replayed']:
+        log(f"✅ 暂存区回放完成: {result['replayed']}个段，{result['locations']}个地区，"
+            f"小时数据新增{result['hourly_new']}条/更新{result['hourly_updated']}条，"
+            f"每日数据新增{result['daily_new']}条/更新{result['daily_updated']}条")
+    if result['failed_rows']:
+        warn(f"⚠️ 回放中{result['failed_rows']}条记录写入失败被跳过（数据错误）")
+    get_metrics().set_gauge('qweather_spool_pending_segments', len(spool.pending()))
+    return result
+
+
+_shared_spool = None
+_shared_spool_lock = threading.Lock()
+
+
+def get_write_spool():
+    """获取进程内共享的暂存区（懒加载）"""
+    global _shared_spool
+    with _shared_spool_lock:
+        if _shared_spool is None:
+            _shared_spool = WriteSpool()
+        return _shared_spool